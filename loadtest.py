@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+13Store Metaverse — Bot-swarm load generator
+
+Starts N headless clients speaking the same protocol as NetworkManager.js
+(join, 20 Hz move, chat, whiteboard, world_edit) against a local server
+and reports snapshot jitter, move-to-visible latency, bandwidth per client
+and server CPU. Results are saved under loadtest_results/ so runs against
+different commits can be compared:
+
+    python loadtest.py --clients 200 --pattern crowd
+    python loadtest.py --clients 200 --pattern crowd --compare latest
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import websockets
+
+ROOT_DIR = Path(__file__).parent.resolve()
+RESULTS_DIR = ROOT_DIR / 'loadtest_results'
+
+# Binary wire format (must match online_server.py / NetworkManager.js)
+WIRE_PROTOCOL = 'bin1'
+POS_SCALE = 64
+RY_SCALE = 32768 / math.pi
+MSG_STATE = 1
+MSG_MOVE = 2
+STATE_HEADER = struct.Struct('<BIIIdHH')   # kind, seq, base, tick, server ms, players, gone
+PLAYER_RECORD = np.dtype([('id', '<u4'), ('x', '<i2'), ('y', '<i2'), ('z', '<i2'), ('ry', '<i2'), ('anim', 'u1')])
+MOVE_RECORD = struct.Struct('<BhhhhBII')   # kind, x, y, z, ry, anim, ack, move seq
+ANIM_STATES = ['idle', 'walk', 'run', 'jump', 'wave', 'dance', 'sit']
+
+MOVE_RATE = 20           # Hz, like NetworkManager.startSendLoop
+SPEED = 4.0              # world units per second
+SAMPLE_LIMIT = 200_000   # latency / interval samples kept (reservoir)
+PATTERNS = ('walk', 'circle', 'crowd', 'idle')
+WB_COLORS = ('#ffffff', '#e2001a', '#42a5f5', '#66bb6a')
+WORLD_OBJECTS = ('cube', 'sphere', 'cylinder', 'cone')
+
+
+def quantize(v):
+    """Snap to the wire's 1/64 grid so sent and observed positions compare exactly."""
+    return round(v * POS_SCALE) / POS_SCALE
+
+
+class Reservoir:
+    """Uniform sample of at most `limit` values from an unbounded stream."""
+    def __init__(self, limit=SAMPLE_LIMIT):
+        self.limit = limit
+        self.values = []
+        self.seen = 0
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.limit:
+            self.values.append(value)
+        else:
+            i = random.randrange(self.seen)
+            if i < self.limit:
+                self.values[i] = value
+
+    def percentiles(self, *qs):
+        if not self.values:
+            return [None] * len(qs)
+        return [round(float(v), 3) for v in np.percentile(self.values, qs)]
+
+
+class Swarm:
+    """Shared measurement state for every bot in this process."""
+    def __init__(self, args):
+        self.args = args
+        self.sent = {}                  # player id -> {(qx, qz): perf_counter when sent}
+        self.latency_ms = Reservoir()   # move sent -> seen in someone's state frame
+        self.interval_ms = Reservoir()  # gap between consecutive state frames per bot
+        self.measuring = False
+        self.bots = []
+        self.errors = 0
+
+    def record_sent(self, pid, x, z, now):
+        positions = self.sent.setdefault(pid, {})
+        positions[(x, z)] = now
+        if len(positions) > 4 * MOVE_RATE:  # ~4 s of history is plenty
+            for key in list(positions)[:MOVE_RATE]:
+                del positions[key]
+
+    def record_seen(self, pid, x, z, now):
+        sent_at = self.sent.get(pid, {}).get((x, z))
+        if sent_at is not None and self.measuring:
+            self.latency_ms.add((now - sent_at) * 1000)
+
+
+class Bot:
+    def __init__(self, swarm, index):
+        self.swarm = swarm
+        self.args = swarm.args
+        self.index = index
+        self.pid = None
+        self.ws = None
+        self.ack = 0
+        self.move_seq = 0
+        self.known = {}          # player id -> [x, z] from state frames
+        self.last_frame = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames = 0
+        spread = self.args.spread
+        self.x = random.uniform(-spread, spread)
+        self.z = random.uniform(-spread, spread)
+        self.heading = random.uniform(0, 2 * math.pi)
+        self.phase = random.uniform(0, 2 * math.pi)
+        self.stroke = 0
+        # Background tab: reports itself hidden, stands still and, like a
+        # throttled browser timer, sends a move once a second
+        self.hidden = index < self.args.clients * self.args.hidden
+
+    async def run(self, url, stop):
+        binary = self.args.binary
+        try:
+            async with websockets.connect(url, max_size=2 ** 22) as ws:
+                self.ws = ws
+                await self.send({
+                    'type': 'join', 'name': f'bot{self.index}', 'color': 0x42a5f5,
+                    'room': self.args.room, 'topics': self.topics(),
+                    **({'proto': WIRE_PROTOCOL} if binary else {})
+                })
+                reader = asyncio.create_task(self.read())
+                try:
+                    await self.act(stop)
+                finally:
+                    reader.cancel()
+        except (OSError, websockets.exceptions.WebSocketException):
+            self.swarm.errors += 1
+
+    def topics(self):
+        """What NetworkManager.js subscribes to, plus the whiteboard if this bot draws."""
+        return ['chat', 'world'] + (['whiteboard'] if self.args.whiteboard_rate > 0 else [])
+
+    async def send(self, message):
+        payload = message if isinstance(message, bytes) else json.dumps(message)
+        self.bytes_out += len(payload)
+        await self.ws.send(payload)
+
+    async def read(self):
+        async for message in self.ws:
+            now = time.perf_counter()
+            self.bytes_in += len(message)
+            if isinstance(message, bytes):
+                self.on_binary_state(message, now)
+                continue
+            data = json.loads(message)
+            for data in data['messages'] if data.get('type') == 'batch' else [data]:
+                self.on_message(data, now)
+
+    def on_message(self, data, now):
+        kind = data.get('type')
+        if kind == 'welcome':
+            self.pid = data['id']
+            self.x, self.z = data['you']['x'], data['you']['z']
+        elif kind == 'state':
+            self.on_frame(data['seq'], now)
+            for p in data['players']:
+                pos = self.known.setdefault(p['id'], [None, None])
+                if 'x' in p:
+                    pos[0] = p['x']
+                if 'z' in p:
+                    pos[1] = p['z']
+                if pos[0] is not None and pos[1] is not None:
+                    self.swarm.record_seen(p['id'], quantize(pos[0]), quantize(pos[1]), now)
+
+    def on_binary_state(self, message, now):
+        if message[0] != MSG_STATE:
+            return
+        _, seq, _, _, _, count, _ = STATE_HEADER.unpack_from(message)
+        self.on_frame(seq, now)
+        records = np.frombuffer(message, PLAYER_RECORD, count, STATE_HEADER.size)
+        for pid, x, z in zip(records['id'].tolist(), records['x'].tolist(), records['z'].tolist()):
+            self.swarm.record_seen(str(pid), x / POS_SCALE, z / POS_SCALE, now)
+
+    def on_frame(self, seq, now):
+        self.ack = seq
+        if self.last_frame is not None and self.swarm.measuring:
+            self.frames += 1
+            self.swarm.interval_ms.add((now - self.last_frame) * 1000)
+        self.last_frame = now
+
+    def step(self, dt, t):
+        """Advance the bot along its movement pattern."""
+        pattern, spread = self.args.pattern, self.args.spread
+        if pattern == 'walk':
+            self.heading += random.uniform(-0.3, 0.3)
+            if math.hypot(self.x, self.z) > spread:
+                self.heading = math.atan2(-self.z, -self.x)  # turn back towards the middle
+            self.x += math.cos(self.heading) * SPEED * dt
+            self.z += math.sin(self.heading) * SPEED * dt
+        elif pattern == 'circle':
+            r = spread * (0.2 + 0.8 * (self.index % 10) / 10)
+            a = self.phase + t * SPEED / r
+            self.x, self.z = r * math.cos(a), r * math.sin(a)
+        elif pattern == 'crowd':
+            # Everyone converges on one spot, then mills around it
+            d = math.hypot(self.x, self.z)
+            if d > 3:
+                self.x -= self.x / d * SPEED * dt
+                self.z -= self.z / d * SPEED * dt
+            else:
+                self.x += random.uniform(-1, 1) * SPEED * dt
+                self.z += random.uniform(-1, 1) * SPEED * dt
+
+    async def act(self, stop):
+        """20 Hz moves plus occasional chat, whiteboard strokes and world edits."""
+        args = self.args
+        period = 1 / MOVE_RATE
+        next_at = time.perf_counter() + random.uniform(0, period)
+        started = next_at
+        while not stop.is_set():
+            await asyncio.sleep(max(0, next_at - time.perf_counter()))
+            now = time.perf_counter()
+            next_at += period
+            if self.pid is None:
+                continue
+            if self.hidden:
+                await self.idle()
+                next_at = time.perf_counter() + 1
+                continue
+            self.step(period, now - started)
+            x, z = quantize(self.x), quantize(self.z)
+            anim = 'idle' if args.pattern == 'idle' else 'walk'
+            self.move_seq += 1
+            if args.binary:
+                await self.send(MOVE_RECORD.pack(MSG_MOVE, round(x * POS_SCALE), 0, round(z * POS_SCALE), 0,
+                                                 ANIM_STATES.index(anim), self.ack, self.move_seq))
+            else:
+                await self.send({'type': 'move', 'x': x, 'y': 0, 'z': z, 'ry': 0, 'anim': anim,
+                                 'ack': self.ack, 'seq': self.move_seq})
+            self.swarm.record_sent(self.pid, x, z, now)
+
+            if random.random() < args.chat_rate * period:
+                await self.send({'type': 'chat', 'message': f'hello from bot{self.index}'})
+            if random.random() < args.whiteboard_rate * period:
+                await self.send_stroke()
+            if random.random() < args.world_edit_rate * period:
+                await self.send({'type': 'world_edit', 'action': 'spawn', 'data': {
+                    'type': random.choice(WORLD_OBJECTS), 'ref': self.index,
+                    'pos': {'x': self.x, 'y': 0.5, 'z': self.z},
+                }})
+
+    async def idle(self):
+        """One background-tab beat: say we're hidden (once), then a move that changes nothing."""
+        if self.move_seq == 0:
+            await self.send({'type': 'presence', 'hidden': True})
+        self.move_seq += 1
+        x, z = quantize(self.x), quantize(self.z)
+        if self.args.binary:
+            await self.send(MOVE_RECORD.pack(MSG_MOVE, round(x * POS_SCALE), 0, round(z * POS_SCALE), 0,
+                                             ANIM_STATES.index('idle'), self.ack, self.move_seq))
+        else:
+            await self.send({'type': 'move', 'x': x, 'y': 0, 'z': z, 'ry': 0, 'anim': 'idle',
+                             'ack': self.ack, 'seq': self.move_seq})
+
+    async def send_stroke(self):
+        x, y = random.randrange(1200), random.randrange(700)
+        points = [x, y]
+        for _ in range(random.randint(5, 30)):
+            x = min(1199, max(0, x + random.randint(-15, 15)))
+            y = min(699, max(0, y + random.randint(-15, 15)))
+            points += [x, y]
+        await self.send({'type': 'whiteboard', 'data': {
+            'type': 'stroke', 'color': random.choice(WB_COLORS), 'size': 4, 'points': points,
+        }})
+
+
+# ─── Server process ──────────────────────────────────────────
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return True
+        time.sleep(0.1)
+    return False
+
+
+def start_server(args, scratch):
+    """Run online_server.py on args.port with its world files in a scratch dir."""
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        WORKERS=str(args.workers),
+        WORLD_SNAPSHOT_PATH=str(Path(scratch) / 'world.json'),
+        WORLD_LOG_PATH=str(Path(scratch) / 'world.log'),
+        SESSION_SECRET='loadtest',
+        ROOM_CAPACITY=str(max(args.clients, 100)),
+        STATS_INTERVAL='3600',
+    )
+    proc = subprocess.Popen([sys.executable, str(ROOT_DIR / 'online_server.py')], env=env,
+                            stdout=subprocess.DEVNULL if not args.verbose else None)
+    if not wait_for_port(args.port):
+        proc.terminate()
+        raise SystemExit('server did not start')
+    return proc
+
+
+def process_tree_cpu(root_pid):
+    """User+system CPU seconds of a process and its descendants, from /proc (Linux only)."""
+    tick = os.sysconf('SC_CLK_TCK')
+    parent, cpu = {}, {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        parent[int(entry)] = int(fields[1])
+        cpu[int(entry)] = (int(fields[11]) + int(fields[12])) / tick
+    total, stack = 0.0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += cpu.get(pid, 0.0)
+        stack.extend(p for p, pp in parent.items() if pp == pid)
+    return total
+
+
+def fetch_json(url):
+    # Stats routes are admin-only: send ADMIN_TOKEN if set (a server this
+    # script starts inherits it), else rely on the request being local
+    request = urllib.request.Request(url)
+    if os.environ.get('ADMIN_TOKEN'):
+        request.add_header('Authorization', f"Bearer {os.environ['ADMIN_TOKEN']}")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            return json.loads(resp.read())
+    except (OSError, ValueError):
+        return None
+
+
+# ─── Run ─────────────────────────────────────────────────────
+async def run(args, server_pid):
+    url = args.url or f'ws://127.0.0.1:{args.port}'
+    swarm = Swarm(args)
+    stop = asyncio.Event()
+    tasks = []
+
+    # Join ramp: args.ramp_rate clients per second
+    print(f"  [🤖] Ramping {args.clients} bots at {args.ramp_rate}/s ({args.pattern}, "
+          f"{'binary' if args.binary else 'json'})")
+    for i in range(args.clients):
+        bot = Bot(swarm, i)
+        swarm.bots.append(bot)
+        tasks.append(asyncio.create_task(bot.run(url, stop)))
+        await asyncio.sleep(1 / args.ramp_rate)
+    await asyncio.sleep(args.warmup)
+
+    # Measurement window
+    for bot in swarm.bots:
+        bot.bytes_in = bot.bytes_out = bot.frames = 0
+    cpu0 = process_tree_cpu(server_pid) if server_pid else None
+    own0 = time.process_time()
+    t0 = time.perf_counter()
+    swarm.measuring = True
+    await asyncio.sleep(args.duration)
+    swarm.measuring = False
+    elapsed = time.perf_counter() - t0
+    cpu1 = process_tree_cpu(server_pid) if server_pid else None
+    own1 = time.process_time()
+
+    http_base = url.replace('ws://', 'http://').replace('wss://', 'https://')
+    stats = await asyncio.to_thread(fetch_json, f'{http_base}/api/stats')
+    conns = await asyncio.to_thread(fetch_json, f'{http_base}/api/connections')
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    connected = [b for b in swarm.bots if b.pid is not None and not b.hidden]
+    hidden = [b for b in swarm.bots if b.pid is not None and b.hidden]
+    n = max(1, len(connected))
+    lat50, lat99 = swarm.latency_ms.percentiles(50, 99)
+    int50, int99 = swarm.interval_ms.percentiles(50, 99)
+    intervals = np.array(swarm.interval_ms.values) if swarm.interval_ms.values else None
+    return {
+        'connected': len(connected) + len(hidden),
+        'hidden': len(hidden),
+        'errors': swarm.errors,
+        'duration_s': round(elapsed, 2),
+        'move_to_visible_ms': {'p50': lat50, 'p99': lat99, 'samples': swarm.latency_ms.seen},
+        'snapshot_interval_ms': {
+            'p50': int50, 'p99': int99,
+            'jitter': round(float(intervals.std()), 3) if intervals is not None else None,
+        },
+        'bytes_in_per_client_s': round(sum(b.bytes_in for b in connected) / n / elapsed),
+        'bytes_out_per_client_s': round(sum(b.bytes_out for b in connected) / n / elapsed),
+        'bytes_in_per_hidden_client_s': (round(sum(b.bytes_in for b in hidden) / len(hidden) / elapsed)
+                                         if hidden else None),
+        'server_connections': (conns or {}).get('modes', {}),
+        'server_cpu_pct': round((cpu1 - cpu0) / elapsed * 100, 1) if cpu0 is not None else None,
+        'loadgen_cpu_pct': round((own1 - own0) / elapsed * 100, 1),
+        'server_ticks': {
+            key: {k: room['tick'][k] for k in ('overruns', 'skipped', 'max_tick_ms')}
+            for key, room in (stats or {}).get('rooms', {}).items()
+        },
+    }
+
+
+def git_revision():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return rev + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Headline numbers for --compare: (path in the result, lower is better)
+COMPARE_KEYS = (
+    ('move_to_visible_ms.p50', True),
+    ('move_to_visible_ms.p99', True),
+    ('snapshot_interval_ms.jitter', True),
+    ('snapshot_interval_ms.p99', True),
+    ('bytes_in_per_client_s', True),
+    ('bytes_out_per_client_s', True),
+    ('server_cpu_pct', True),
+    ('connected', False),
+)
+
+
+def lookup(result, path):
+    for key in path.split('.'):
+        result = (result or {}).get(key)
+    return result
+
+
+def compare(old, new):
+    print(f"\n  Compared with {old['revision']} ({old['started']}):")
+    for path, lower_better in COMPARE_KEYS:
+        a, b = lookup(old['results'], path), lookup(new['results'], path)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a * 100 if a else 0.0
+        better = (change < 0) == lower_better or change == 0
+        print(f"    {path:32} {a:>10} → {b:<10} {change:+6.1f}% {'✓' if better else '✗'}")
+
+
+def print_results(r):
+    lat, snap = r['move_to_visible_ms'], r['snapshot_interval_ms']
+    print()
+    print(f"  Connected           {r['connected']} ({r.get('hidden', 0)} hidden, {r['errors']} errors)")
+    print(f"  Move → visible      p50 {lat['p50']} ms, p99 {lat['p99']} ms ({lat['samples']} samples)")
+    print(f"  Snapshot interval   p50 {snap['p50']} ms, p99 {snap['p99']} ms, jitter (σ) {snap['jitter']} ms")
+    print(f"  Bytes/client/s      in {r['bytes_in_per_client_s']}, out {r['bytes_out_per_client_s']}")
+    if r.get('bytes_in_per_hidden_client_s') is not None:
+        print(f"  Hidden tabs         in {r['bytes_in_per_hidden_client_s']} bytes/client/s")
+    for mode, m in r.get('server_connections', {}).items():
+        print(f"  Server [{mode}]".ljust(22) + f"{m['connections']} connections, "
+              f"{m['bytes_per_s']} bytes/s and ~{m['memory']} bytes buffered each")
+    print(f"  Server CPU          {r['server_cpu_pct']}%   (load generator {r['loadgen_cpu_pct']}%)")
+    for key, t in r['server_ticks'].items():
+        print(f"  Ticks [{key}]".ljust(22) + f"{t['overruns']} overruns, {t['skipped']} skipped, max {t['max_tick_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds, after ramp + warmup')
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--ramp-rate', type=float, default=50, help='joins per second')
+    parser.add_argument('--pattern', choices=PATTERNS, default='walk')
+    parser.add_argument('--spread', type=float, default=60, help='radius bots start in / roam')
+    parser.add_argument('--hidden', type=float, default=0, help='fraction of bots acting as background tabs')
+    parser.add_argument('--json', dest='binary', action='store_false', help="use JSON moves/state instead of 'bin1'")
+    parser.add_argument('--chat-rate', type=float, default=0.05, help='chat messages per bot per second')
+    parser.add_argument('--whiteboard-rate', type=float, default=0.05, help='strokes per bot per second')
+    parser.add_argument('--world-edit-rate', type=float, default=0.01, help='world edits per bot per second')
+    parser.add_argument('--room', default='loadtest')
+    parser.add_argument('--url', help='test a running server instead of starting one')
+    parser.add_argument('--port', type=int, default=18765)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--label', default='', help='free-form note stored with the result')
+    parser.add_argument('--compare', help="earlier result file, or 'latest'")
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help="show the server's output")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        path = args.compare
+        if path == 'latest':
+            files = sorted(RESULTS_DIR.glob('*.json'))
+            path = files[-1] if files else None
+        if path:
+            previous = json.loads(Path(path).read_text())
+
+    started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with tempfile.TemporaryDirectory() as scratch:
+        proc = None if args.url else start_server(args, scratch)
+        try:
+            results = asyncio.run(run(args, proc.pid if proc else None))
+        finally:
+            if proc:
+                proc.terminate()
+                proc.wait()
+
+    record = {
+        'revision': git_revision(),
+        'started': started,
+        'label': args.label,
+        'config': {k: v for k, v in vars(args).items() if k not in ('compare', 'no_save', 'verbose')},
+        'results': results,
+    }
+    print_results(results)
+    if previous:
+        compare(previous, record)
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        out = RESULTS_DIR / f"{started.replace(':', '')}-{record['revision']}.json"
+        out.write_text(json.dumps(record, indent=2))
+        print(f"\n  [💾] Saved {out.relative_to(ROOT_DIR)}")
+
+
+if __name__ == '__main__':
+    main()
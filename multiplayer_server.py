@@ -4,9 +4,101 @@
 Handles player connections, position sync, and chat
 """
 import asyncio
+import atexit
 import json
+import logging
+import logging.handlers
+import math
+import os
+import queue
 import time
 import random
+import sys
+
+# Area of interest: players see others within VIEW_RADIUS, and keep seeing
+# them until they are VIEW_HYSTERESIS further away (avoids enter/exit flicker)
+VIEW_RADIUS = float(os.environ.get('VIEW_RADIUS', 40))
+VIEW_HYSTERESIS = float(os.environ.get('VIEW_HYSTERESIS', 8))
+
+# Join/leave/chat logging goes through a queue to a writer thread, so the
+# event loop never waits on stdout. LOG_FORMAT=json writes one object per line
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+
+class LogFormatter(logging.Formatter):
+    def format(self, record):
+        if LOG_FORMAT == 'json':
+            return json.dumps({'ts': round(record.created, 3), 'event': record.event, **record.fields,
+                               'msg': record.getMessage()}, ensure_ascii=False, default=str)
+        return f'  {record.getMessage()}'
+
+
+def _start_logging():
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(LogFormatter())
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger = logging.getLogger('metaverse')
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+_logger = _start_logging()
+
+
+def log(event, template, **fields):
+    """Queue a structured log record; same call shape as online_server.log."""
+    _logger.info(template.format(**fields), extra={'event': event, 'fields': fields})
+
+
+class InterestGrid:
+    """
+    Uniform spatial hash over the x/z plane.
+    Cells are as wide as the largest query radius, so the 3x3 block around
+    a point covers every candidate and lookups only touch local players.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cz) -> set of player ids
+        self.where = {}  # player id -> (cx, cz)
+
+    def _cell(self, x, z):
+        return (int(x // self.cell_size), int(z // self.cell_size))
+
+    def update(self, pid, x, z):
+        cell = self._cell(x, z)
+        old = self.where.get(pid)
+        if old == cell:
+            return
+        if old is not None:
+            self._discard(pid, old)
+        self.cells.setdefault(cell, set()).add(pid)
+        self.where[pid] = cell
+
+    def remove(self, pid):
+        old = self.where.pop(pid, None)
+        if old is not None:
+            self._discard(pid, old)
+
+    def _discard(self, pid, cell):
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.discard(pid)
+            if not bucket:
+                del self.cells[cell]
+
+    def nearby(self, x, z):
+        """Yield ids in the 3x3 cell block around (x, z)."""
+        cx, cz = self._cell(x, z)
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                bucket = self.cells.get((cx + dx, cz + dz))
+                if bucket:
+                    yield from bucket
 
 
 class GameServer:
@@ -14,6 +106,8 @@ class GameServer:
         self.players = {}  # id -> player state
         self.next_id = 1
         self.connections = {}  # id -> websocket
+        self.grid = InterestGrid(VIEW_RADIUS + VIEW_HYSTERESIS)
+        self.interest = {}  # id -> set of player ids that client currently sees
 
         # Avatar colors pool
         self.colors = [
@@ -55,37 +149,55 @@ class GameServer:
                         'ry': 0,
                         'anim': 'idle'
                     }
+                    me = self.players[player_id]
+                    self.grid.update(player_id, me['x'], me['z'])
+                    near = self._visible_from(player_id)
+                    self.interest[player_id] = near
 
                     # Send welcome with assigned ID
                     await websocket.send(json.dumps({
                         'type': 'welcome',
                         'id': player_id,
-                        'you': self.players[player_id]
+                        'you': me
                     }))
 
-                    # Send existing players list
+                    # Send players in the area of interest
                     await websocket.send(json.dumps({
                         'type': 'player_list',
-                        'players': list(self.players.values())
+                        'players': [me] + [self.players[i] for i in near]
                     }))
 
-                    # Notify others
+                    # Notify others; only nearby players spawn the avatar
+                    for pid in near:
+                        self.interest.setdefault(pid, set()).add(player_id)
+                    far = set(self.connections) - near - {player_id}
                     await self.broadcast({
                         'type': 'player_join',
-                        **self.players[player_id]
-                    }, exclude=player_id)
+                        **me,
+                        'visible': True
+                    }, only=near)
+                    await self.broadcast({
+                        'type': 'player_join',
+                        **me,
+                        'visible': False
+                    }, only=far)
 
                     player_count = len(self.players)
-                    print(f"[+] {self.players[player_id]['name']} joined (ID: {player_id}) — {player_count} online")
+                    log('join', '[+] {name} joined (ID: {player}) — {online} online',
+                        player=player_id, name=self.players[player_id]['name'], online=player_count)
 
                 elif msg_type == 'move' and player_id:
                     if player_id in self.players:
                         p = self.players[player_id]
-                        p['x'] = data.get('x', p['x'])
-                        p['y'] = data.get('y', p['y'])
-                        p['z'] = data.get('z', p['z'])
-                        p['ry'] = data.get('ry', p['ry'])
+                        for k in ('x', 'y', 'z', 'ry'):
+                            try:
+                                v = float(data.get(k, p[k]))
+                            except (TypeError, ValueError):
+                                continue
+                            if math.isfinite(v):
+                                p[k] = v
                         p['anim'] = data.get('anim', p['anim'])
+                        self.grid.update(player_id, p['x'], p['z'])
 
                 elif msg_type == 'appearance_update' and player_id:
                     if player_id in self.players:
@@ -108,44 +220,95 @@ class GameServer:
                             'message': msg_text,
                             'color': self.players[player_id].get('color', 0xffffff)
                         })
-                        print(f"[Chat] {self.players[player_id]['name']}: {msg_text}")
+                        log('chat', '[Chat] {name}: {message}', player=player_id,
+                            name=self.players[player_id]['name'], message=msg_text)
 
         except Exception as e:
-            print(f"[!] Connection error: {e}")
+            log('error', '[!] Connection error: {error}', player=player_id, error=str(e))
         finally:
             if player_id:
                 name = self.players.get(player_id, {}).get('name', 'Unknown')
-                self.players.pop(player_id, None)
-                self.connections.pop(player_id, None)
+                self._drop(player_id)
                 await self.broadcast({
                     'type': 'player_leave',
                     'id': player_id
                 })
                 player_count = len(self.players)
-                print(f"[-] {name} left — {player_count} online")
+                log('leave', '[-] {name} left — {online} online', player=player_id, name=name, online=player_count)
+
+    def _drop(self, pid):
+        """Forget a player everywhere: connection, state, grid and interest sets"""
+        self.players.pop(pid, None)
+        self.connections.pop(pid, None)
+        self.grid.remove(pid)
+        self.interest.pop(pid, None)
+        for seen in self.interest.values():
+            seen.discard(pid)
 
-    async def broadcast(self, message, exclude=None):
+    def _visible_from(self, pid):
+        """Ids of players inside pid's area of interest (with hysteresis)"""
+        me = self.players[pid]
+        x, z = me['x'], me['z']
+        enter_r2 = VIEW_RADIUS * VIEW_RADIUS
+        exit_r2 = (VIEW_RADIUS + VIEW_HYSTERESIS) ** 2
+        current = self.interest.get(pid, ())
+        visible = set()
+        for other in self.grid.nearby(x, z):
+            if other == pid:
+                continue
+            p = self.players.get(other)
+            if p is None:
+                continue
+            dx = p['x'] - x
+            dz = p['z'] - z
+            d2 = dx * dx + dz * dz
+            if d2 <= enter_r2 or (d2 <= exit_r2 and other in current):
+                visible.add(other)
+        return visible
+
+    async def broadcast(self, message, exclude=None, only=None):
         msg_str = json.dumps(message)
         disconnected = []
-        for pid, ws in self.connections.items():
-            if pid == exclude:
+        targets = self.connections if only is None else only
+        for pid in list(targets):
+            ws = self.connections.get(pid)
+            if ws is None or pid == exclude:
                 continue
             try:
                 await ws.send(msg_str)
             except Exception:
                 disconnected.append(pid)
         for pid in disconnected:
-            self.connections.pop(pid, None)
-            self.players.pop(pid, None)
+            self._drop(pid)
 
     async def state_broadcast_loop(self):
-        """Broadcast all player positions at 20 Hz"""
+        """Send every player the positions in their area of interest at 20 Hz"""
         while True:
-            if self.players:
-                await self.broadcast({
-                    'type': 'state',
-                    'players': list(self.players.values())
-                })
+            disconnected = []
+            for pid, ws in list(self.connections.items()):
+                if pid not in self.players:
+                    continue
+                visible = self._visible_from(pid)
+                known = self.interest.get(pid, set())
+                entered = visible - known
+                exited = known - visible
+                self.interest[pid] = visible
+                try:
+                    if entered or exited:
+                        await ws.send(json.dumps({
+                            'type': 'interest',
+                            'enter': [self.players[i] for i in entered],
+                            'exit': list(exited)
+                        }))
+                    if visible:
+                        await ws.send(json.dumps({
+                            'type': 'state',
+                            'players': [self.players[i] for i in visible if i in self.players]
+                        }))
+                except Exception:
+                    disconnected.append(pid)
+            for pid in disconnected:
+                self._drop(pid)
             await asyncio.sleep(0.05)  # 20 ticks/sec
 
 
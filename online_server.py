@@ -6,25 +6,449 @@ Single port for both static files and multiplayer.
 Works with websockets >= 13.0 (including v15)
 """
 import asyncio
+import atexit
+import base64
+import bisect
+import fnmatch
+import gzip
 import json
+import math
+import multiprocessing
 import random
 import os
+import queue
+import re
+import signal
+import stat
 import hashlib
+import hmac
+import ipaddress
 import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from http import HTTPStatus
+from urllib.parse import parse_qs
 
+import numpy as np
 import websockets
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import BINARY, CONT, CTRL_OPCODES, Frame
 from websockets.http11 import Response
 
+try:
+    import brotli  # optional: adds 'br' variants of static assets
+except ImportError:
+    brotli = None
+
 # ─── Configuration ───────────────────────────────────────────
 PORT = int(os.environ.get('PORT', 8080))
 ROOT_DIR = Path(__file__).parent.resolve()
 DB_PATH = ROOT_DIR / 'users.db'
 
+# Server-private files (the session key, the world log and snapshot) live
+# in STATE_DIR, outside the ROOT_DIR tree that is served over HTTP
+STATE_DIR = Path(os.environ.get('STATE_DIR', Path.home() / '.13metaverse'))
+
+# Game tick: fixed rate on the monotonic clock. When ticks fall behind,
+# 'catchup' runs up to TICK_MAX_CATCHUP missed ticks back to back, 'skip'
+# drops them and resumes on schedule
+TICK_RATE = int(os.environ.get('TICK_RATE', 20))
+TICK_POLICY = os.environ.get('TICK_POLICY', 'skip')
+TICK_MAX_CATCHUP = int(os.environ.get('TICK_MAX_CATCHUP', 3))
+STATS_INTERVAL = float(os.environ.get('STATS_INTERVAL', 60))
+
+# Area of interest: players see others within VIEW_RADIUS, and keep seeing
+# them until they are VIEW_HYSTERESIS further away (avoids enter/exit flicker)
+VIEW_RADIUS = float(os.environ.get('VIEW_RADIUS', 40))
+VIEW_HYSTERESIS = float(os.environ.get('VIEW_HYSTERESIS', 8))
+
+# Delta snapshots: a client that hasn't acked within this many ticks
+# gets a full resync instead of a delta against a stale baseline
+SNAPSHOT_WINDOW = int(os.environ.get('SNAPSHOT_WINDOW', 40))
+
+# Snapshot history: positions from the last SNAPSHOT_HISTORY ticks, for
+# rewinding to what a client saw (lag compensation). Clients render remote
+# players INTERP_DELAY_MS behind the newest snapshot
+SNAPSHOT_HISTORY = int(os.environ.get('SNAPSHOT_HISTORY', 64))
+INTERP_DELAY_MS = int(os.environ.get('INTERP_DELAY_MS', 100))
+
+# Outbound queue per connection; a client with this many undelivered
+# reliable messages is too slow to keep and gets disconnected
+SEND_QUEUE_LIMIT = int(os.environ.get('SEND_QUEUE_LIMIT', 256))
+
+# Idle clients: one with no input for IDLE_AFTER seconds (0 = never), or
+# whose tab says it is hidden, drops to a low-footprint mode. It gets
+# state only every IDLE_STATE_INTERVAL seconds (0 = events only; hidden
+# tabs always get events only). Its send queue holds IDLE_QUEUE_LIMIT
+# messages, its socket buffers IDLE_WRITE_BUFFER bytes, and no compressor
+# is kept between messages. Input brings it back with a full snapshot
+IDLE_AFTER = float(os.environ.get('IDLE_AFTER', 60))
+IDLE_STATE_INTERVAL = float(os.environ.get('IDLE_STATE_INTERVAL', 1))
+IDLE_QUEUE_LIMIT = int(os.environ.get('IDLE_QUEUE_LIMIT', 16))
+IDLE_WRITE_BUFFER = int(os.environ.get('IDLE_WRITE_BUFFER', 4096))
+
+# WebSocket compression: 'adaptive' decides per message type whether to
+# deflate and at what level (see COMPRESSION_POLICY), 'deflate' compresses
+# everything (websockets' default), 'off' turns permessage-deflate off.
+# Adaptive mode uses the last COMPRESSION_WINDOW bytes a client inflated as
+# the dictionary for the next message and, with COMPRESSION_PRIME, seeds
+# that window with common message keys on connect
+WS_COMPRESSION = os.environ.get('WS_COMPRESSION', 'adaptive')
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 128))
+COMPRESSION_WINDOW = int(os.environ.get('COMPRESSION_WINDOW', 8192))
+COMPRESSION_PRIME = int(os.environ.get('COMPRESSION_PRIME', 1))
+
+# Reliable events raised during a tick reach each client as one 'batch'
+# frame, together with that tick's state. A joiner's player_list arrives
+# in pages of PLAYER_LIST_PAGE players, one page per tick
+PLAYER_LIST_PAGE = int(os.environ.get('PLAYER_LIST_PAGE', 64))
+
+# Scale-out: WORKERS > 1 runs that many server processes on PORT, relaying
+# players and events between them over a Unix-socket bus at BUS_PATH
+WORKERS = int(os.environ.get('WORKERS', 1))
+BUS_PATH = os.environ.get('BUS_PATH', f'/tmp/13metaverse-{PORT}.sock')
+BUS_REPORT_INTERVAL = float(os.environ.get('BUS_REPORT_INTERVAL', 2))
+
+# Rooms: join may name a room; each instance holds up to ROOM_CAPACITY
+# players and overflow opens another ('lobby#2', 'lobby#3', ...)
+DEFAULT_ROOM = os.environ.get('DEFAULT_ROOM', 'lobby')
+ROOM_CAPACITY = int(os.environ.get('ROOM_CAPACITY', 100))
+
+# NPCs: every room simulates the agents listed in NPC_FILE (a JSON list,
+# see load_npcs(); the built-in showroom staff when unset) on its tick
+NPC_FILE = os.environ.get('NPC_FILE', '')
+
+# Inbound messages: every connection has a token bucket per message class
+# ('class=rate/burst;...', per second), plus 'frame' for everything it
+# sends. Messages that are rate-limited, over their type's byte cap or
+# malformed are dropped, each costing a strike; a client that uses up
+# INBOUND_STRIKE_BURST strikes (refilled at INBOUND_STRIKE_RATE a second)
+# is disconnected
+INBOUND_RATES = os.environ.get(
+    'INBOUND_RATES',
+    'frame=120/240;move=40/80;control=40/80;chat=2/6;draw=30/60;world=10/30;voice=10/20;profile=2/5'
+)
+INBOUND_STRIKE_RATE = float(os.environ.get('INBOUND_STRIKE_RATE', 5))
+INBOUND_STRIKE_BURST = int(os.environ.get('INBOUND_STRIKE_BURST', 100))
+
+# Static assets: LRU of file bodies and their gzip/brotli variants, bounded
+# by STATIC_CACHE_BYTES. STATIC_CACHE_CONTROL maps URL patterns to
+# Cache-Control values ('pattern=value;...', first match wins); 'no-cache'
+# still lets browsers revalidate cheaply with the ETag
+STATIC_CACHE_BYTES = int(os.environ.get('STATIC_CACHE_BYTES', 64 * 1024 * 1024))
+STATIC_CACHE_MAX_FILE = int(os.environ.get('STATIC_CACHE_MAX_FILE', 8 * 1024 * 1024))
+STATIC_COMPRESS_MIN = int(os.environ.get('STATIC_COMPRESS_MIN', 1024))
+STATIC_CACHE_CONTROL = os.environ.get(
+    'STATIC_CACHE_CONTROL',
+    '*.html=no-cache;/src/*=no-cache;*=public, max-age=3600'
+)
+
+# Only these URL paths are served from ROOT_DIR ('path;...'; entries
+# ending in '/' cover everything under that directory). Dotfiles and
+# database files are refused even inside them
+STATIC_PATHS = os.environ.get(
+    'STATIC_PATHS',
+    '/index.html;/landing.html;/world_data.json;/src/;/samples/'
+)
+
+# Files of STATIC_STREAM_MIN bytes and up (.glb/.obj models) skip the cache
+# and go straight from disk to the socket with sendfile(). At most
+# STATIC_STREAM_CONCURRENCY are sent at once, STATIC_STREAM_BACKLOG more
+# wait for a slot and anything past that gets 503. Any static file answers
+# a single-range 'Range: bytes=' request with 206
+STATIC_STREAM_MIN = int(os.environ.get('STATIC_STREAM_MIN', 1024 * 1024))
+STATIC_STREAM_CONCURRENCY = int(os.environ.get('STATIC_STREAM_CONCURRENCY', 4))
+STATIC_STREAM_BACKLOG = int(os.environ.get('STATIC_STREAM_BACKLOG', 32))
+
+# OBJ models: a .obj request that accepts model/gltf-binary gets the model
+# converted to GLB. Conversions run in a pool of MODEL_WORKERS processes
+# and are kept in MODEL_CACHE_DIR by content hash; with MODEL_PRECONVERT=1
+# every .obj under the site root is converted at startup
+MODEL_CACHE_DIR = Path(os.environ.get('MODEL_CACHE_DIR', ROOT_DIR / '.model_cache'))
+MODEL_WORKERS = int(os.environ.get('MODEL_WORKERS', 2))
+MODEL_PRECONVERT = int(os.environ.get('MODEL_PRECONVERT', 0))
+
+# World editor objects are owned by the server (worker 0 with WORKERS > 1).
+# Each edit is appended to WORLD_LOG_PATH, with one fsync per
+# WORLD_FLUSH_INTERVAL batch, and every WORLD_COMPACT_OPS edits the log is
+# folded into the WORLD_SNAPSHOT_PATH snapshot in the background
+WORLD_SNAPSHOT_PATH = Path(os.environ.get('WORLD_SNAPSHOT_PATH', STATE_DIR / 'world.json'))
+WORLD_LOG_PATH = Path(os.environ.get('WORLD_LOG_PATH', STATE_DIR / 'world.log'))
+WORLD_FLUSH_INTERVAL = float(os.environ.get('WORLD_FLUSH_INTERVAL', 0.05))
+WORLD_COMPACT_OPS = int(os.environ.get('WORLD_COMPACT_OPS', 500))
+WORLD_MAX_OBJECTS = int(os.environ.get('WORLD_MAX_OBJECTS', 5000))
+
+# Whiteboard: strokes are broadcast once per tick; past
+# WHITEBOARD_HISTORY_POINTS points of history the oldest strokes are
+# flattened into a bitmap. Each client may draw WHITEBOARD_INK_RATE points
+# per second, in bursts of up to WHITEBOARD_INK_BURST
+WHITEBOARD_HISTORY_POINTS = int(os.environ.get('WHITEBOARD_HISTORY_POINTS', 20000))
+WHITEBOARD_INK_RATE = float(os.environ.get('WHITEBOARD_INK_RATE', 600))
+WHITEBOARD_INK_BURST = int(os.environ.get('WHITEBOARD_INK_BURST', 1200))
+
+# Auth storage: DB_POOL_SIZE reader connections, writes batched for up to
+# DB_BATCH_WINDOW seconds per transaction, scrypt cost PASSWORD_KDF_N
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+DB_BATCH_WINDOW = float(os.environ.get('DB_BATCH_WINDOW', 0.002))
+PASSWORD_KDF_N = int(os.environ.get('PASSWORD_KDF_N', 2 ** 14))
+PASSWORD_KDF_THREADS = int(os.environ.get('PASSWORD_KDF_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+
+# Sessions: login issues an HMAC-signed token valid for SESSION_TTL
+# seconds. join checks it against an LRU of up to SESSION_CACHE_SIZE
+# sessions, re-read from the database after SESSION_CACHE_TTL seconds.
+# Tokens survive restarts as long as the key does: SESSION_SECRET, or a
+# random key generated once into SESSION_SECRET_PATH
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 7 * 24 * 3600))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 300))
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '')
+SESSION_SECRET_PATH = Path(os.environ.get('SESSION_SECRET_PATH', STATE_DIR / 'session_secret'))
+
+# Operator endpoints (ADMIN_ROUTES) need 'Authorization: Bearer ADMIN_TOKEN';
+# with no ADMIN_TOKEN set they answer direct loopback requests only
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# ─── Metrics & Logging ───────────────────────────────────────
+# In-process Prometheus metrics, rendered by /api/metrics. Label values
+# only ever come from small fixed sets (message types, routes, tick loops),
+# never from user input, so the number of series stays bounded.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> total
+
+    def inc(self, *labels, n=1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield '', dict(zip(self.labels, labels)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket (last is +Inf), sum]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in self.series.items():
+            names = dict(zip(self.labels, labels))
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                total += count
+                yield '_bucket', {**names, 'le': bound}, total
+            yield '_sum', names, series[-1]
+            yield '_count', names, total
+
+
+class Gauge:
+    """Value read at scrape time: fn() returns a number or [(label values, number)]."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = labels
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, (int, float)):
+            value = [((), value)]
+        for labels, v in value:
+            yield '', dict(zip(self.labels, labels)), v
+
+
+class Metrics:
+    """Registry; constant labels (the worker number) are added to every sample."""
+    def __init__(self):
+        self.registry = {}
+        self.const_labels = {}
+
+    def counter(self, name, help, labels=()):
+        return self.registry.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.registry.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=(), kind='gauge'):
+        """Register (or re-point) a scrape-time value."""
+        self.registry[name] = Gauge(name, help, fn, labels, kind)
+
+    def render(self):
+        lines = []
+        for metric in self.registry.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                labels = {**labels, **self.const_labels}
+                text = ','.join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+                lines.append(f'{metric.name}{suffix}{{{text}}} {value}' if text else f'{metric.name}{suffix} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+TICK_SECONDS = metrics.histogram('metaverse_tick_seconds', 'Time spent running one tick', ('loop',))
+TICK_OVERRUN_SECONDS = metrics.histogram(
+    'metaverse_tick_overrun_seconds', 'How far overrunning ticks went past their period', ('loop',))
+TICKS_SKIPPED = metrics.counter('metaverse_ticks_skipped_total', 'Ticks dropped after falling behind', ('loop',))
+MESSAGES_IN = metrics.counter('metaverse_messages_received_total', 'WebSocket messages received', ('type',))
+BYTES_IN = metrics.counter('metaverse_received_bytes_total', 'WebSocket payload bytes received', ('type',))
+MESSAGES_OUT = metrics.counter('metaverse_messages_sent_total', 'WebSocket messages sent', ('type',))
+BYTES_OUT = metrics.counter('metaverse_sent_bytes_total', 'WebSocket payload bytes sent', ('type',))
+EVENTS_BATCHED = metrics.counter(
+    'metaverse_events_batched_total', "Messages sent inside a tick's batch frame", ('type',))
+COMPRESSION_RAW_BYTES = metrics.counter(
+    'metaverse_compression_raw_bytes_total', 'Outbound bytes compressed, before deflate', ('type',))
+COMPRESSION_WIRE_BYTES = metrics.counter(
+    'metaverse_compression_wire_bytes_total', 'Outbound bytes compressed, after deflate', ('type',))
+COMPRESSION_SECONDS = metrics.counter(
+    'metaverse_compression_cpu_seconds_total', 'CPU time spent compressing outbound messages', ('type',))
+COMPRESSION_SKIPPED = metrics.counter(
+    'metaverse_compression_skipped_total', 'Outbound messages sent uncompressed by policy', ('type',))
+MESSAGES_DROPPED = metrics.counter(
+    'metaverse_messages_dropped_total', 'Outbound messages discarded before sending', ('type', 'reason'))
+BROADCAST_SECONDS = metrics.histogram(
+    'metaverse_broadcast_seconds', 'Time to serialize and queue one broadcast for every target', ('type',))
+SEND_DELAY_SECONDS = metrics.histogram(
+    'metaverse_send_delay_seconds', 'Time outbound messages wait in a connection queue', ('type',))
+SEND_QUEUE_DEPTH = metrics.histogram(
+    'metaverse_send_queue_depth', 'Connection queue depth seen by each queued message', buckets=DEPTH_BUCKETS)
+# Label values for the HTTP metrics: other API paths are counted as '/api/other'
+API_ROUTES = frozenset((
+    '/api/register', '/api/login', '/api/logout', '/api/world', '/api/stats', '/api/metrics',
+    '/api/connections',
+))
+# API routes that report server internals, see admin_allowed()
+ADMIN_ROUTES = frozenset(('/api/stats', '/api/metrics', '/api/connections'))
+HTTP_SECONDS = metrics.histogram('metaverse_http_request_seconds', 'HTTP request latency', ('route',))
+HTTP_RESPONSES = metrics.counter('metaverse_http_responses_total', 'HTTP responses', ('route', 'code'))
+INBOUND_REJECTED = metrics.counter(
+    'metaverse_messages_rejected_total', 'Inbound messages dropped unhandled', ('type', 'reason'))
+MOVES_COALESCED = metrics.counter(
+    'metaverse_moves_coalesced_total', 'Moves overridden by a newer one before their tick')
+IDLE_TRANSITIONS = metrics.counter(
+    'metaverse_idle_transitions_total', 'Clients entering low-footprint mode, by cause', ('mode',))
+STATIC_STREAM_BYTES = metrics.counter(
+    'metaverse_static_stream_bytes_total', 'Body bytes of large static files sent with sendfile()')
+
+# Structured logging: log(event, template, **fields) only queues the record;
+# a daemon thread formats and writes batches ('text' lines or 'json')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_QUEUE_LIMIT = int(os.environ.get('LOG_QUEUE_LIMIT', 10000))
+
+
+class Logger:
+    """
+    Queued structured log. Callers on the event loop never format or
+    write; when the queue is full records are dropped (and counted)
+    rather than blocking.
+    """
+    def __init__(self, fmt=LOG_FORMAT, limit=LOG_QUEUE_LIMIT, stream=None):
+        self.fmt = fmt
+        self.queue = queue.Queue(limit)
+        self.stream = stream
+        self.dropped = 0
+        self.thread = None
+
+    def __call__(self, event, template, **fields):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._drain, name='log', daemon=True)
+            self.thread.start()
+        try:
+            self.queue.put_nowait((time.time(), event, template, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def format(self, ts, event, template, fields):
+        text = template.format(**fields)
+        if self.fmt == 'json':
+            return json.dumps({'ts': round(ts, 3), 'event': event, **fields, 'msg': text},
+                              ensure_ascii=False, default=str) + '\n'
+        return f'  {text}\n'
+
+    def _drain(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stream = self.stream or sys.stdout
+            stream.write(''.join(self.format(*record) for record in batch))
+            stream.flush()
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self, timeout=1.0):
+        """Wait (briefly) for queued records to be written, e.g. before exiting."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+log = Logger()
+atexit.register(log.flush)
+metrics.gauge('metaverse_log_dropped_total', 'Log records dropped because the queue was full',
+              lambda: log.dropped, kind='counter')
+
+
 # ─── Database ────────────────────────────────────────────────
+# All SQLite and password-hashing work runs on thread pools: readers each
+# keep one long-lived connection, a single writer thread commits queued
+# writes in batches (one transaction per batch), and the KDF has its own
+# pool so a burst of logins never queues behind (or in front of) queries.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',     # readers don't block the writer
+    'PRAGMA synchronous=NORMAL',   # fsync at checkpoints, safe with WAL
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-8000',     # 8 MiB page cache per connection
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def connect_db():
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False, isolation_level=None)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
 def init_db():
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = connect_db()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,265 +459,4019 @@ def init_db():
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    conn.commit()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            revoked INTEGER DEFAULT 0
+        )
+    ''')
+    # Emails are stored lowercased, so the UNIQUE constraint's index serves
+    # every lookup (login is a single `email = ?` probe); no extra index needed
+    conn.execute('PRAGMA optimize')
     conn.close()
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
 
-def register_user(email, password, name=None):
-    conn = sqlite3.connect(str(DB_PATH))
-    try:
-        display_name = name or email.split('@')[0]
-        conn.execute(
-            'INSERT INTO users (email, password_hash, name) VALUES (?, ?, ?)',
-            (email.lower(), hash_password(password), display_name)
-        )
-        conn.commit()
-        user_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
-        return {'id': user_id, 'email': email, 'name': display_name}
-    except sqlite3.IntegrityError:
-        return None  # Email already exists
-    finally:
-        conn.close()
-
-def login_user(email, password):
-    conn = sqlite3.connect(str(DB_PATH))
-    row = conn.execute(
-        'SELECT id, email, name, avatar_color FROM users WHERE email=? AND password_hash=?',
-        (email.lower(), hash_password(password))
-    ).fetchone()
-    conn.close()
-    if row:
-        return {'id': row[0], 'email': row[1], 'name': row[2], 'color': row[3]}
-    return None
+def hash_password(password, salt=None):
+    """scrypt hash as 'scrypt$n$r$p$salt$hash' (hex). Deliberately slow: call off-loop."""
+    salt = salt if salt is not None else os.urandom(16)
+    digest = hashlib.scrypt(
+        password.encode(), salt=salt, n=PASSWORD_KDF_N, r=8, p=1,
+        maxmem=256 * PASSWORD_KDF_N * 8, dklen=32
+    )
+    return f'scrypt${PASSWORD_KDF_N}$8$1${salt.hex()}${digest.hex()}'
+
+
+def verify_password(password, stored):
+    """(matches, needs_rehash). Accepts the legacy unsalted sha256 hex hashes too."""
+    if not stored.startswith('scrypt$'):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+    _, n, r, p, salt, digest = stored.split('$')
+    candidate = hashlib.scrypt(
+        password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p),
+        maxmem=256 * int(n) * int(r), dklen=len(digest) // 2
+    )
+    return hmac.compare_digest(candidate.hex(), digest), int(n) != PASSWORD_KDF_N
+
+
+class UserDB:
+    """
+    Async access to the users table. Coroutines hand SQL to the reader
+    pool or the batched writer and KDF work to the hash pool, so the event
+    loop only ever awaits futures.
+    """
+    def __init__(self, pool_size=DB_POOL_SIZE):
+        self.local = threading.local()  # each pool thread's own connection
+        self.readers = ThreadPoolExecutor(pool_size, 'db-read', initializer=self._open)
+        self.writer = ThreadPoolExecutor(1, 'db-write', initializer=self._open)
+        self.hasher = ThreadPoolExecutor(PASSWORD_KDF_THREADS, 'kdf')
+        self.pending = []      # [(sql, params, future)] waiting for the next batch
+        self.flushing = False
+        self.tasks = set()     # batch flushes and hash upgrades still running
+        self.batches = 0
+        self.writes = 0
+        # Hashed for unknown emails so a miss costs as much as a wrong password
+        self.dummy_hash = hash_password('')
+
+    def _open(self):
+        self.local.conn = connect_db()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _fetchone(self, sql, params):
+        return self.local.conn.execute(sql, params).fetchone()
+
+    def _write_batch(self, batch):
+        """Run queued writes in one transaction; each gets its own rowid or error."""
+        conn = self.local.conn
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params, _ in batch:
+                conn.execute('SAVEPOINT w')
+                try:
+                    results.append(conn.execute(sql, params).lastrowid)
+                    conn.execute('RELEASE w')
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO w')
+                    conn.execute('RELEASE w')
+                    results.append(e)
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return results
+
+    def _fetchall(self, sql, params):
+        return self.local.conn.execute(sql, params).fetchall()
+
+    async def read(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, self._fetchone, sql, params)
+
+    async def read_all(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, self._fetchall, sql, params)
+
+    async def write(self, sql, params=()):
+        """Queue a write for the next batch; returns its lastrowid or raises its error."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((sql, params, future))
+        if not self.flushing:
+            self.flushing = True
+            self._spawn(self._flush())
+        return await future
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                await asyncio.sleep(DB_BATCH_WINDOW)  # let concurrent writes join
+                batch, self.pending = self.pending, []
+                try:
+                    results = await loop.run_in_executor(self.writer, self._write_batch, batch)
+                except Exception as e:
+                    results = [e] * len(batch)
+                self.batches += 1
+                self.writes += len(batch)
+                for (_, _, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            self.flushing = False
+
+    async def hash(self, password):
+        return await asyncio.get_running_loop().run_in_executor(self.hasher, hash_password, password)
+
+    async def verify(self, password, stored):
+        return await asyncio.get_running_loop().run_in_executor(self.hasher, verify_password, password, stored)
+
+    async def register(self, email, password, name=None):
+        """New user dict, or None if the email is taken."""
+        display_name = name or email.split('@')[0]
+        password_hash = await self.hash(password)
+        try:
+            user_id = await self.write(
+                'INSERT INTO users (email, password_hash, name) VALUES (?, ?, ?)',
+                (email.lower(), password_hash, display_name)
+            )
+        except sqlite3.IntegrityError:
+            return None  # Email already exists
+        return {'id': user_id, 'email': email, 'name': display_name}
+
+    async def login(self, email, password):
+        """User dict if the credentials match, else None."""
+        row = await self.read(
+            'SELECT id, email, name, avatar_color, password_hash FROM users WHERE email=?',
+            (email.lower(),)
+        )
+        ok, rehash = await self.verify(password, row[4] if row else self.dummy_hash)
+        if not (row and ok):
+            return None
+        if rehash:
+            # Upgrade legacy sha256 (or outdated KDF cost) hashes in the background
+            async def upgrade():
+                try:
+                    await self.write('UPDATE users SET password_hash=? WHERE id=?', (await self.hash(password), row[0]))
+                except Exception as e:
+                    log('db_error', '[!] Password hash upgrade failed: {error}', error=str(e))
+            self._spawn(upgrade())
+        return {'id': row[0], 'email': row[1], 'name': row[2], 'color': row[3]}
+
+    def stats(self):
+        return {'batches': self.batches, 'writes': self.writes, 'queued': len(self.pending)}
+
+
+# ─── Sessions ────────────────────────────────────────────────
+def load_session_secret():
+    """SESSION_SECRET, or the key in SESSION_SECRET_PATH (created by whichever worker gets there first)."""
+    if SESSION_SECRET:
+        return SESSION_SECRET.encode()
+    SESSION_SECRET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(SESSION_SECRET_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return SESSION_SECRET_PATH.read_bytes()
+    key = os.urandom(32).hex().encode()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def unb64url(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_token(secret, payload):
+    body = b64url(json.dumps(payload, separators=(',', ':')).encode())
+    mac = hmac.new(secret, body.encode(), hashlib.sha256).digest()
+    return f'{body}.{b64url(mac)}'
+
+
+def read_token(secret, token):
+    """Payload of a correctly signed, unexpired token, else None. Pure CPU, no I/O."""
+    if not isinstance(token, str) or token.count('.') != 1:
+        return None
+    body, _, mac = token.partition('.')
+    expected = hmac.new(secret, body.encode(), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(unb64url(mac), expected):
+            return None
+        payload = json.loads(unb64url(body))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(payload, dict) or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+class SessionCache:
+    """
+    LRU of session id -> user dict (None for revoked or unknown sessions,
+    so repeated bad tokens don't hit the database either). Entries expire
+    SESSION_CACHE_TTL seconds after they were loaded.
+    """
+    def __init__(self, capacity=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # sid -> (loaded at, user or None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sid):
+        """(found, user)."""
+        entry = self.entries.get(sid)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(sid)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, sid, user):
+        self.entries[sid] = (time.monotonic(), user)
+        self.entries.move_to_end(sid)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def revoke(self, sid):
+        self.put(sid, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None}
+
+
+class Sessions:
+    """
+    Issues and validates login tokens. The signature and expiry are checked
+    in memory; the database is only asked whether a session was revoked,
+    and only on a cache miss. Concurrent misses for one session share a
+    single query, and warm() preloads every live session at startup so a
+    reconnect storm after a deploy is served from memory.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.secret = load_session_secret()
+        self.cache = SessionCache()
+        self.loading = {}  # sid -> future of an in-flight database read
+        self.db_reads = 0
+
+    async def issue(self, user):
+        """New token for a user dict ({'id', 'name', 'color', ...}); returns (token, sid, expires)."""
+        sid = b64url(os.urandom(18))
+        expires = int(time.time()) + SESSION_TTL
+        await self.db.write('INSERT INTO sessions (sid, user_id, expires_at) VALUES (?, ?, ?)',
+                            (sid, user['id'], expires))
+        self.cache.put(sid, self.session_user(user))
+        return sign_token(self.secret, {'sid': sid, 'uid': user['id'], 'exp': expires}), sid, expires
+
+    @staticmethod
+    def session_user(user):
+        return {'id': user['id'], 'name': user['name'], 'color': user.get('color')}
+
+    async def validate(self, token):
+        """User dict for a valid, unrevoked token, else None."""
+        payload = read_token(self.secret, token)
+        if payload is None:
+            return None
+        sid = payload['sid']
+        found, user = self.cache.get(sid)
+        if found:
+            return user
+        future = self.loading.get(sid)
+        if future is None:
+            future = self.loading[sid] = asyncio.ensure_future(self._load(sid))
+            future.add_done_callback(lambda _: self.loading.pop(sid, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, sid):
+        self.db_reads += 1
+        row = await self.db.read(
+            'SELECT u.id, u.name, u.avatar_color FROM sessions s JOIN users u ON u.id = s.user_id '
+            'WHERE s.sid = ? AND s.revoked = 0 AND s.expires_at > ?',
+            (sid, int(time.time()))
+        )
+        user = {'id': row[0], 'name': row[1], 'color': row[2]} if row else None
+        self.cache.put(sid, user)
+        return user
+
+    async def revoke(self, token):
+        """Revoke a token's session; returns its sid, or None if the token is invalid."""
+        payload = read_token(self.secret, token)
+        if payload is None:
+            return None
+        await self.db.write('UPDATE sessions SET revoked = 1 WHERE sid = ?', (payload['sid'],))
+        self.cache.revoke(payload['sid'])
+        return payload['sid']
+
+    async def warm(self):
+        """Drop expired sessions and load the newest live ones into the cache."""
+        now = int(time.time())
+        await self.db.write('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+        rows = await self.db.read_all(
+            'SELECT s.sid, u.id, u.name, u.avatar_color FROM sessions s JOIN users u ON u.id = s.user_id '
+            'WHERE s.revoked = 0 AND s.expires_at > ? ORDER BY s.expires_at DESC LIMIT ?',
+            (now, self.cache.capacity)
+        )
+        self.db_reads += 1
+        for sid, uid, name, color in reversed(rows):
+            self.cache.put(sid, {'id': uid, 'name': name, 'color': color})
+        return len(rows)
+
+    def stats(self):
+        return {**self.cache.stats(), 'db_reads': self.db_reads}
+
+
+MIME_MAP = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.mjs': 'application/javascript; charset=utf-8',
+    '.json': 'application/json',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.glb': 'model/gltf-binary',
+    '.gltf': 'model/gltf+json',
+    '.obj': 'text/plain',
+    '.mtl': 'text/plain',
+}
+
+
+# ─── Player Store ────────────────────────────────────────────
+# Per-tick fields carried by 'state' frames; name/color/appearance are
+# static and only travel with join, interest enter and appearance_update
+DYNAMIC_FIELDS = ('x', 'y', 'z', 'ry', 'anim')
+APPEARANCE_FIELDS = (
+    'color', 'shirtColor', 'pantsColor', 'skinColor', 'shoeColor',
+    'hairColor', 'hairStyle', 'shirtType'
+)
+ANIM_STATES = ('idle', 'walk', 'run', 'jump', 'wave', 'dance', 'sit')
+ANIM_INDEX = {a: i for i, a in enumerate(ANIM_STATES)}
+
+
+NO_SLOTS = np.zeros(0, np.intp)
+
+
+def lookup_sorted(values, sorted_arr):
+    """(found mask, index) of each value in the sorted array `sorted_arr`."""
+    if not sorted_arr.size:
+        return np.zeros(len(values), np.bool_), np.zeros(len(values), np.intp)
+    idx = np.searchsorted(sorted_arr, values)
+    idx[idx == len(sorted_arr)] = 0
+    return sorted_arr[idx] == values, idx
+
+
+def in_sorted(values, sorted_arr):
+    """Bool mask of which `values` appear in the sorted array `sorted_arr`."""
+    return lookup_sorted(values, sorted_arr)[0]
+
+
+class PlayerStore:
+    """
+    Struct-of-arrays player table. Per-tick fields live in NumPy columns
+    indexed by slot (x/y/z/ry as float32, anim as a uint8 ANIM_STATES
+    index); rarely-changing profile fields live in a side table.
+
+    Every field write is stamped with the tick it will first be sent on
+    (field_tick), so "what changed since tick T" is one vectorized compare.
+    The dirty column flags slots touched since the last take_dirty().
+    """
+    COLUMNS = (
+        ('x', np.float32, ()), ('y', np.float32, ()), ('z', np.float32, ()),
+        ('ry', np.float32, ()), ('anim', np.uint8, ()),
+        ('num_id', np.uint32, ()),  # numeric player id, for binary frames
+        ('move_seq', np.uint32, ()),  # client seq of the newest 'move' ...
+        ('move_ms', np.float64, ()),  # ... and when the server received it
+        ('active', np.bool_, ()),
+        ('dirty', np.bool_, ()),
+        ('field_tick', np.int64, (len(DYNAMIC_FIELDS),)),
+    )
+
+    def __init__(self, capacity=64):
+        self.slot_of = {}    # player id -> slot
+        self.profiles = {}   # player id -> static fields (id, name, color, ...)
+        self.free = []       # released slots, reused before growing
+        self.size = 0        # slots ever handed out
+        self.tick = 1        # stamp for writes made now (see advance())
+        self.pid_at = []     # slot -> player id
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        """(Re)allocate every column at `capacity`, keeping existing rows."""
+        for name, dtype, shape in self.COLUMNS:
+            col = np.zeros((capacity,) + shape, dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                col[:len(old)] = old
+            setattr(self, name, col)
+        self.pid_at += [None] * (capacity - len(self.pid_at))
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, pid):
+        return pid in self.slot_of
+
+    def __iter__(self):
+        return iter(self.slot_of)
+
+    def add(self, pid, profile, x, y, z, ry=0.0, anim='idle'):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._alloc(self.capacity * 2)
+            slot = self.size
+            self.size += 1
+        self.slot_of[pid] = slot
+        self.pid_at[slot] = pid
+        self.profiles[pid] = {'id': pid, **profile}
+        self.num_id[slot] = int(pid)
+        self.x[slot], self.y[slot], self.z[slot], self.ry[slot] = x, y, z, ry
+        self.anim[slot] = ANIM_INDEX.get(anim, 0)
+        self.active[slot] = True
+        self.dirty[slot] = True
+        self.field_tick[slot] = self.tick
+        return slot
+
+    def remove(self, pid):
+        slot = self.slot_of.pop(pid, None)
+        if slot is None:
+            return
+        self.profiles.pop(pid, None)
+        self.pid_at[slot] = None
+        self.active[slot] = False
+        self.dirty[slot] = False
+        self.free.append(slot)
+
+    def move(self, pid, x=None, y=None, z=None, ry=None, anim=None):
+        """Write the given per-tick fields, stamping only those that changed."""
+        slot = self.slot_of[pid]
+        changed = False
+        for i, (col, v) in enumerate(((self.x, x), (self.y, y), (self.z, z), (self.ry, ry))):
+            if v is not None and col[slot] != np.float32(v):
+                col[slot] = v
+                self.field_tick[slot, i] = self.tick
+                changed = True
+        if anim is not None:
+            a = ANIM_INDEX.get(anim, 0)
+            if self.anim[slot] != a:
+                self.anim[slot] = a
+                self.field_tick[slot, 4] = self.tick
+                changed = True
+        if changed:
+            self.dirty[slot] = True
+        return changed
+
+    def write(self, slots, x, y, z, ry, anim):
+        """Vectorized move() for many slots at once (columns follow `slots`)."""
+        for i, (col, v) in enumerate(((self.x, x), (self.y, y), (self.z, z), (self.ry, ry), (self.anim, anim))):
+            diff = col[slots] != v
+            col[slots] = v
+            self.field_tick[slots[diff], i] = self.tick
+            self.dirty[slots[diff]] = True
+
+    def stamp_move(self, pid, seq, received_ms):
+        """Remember when the newest 'move' arrived, and its client seq if it had one."""
+        slot = self.slot_of[pid]
+        if seq is not None:
+            self.move_seq[slot] = seq
+        self.move_ms[slot] = received_ms
+
+    def advance(self, tick):
+        """Tick `tick` has been snapshotted; later writes belong to the next one."""
+        self.tick = tick + 1
+
+    def position(self, pid):
+        slot = self.slot_of[pid]
+        return float(self.x[slot]), float(self.z[slot])
+
+    def profile(self, pid):
+        return self.profiles[pid]
+
+    def record(self, pid):
+        """Profile plus current per-tick fields, as sent in join/enter events."""
+        slot = self.slot_of[pid]
+        return {
+            **self.profiles[pid],
+            'x': round(float(self.x[slot]), 3),
+            'y': round(float(self.y[slot]), 3),
+            'z': round(float(self.z[slot]), 3),
+            'ry': round(float(self.ry[slot]), 3),
+            'anim': ANIM_STATES[self.anim[slot]],
+        }
+
+    def ids_of(self, num_ids):
+        """Player id strings for an array of numeric ids."""
+        return [str(i) for i in num_ids.tolist()]
+
+    def changed_since(self, tick, slots=None):
+        """
+        Per-field bool mask (rows follow `slots`) of writes after `tick`,
+        which may be a column of per-row ticks.
+        """
+        stamps = self.field_tick[:self.size] if slots is None else self.field_tick[slots]
+        return stamps > tick
+
+    def take_dirty(self):
+        """Slots written since the last call, clearing their flags."""
+        slots = np.flatnonzero(self.dirty[:self.size])
+        self.dirty[slots] = False
+        return slots
+
+
+# ─── Interest Management ─────────────────────────────────────
+NO_KEYS = np.zeros(0, np.uint64)
+NO_TICKS = np.zeros(0, np.int64)
+NO_IDS = np.zeros(0, np.uint32)
+
+
+def pair_keys(viewer_ids, other_ids):
+    """Sortable uint64 key per (viewer, other) pair of numeric ids, viewer-major."""
+    return (viewer_ids.astype(np.uint64) << np.uint64(32)) | other_ids.astype(np.uint64)
+
+
+def key_viewers(keys):
+    return (keys >> np.uint64(32)).astype(np.uint32)
+
+
+def key_others(keys):
+    return (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def viewer_rows(keys, viewer_ids):
+    """Mask of the sorted pair `keys` whose viewer is one of `viewer_ids` (sorted)."""
+    first = viewer_ids.astype(np.uint64) << np.uint64(32)
+    starts = np.searchsorted(keys, first)
+    ends = np.searchsorted(keys, first + (np.uint64(1) << np.uint64(32)))
+    marks = np.zeros(len(keys) + 1, np.int32)
+    np.add.at(marks, starts, 1)
+    np.add.at(marks, ends, -1)
+    return np.cumsum(marks[:-1]) > 0
+
+
+def group_bounds(sorted_ids):
+    """{id: (start, end)} for each run of equal values in a sorted array."""
+    ids, starts, counts = np.unique(sorted_ids, return_index=True, return_counts=True)
+    return {i: (s, s + c) for i, s, c in zip(ids.tolist(), starts.tolist(), counts.tolist())}
+
+
+class InterestGrid:
+    """
+    Uniform spatial hash over the x/z plane, rebuilt from the player store
+    with one vectorized sort. Cells are as wide as the largest query radius,
+    so the 3x3 block around a player covers every candidate it could see and
+    the pair count scales with local density, not total population.
+    """
+    SPAN = 1 << 21  # cell coordinates are packed as (cx + SPAN/2) * SPAN + cz
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+    def candidate_pairs(self, store, skip=NO_IDS):
+        """
+        (viewer slots, other slots) for every two players in neighbouring
+        cells, leaving out viewers whose numeric id is in `skip` (sorted).
+        """
+        slots = np.flatnonzero(store.active[:store.size])
+        half = self.SPAN // 2
+        cx = np.floor_divide(store.x[slots], self.cell_size).astype(np.int64) + half
+        cz = np.floor_divide(store.z[slots], self.cell_size).astype(np.int64) + half
+        cell = cx * self.SPAN + cz
+        order = np.argsort(cell, kind='stable')
+        by_cell = slots[order]
+        cells, starts, counts = np.unique(cell[order], return_index=True, return_counts=True)
+        if not cells.size:
+            return NO_SLOTS, NO_SLOTS
+
+        rows, row_cell = slots, cell
+        if skip.size:
+            keep = ~in_sorted(store.num_id[slots], skip)
+            rows, row_cell = slots[keep], cell[keep]
+        viewers, others = [], []
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                target = row_cell + (dx * self.SPAN + dz)
+                pos = np.searchsorted(cells, target)
+                pos[pos == len(cells)] = 0
+                hit = cells[pos] == target
+                n = counts[pos[hit]]
+                total = int(n.sum())
+                if not total:
+                    continue
+                # Expand each viewer into one row per player of the target cell
+                first = np.repeat(starts[pos[hit]] - (np.cumsum(n) - n), n)
+                viewers.append(np.repeat(rows[hit], n))
+                others.append(by_cell[first + np.arange(total)])
+        if not viewers:
+            return NO_SLOTS, NO_SLOTS
+        viewers = np.concatenate(viewers)
+        others = np.concatenate(others)
+        distinct = viewers != others
+        return viewers[distinct], others[distinct]
+
+
+class InterestTracker:
+    """
+    Who-sees-whom for every client at once, with hysteresis: newcomers must
+    be within VIEW_RADIUS, visible players stay until VIEW_RADIUS +
+    VIEW_HYSTERESIS. Visible pairs are one sorted array of pair_keys plus
+    the tick each pair became visible; pairs that dropped out are logged for
+    SNAPSHOT_WINDOW ticks so delta snapshots can still report them as gone.
+    """
+    def __init__(self, radius=VIEW_RADIUS, hysteresis=VIEW_HYSTERESIS):
+        self.enter_r2 = radius * radius
+        self.exit_r2 = (radius + hysteresis) ** 2
+        self.grid = InterestGrid(radius + hysteresis)
+        self.keys = NO_KEYS      # sorted visible pairs
+        self.since = NO_TICKS    # tick each pair became visible
+        self.pending = []        # (keys, tick) announced between ticks
+        self.exit_keys = NO_KEYS
+        self.exit_since = NO_TICKS
+        self.exit_tick = NO_TICKS
+
+    def visible_from(self, store, slot):
+        """Sorted numeric ids within VIEW_RADIUS of one player (for joins)."""
+        others = np.flatnonzero(store.active[:store.size])
+        others = others[others != slot]
+        dx = store.x[others] - store.x[slot]
+        dz = store.z[others] - store.z[slot]
+        near = others[dx * dx + dz * dz <= self.enter_r2]
+        return np.sort(store.num_id[near])
+
+    def announce(self, keys, tick):
+        """Pairs the clients were already told about; they won't be re-sent as entered."""
+        self.pending.append((keys, tick))
+
+    def update(self, store, tick, frozen=NO_IDS, blind=NO_IDS):
+        """
+        Recompute visible pairs. Returns (keys, viewer slots, other slots,
+        since, entered mask, exited keys) with everything sorted by key.
+
+        Viewers in `frozen` (sorted numeric ids) are skipped: their pairs
+        are held as they were and left out of the result, so the first
+        update that includes them again reports everything that entered or
+        left since they were frozen. Ids in `blind` (sorted; NPCs) are
+        never viewers at all, though others still see them.
+        """
+        if self.pending:
+            keys = np.concatenate([self.keys] + [k for k, _ in self.pending])
+            since = np.concatenate([self.since] + [np.full(len(k), t) for k, t in self.pending])
+            self.keys, first = np.unique(keys, return_index=True)
+            self.since = since[first]
+            self.pending = []
+            if blind.size:
+                seen = ~viewer_rows(self.keys, blind)
+                self.keys, self.since = self.keys[seen], self.since[seen]
+
+        prev_keys, prev_since = self.keys, self.since
+        held_keys = NO_KEYS
+        if frozen.size:
+            held = viewer_rows(prev_keys, frozen)
+            held_keys, held_since = prev_keys[held], prev_since[held]
+            prev_keys, prev_since = prev_keys[~held], prev_since[~held]
+        skip = np.union1d(frozen, blind) if blind.size else frozen
+        viewers, others = self.grid.candidate_pairs(store, skip)
+        dx = store.x[others] - store.x[viewers]
+        dz = store.z[others] - store.z[viewers]
+        d2 = dx * dx + dz * dz
+        keys = pair_keys(store.num_id[viewers], store.num_id[others])
+        found, pos = lookup_sorted(keys, prev_keys)
+        keep = (d2 <= self.enter_r2) | (found & (d2 <= self.exit_r2))
+        order = np.argsort(keys[keep])
+        keys = keys[keep][order]
+        viewers = viewers[keep][order]
+        others = others[keep][order]
+        found = found[keep][order]
+        since = np.full(len(keys), tick, np.int64)
+        since[found] = prev_since[pos[keep][order][found]]
+
+        gone = ~in_sorted(prev_keys, keys)
+        exited = prev_keys[gone]
+        recent = self.exit_tick > tick - SNAPSHOT_WINDOW
+        self.exit_keys = np.concatenate([self.exit_keys[recent], exited])
+        self.exit_since = np.concatenate([self.exit_since[recent], prev_since[gone]])
+        self.exit_tick = np.concatenate([self.exit_tick[recent], np.full(len(exited), tick)])
+
+        if held_keys.size:
+            # Two sorted runs: a stable sort merges them in linear time
+            all_keys = np.concatenate([keys, held_keys])
+            order = np.argsort(all_keys, kind='stable')
+            self.keys = all_keys[order]
+            self.since = np.concatenate([since, held_since])[order]
+        else:
+            self.keys, self.since = keys, since
+        return keys, viewers, others, since, ~found, exited
+
+
+# ─── Delta Snapshots ─────────────────────────────────────────
+class ClientBaseline:
+    """
+    Snapshots sent to one client and the newest one it acknowledged.
+    A snapshot is remembered by the tick it was taken on: the store's
+    per-field tick stamps and the interest tracker's visibility ticks give
+    everything that changed since then. Each 'state' frame is a delta
+    against the acked snapshot (seq 0 is the empty snapshot, so a delta
+    against it is a full resync).
+    """
+    __slots__ = ('seq', 'sent', 'acked_seq', 'acked_tick')
+
+    def __init__(self):
+        self.seq = 0
+        self.sent = {}  # seq -> tick
+        self.reset()
+
+    def reset(self):
+        self.acked_seq = 0
+        self.acked_tick = -1
+        self.sent.clear()
+
+    def ack(self, seq):
+        if not isinstance(seq, int):
+            return
+        tick = self.sent.get(seq)
+        if tick is None or seq <= self.acked_seq:
+            return
+        self.acked_seq = seq
+        self.acked_tick = tick
+        self.sent = {s: t for s, t in self.sent.items() if s > seq}
+
+    def expire(self, tick):
+        """Fall back to a full resync once the acked snapshot is too old to diff against."""
+        if self.acked_seq and tick - self.acked_tick > SNAPSHOT_WINDOW:
+            self.reset()
+        elif len(self.sent) > SNAPSHOT_WINDOW:
+            self.sent = {s: t for s, t in self.sent.items() if t > tick - SNAPSHOT_WINDOW}
+
+    def next_seq(self, tick):
+        """(seq, base seq) for a new frame snapshotting `tick`."""
+        self.seq += 1
+        self.sent[self.seq] = tick
+        return self.seq, self.acked_seq
+
+
+def json_entries(store, slots, fields):
+    """'players' entries of a JSON 'state' frame: id plus the masked per-tick fields."""
+    cols = (
+        np.round(store.x[slots].astype(np.float64), 3).tolist(),
+        np.round(store.y[slots].astype(np.float64), 3).tolist(),
+        np.round(store.z[slots].astype(np.float64), 3).tolist(),
+        np.round(store.ry[slots].astype(np.float64), 3).tolist(),
+        [ANIM_STATES[a] for a in store.anim[slots].tolist()],
+    )
+    entries = []
+    for row, (pid, mask) in enumerate(zip(store.num_id[slots].tolist(), fields.tolist())):
+        entry = {k: col[row] for k, col, send in zip(DYNAMIC_FIELDS, cols, mask) if send}
+        entry['id'] = str(pid)
+        entries.append(entry)
+    return entries
+
+
+def encode_json_state(seq, base, tick, now_ms, entries, gone):
+    """JSON 'state' frame with only the changed fields of each changed player."""
+    frame = {
+        'type': 'state', 'seq': seq, 'base': base,
+        'tick': tick, 't': now_ms, 'players': entries
+    }
+    if gone.size:
+        frame['gone'] = [str(i) for i in gone.tolist()]
+    return json.dumps(frame)
+
+
+# ─── Binary Wire Format ──────────────────────────────────────
+# Optional protocol for the hot 'move' and 'state' messages, negotiated with
+# {"type": "join", "proto": "bin1"}. Control messages stay JSON text.
+WIRE_PROTOCOL = 'bin1'
+POS_SCALE = 64                  # 1/64 m steps; int16 covers ±512 m
+POS_LIMIT = 32767 / POS_SCALE   # moves are clamped to what the wire can carry
+RY_SCALE = 32768 / math.pi      # int16 covers [-π, π)
+
+MSG_STATE = 1
+MSG_MOVE = 2
+STATE_HEADER = struct.Struct('<BIIIdHH')  # kind, seq, base, tick, server ms, player count, gone count
+PLAYER_RECORD = np.dtype([                # one packed record per changed player
+    ('id', '<u4'), ('x', '<i2'), ('y', '<i2'), ('z', '<i2'), ('ry', '<i2'), ('anim', 'u1')
+])
+MOVE_RECORD = struct.Struct('<BhhhhBII')  # kind, x, y, z, ry, anim, ack, move seq
+MOVE_RECORD_V0 = struct.Struct('<BhhhhBI')  # same without the seq, from older clients
+
+
+def quantize_pos(col):
+    return np.clip(np.rint(col * POS_SCALE), -32768, 32767)
+
+
+def quantize_ry(col):
+    wrapped = np.mod(col.astype(np.float64) + math.pi, math.tau) - math.pi
+    return np.clip(np.rint(wrapped * RY_SCALE), -32768, 32767)
+
+
+def player_records(store, slots):
+    """Packed PLAYER_RECORD rows (always all per-tick fields), built column-wise."""
+    records = np.empty(len(slots), PLAYER_RECORD)
+    records['id'] = store.num_id[slots]
+    records['x'] = quantize_pos(store.x[slots])
+    records['y'] = quantize_pos(store.y[slots])
+    records['z'] = quantize_pos(store.z[slots])
+    records['ry'] = quantize_ry(store.ry[slots])
+    records['anim'] = store.anim[slots]
+    return records
+
+
+def encode_state(seq, base, tick, now_ms, records, gone):
+    """Pack a 'state' frame: header, one record per changed player, then the gone ids."""
+    header = STATE_HEADER.pack(MSG_STATE, seq, base, tick, now_ms, len(records), len(gone))
+    return header + records.tobytes() + gone.astype('<u4').tobytes()
+
+
+def decode_move(message):
+    """Unpack a binary 'move' into the same dict a JSON 'move' would give, or None."""
+    if not message or message[0] != MSG_MOVE:
+        return None
+    if len(message) == MOVE_RECORD.size:
+        _, x, y, z, ry, anim, ack, seq = MOVE_RECORD.unpack(message)
+    elif len(message) == MOVE_RECORD_V0.size:
+        (_, x, y, z, ry, anim, ack), seq = MOVE_RECORD_V0.unpack(message), None
+    else:
+        return None
+    move = {
+        'x': x / POS_SCALE, 'y': y / POS_SCALE, 'z': z / POS_SCALE,
+        'ry': ry / RY_SCALE,
+        'anim': ANIM_STATES[anim] if anim < len(ANIM_STATES) else 'idle',
+        'ack': ack
+    }
+    if seq is not None:
+        move['seq'] = seq
+    return move
+
+
+# ─── Snapshot History ────────────────────────────────────────
+class SnapshotHistory:
+    """
+    Ring buffer of the last `size` ticks of player positions, each stored
+    as packed PLAYER_RECORD rows sorted by id (13 bytes per player per
+    tick), for answering "where was everyone as of tick T".
+    """
+    def __init__(self, size=SNAPSHOT_HISTORY):
+        self.size = size
+        self.ticks = np.full(size, -1, np.int64)
+        self.times = np.zeros(size, np.float64)  # server ms each tick was taken at
+        self.frames = [None] * size
+
+    def record(self, tick, now_ms, records):
+        i = tick % self.size
+        self.ticks[i] = tick
+        self.times[i] = now_ms
+        self.frames[i] = records[np.argsort(records['id'], kind='stable')]
+
+    @property
+    def oldest(self):
+        kept = self.ticks[self.ticks >= 0]
+        return int(kept.min()) if kept.size else None
+
+    def at(self, tick):
+        """(tick, records) of the newest snapshot taken at or before `tick`, or None."""
+        kept = np.flatnonzero((self.ticks >= 0) & (self.ticks <= tick))
+        if not kept.size:
+            return None
+        i = kept[np.argmax(self.ticks[kept])]
+        return int(self.ticks[i]), self.frames[i]
+
+    def tick_at(self, server_ms):
+        """Newest recorded tick taken at or before `server_ms`, or None."""
+        kept = np.flatnonzero((self.ticks >= 0) & (self.times <= server_ms))
+        return int(self.ticks[kept[np.argmax(self.ticks[kept])]]) if kept.size else None
+
+    def positions(self, tick, num_ids):
+        """
+        (found mask, x, y, z) of the given numeric ids as of `tick`; rows
+        not found are meaningless. Ticks older than the buffer resolve to
+        the oldest snapshot kept.
+        """
+        oldest = self.oldest
+        snap = self.at(max(tick, oldest)) if oldest is not None else None
+        if snap is None or not snap[1].size:
+            zero = np.zeros(len(num_ids), np.float32)
+            return np.zeros(len(num_ids), np.bool_), zero, zero, zero
+        records = snap[1]
+        found, pos = lookup_sorted(np.asarray(num_ids, np.uint32), records['id'])
+        rows = records[pos]
+        return found, rows['x'] / POS_SCALE, rows['y'] / POS_SCALE, rows['z'] / POS_SCALE
+
+    def stats(self):
+        kept = self.ticks >= 0
+        return {'ticks': int(kept.sum()), 'oldest': self.oldest,
+                'bytes': sum(f.nbytes for f in self.frames if f is not None)}
+
+
+# ─── Compression ─────────────────────────────────────────────
+# type -> (minimum size in bytes, zlib level); level 0 never compresses and
+# 'type:bin' applies to binary frames. Per-tick traffic gets a cheap level
+# (3 costs about half the CPU of 6 for ~15% more bytes on JSON state),
+# packed binary state barely compresses, and one-off large messages get the
+# best ratio
+COMPRESSION_POLICY = {
+    'state': (COMPRESSION_MIN_SIZE, 3),
+    'state:bin': (1024, 1),
+    'batch': (COMPRESSION_MIN_SIZE, 3),
+    'interest': (COMPRESSION_MIN_SIZE, 3),
+    'whiteboard': (COMPRESSION_MIN_SIZE, 6),
+    'player_list': (COMPRESSION_MIN_SIZE, 9),
+    'world': (COMPRESSION_MIN_SIZE, 9),
+    'dict': (0, 9),
+    'voice_talking': (0, 0),
+}
+DEFAULT_COMPRESSION = (COMPRESSION_MIN_SIZE, 3)
+
+# Sent (compressed) right after connecting so the keys and shapes of
+# common messages are already in the client's window
+COMPRESSION_PRIMER = json.dumps({'type': 'dict', 'samples': [
+    {'type': 'appearance_update', 'id': '1', 'data': {'hairStyle': 'short', 'hairColor': 0, 'shirtType': 'tshirt'}},
+    {'type': 'world_edit', 'id': '1', 'ref': 1, 'seq': 1, 'action': 'move', 'oid': 1, 'data': {
+        'type': 'cube', 'pos': {'x': 0.0, 'y': 0.0, 'z': 0.0}, 'rot': {'x': 0.0, 'y': 0.0, 'z': 0.0},
+        'scl': {'x': 1.0, 'y': 1.0, 'z': 1.0}}},
+    {'type': 'whiteboard', 'data': {'type': 'strokes', 'strokes': [
+        {'id': '1', 'color': '#ffffff', 'size': 4, 'points': [0, 0]}]}},
+    {'type': 'voice_talking', 'id': '1', 'talking': False},
+    {'type': 'chat', 'id': '1', 'name': 'Player 1', 'message': '', 'color': 0},
+    {'type': 'player_leave', 'id': '1'},
+    {'type': 'player_join', 'id': '1', 'name': 'Player 1', 'color': 0, 'x': 0.0, 'y': 0, 'z': 0.0, 'visible': True},
+    {'type': 'interest', 'enter': [{'id': '1', 'name': 'Player 1', 'color': 0, 'x': 0.0, 'y': 0.0, 'z': 0.0,
+                                    'ry': 0.0, 'anim': 'idle'}], 'exit': []},
+    {'type': 'batch', 'messages': [{'type': 'state', 'seq': 1, 'base': 0, 'tick': 1, 't': 0, 'players': [
+        {'id': '1', 'x': 0.0, 'z': 0.0, 'ry': 0.0, 'anim': 'walk'}], 'gone': []}]},
+]})
+
+
+class AdaptiveDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that decides per message, by the type the Outbox
+    tagged it with (`kind`), whether to compress and how hard.
+
+    Messages at the same level share one streaming compressor, as with
+    plain permessage-deflate. Switching level starts a new compressor
+    preset with the last COMPRESSION_WINDOW bytes the client inflated, so
+    cross-message context survives the switch. Messages sent uncompressed
+    never enter the client's window. In `lean` mode (idle clients) the
+    compressor is dropped after every message and rebuilt from the window.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoder = None  # created for the first compressed message
+        self.level = None    # ... and recreated when the level changes
+        self.lean = False
+        self.kind = 'other'
+        self.window = b''
+        self.window_size = min(COMPRESSION_WINDOW, 2 ** self.local_max_window_bits)
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        kind = self.kind
+        policy = COMPRESSION_POLICY.get(kind, DEFAULT_COMPRESSION)
+        if frame.opcode is BINARY:
+            policy = COMPRESSION_POLICY.get(kind + ':bin', policy)
+        min_size, level = policy
+        # Fragmented messages (never sent here) simply go out uncompressed
+        if level == 0 or len(frame.data) < min_size or frame.opcode is CONT or not frame.fin:
+            COMPRESSION_SKIPPED.inc(kind)
+            return frame
+        started = time.thread_time()
+        takeover = not self.local_no_context_takeover
+        if self.encoder is None or level != self.level:
+            zdict = {'zdict': self.window} if takeover and self.window else {}
+            self.encoder = zlib.compressobj(level, wbits=-self.local_max_window_bits, **self.compress_settings, **zdict)
+            self.level = level
+        # A sync flush ends in 00 00 ff ff, which the receiver adds back
+        data = (self.encoder.compress(frame.data) + self.encoder.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        if takeover:
+            self.window = (self.window + frame.data)[-self.window_size:]
+        if not takeover or self.lean:
+            self.encoder = None
+        COMPRESSION_SECONDS.inc(kind, n=time.thread_time() - started)
+        COMPRESSION_RAW_BYTES.inc(kind, n=len(frame.data))
+        COMPRESSION_WIRE_BYTES.inc(kind, n=len(data))
+        return Frame(frame.opcode, data, frame.fin, True, frame.rsv2, frame.rsv3)
+
+    def footprint(self):
+        """Approximate bytes held for this connection's outbound compression."""
+        size = len(self.window)
+        if self.encoder is not None:
+            # zlib's deflate state: window and hash tables, plus the pending buffer
+            mem_level = self.compress_settings.get('memLevel', 8)
+            size += (1 << (self.local_max_window_bits + 2)) + (1 << (mem_level + 9))
+        return size
+
+
+class AdaptiveDeflateFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate like websockets does, with AdaptiveDeflate as the codec."""
+    def process_request_params(self, params, accepted_extensions):
+        response, ext = super().process_request_params(params, accepted_extensions)
+        return response, AdaptiveDeflate(
+            ext.remote_no_context_takeover, ext.local_no_context_takeover,
+            ext.remote_max_window_bits, ext.local_max_window_bits, ext.compress_settings)
+
+
+def compression_options(mode=WS_COMPRESSION):
+    """websockets.serve() keyword arguments for a WS_COMPRESSION mode."""
+    if mode == 'off':
+        return {'compression': None}
+    if mode == 'deflate':
+        return {'compression': 'deflate'}
+    return {'compression': None, 'extensions': [AdaptiveDeflateFactory(compress_settings={'memLevel': 5})]}
+
+
+def adaptive_deflate(ws):
+    """The connection's AdaptiveDeflate, if it negotiated one."""
+    protocol = getattr(ws, 'protocol', None)
+    return next((e for e in getattr(protocol, 'extensions', ()) if isinstance(e, AdaptiveDeflate)), None)
+
+
+def compression_stats():
+    """Per message type: messages skipped, bytes in/out and CPU spent, from the counters."""
+    stats = {}
+    for (kind,), raw in COMPRESSION_RAW_BYTES.values.items():
+        wire = COMPRESSION_WIRE_BYTES.values.get((kind,), 0)
+        stats[kind] = {'raw_bytes': raw, 'wire_bytes': wire, 'ratio': round(wire / raw, 3) if raw else None,
+                       'cpu_ms': round(COMPRESSION_SECONDS.values.get((kind,), 0) * 1000, 2)}
+    for (kind,), n in COMPRESSION_SKIPPED.values.items():
+        stats.setdefault(kind, {})['skipped'] = n
+    return {'mode': WS_COMPRESSION, 'types': stats}
+
+
+# ─── Outbound Pipeline ───────────────────────────────────────
+# What happens to a queued message when its client can't keep up:
+#   supersede — only the newest queued one is kept (state snapshots)
+#   droppable — discarded once the queue is half full (cosmetic events)
+#   reliable  — always delivered; overflowing the queue disconnects the client
+SUPERSEDE, DROPPABLE, RELIABLE = 'supersede', 'droppable', 'reliable'
+MESSAGE_POLICY = {
+    'state': SUPERSEDE,
+    'voice_talking': DROPPABLE,
+}
+
+
+class Outbox:
+    """
+    Bounded send queue for one connection, drained by its own writer task so
+    a slow socket only ever delays itself. Payloads arrive pre-serialized,
+    letting a broadcast encode once and share the same object everywhere.
+
+    Events are usually defer()red instead of pushed: the room's tick then
+    flush()es them as a single 'batch' frame.
+    """
+    def __init__(self, ws, limit=SEND_QUEUE_LIMIT):
+        self.ws = ws
+        self.limit = limit
+        self.full_limit = limit
+        self.lean = False     # idle client: see set_lean()
+        self.queue = deque()  # [payload, policy, kind, queued at]; payload None once superseded
+        self.pending = 0      # live entries in queue
+        self.latest = None    # queued SUPERSEDE entry, if any
+        self.events = []      # [payload, kind] deferred until this tick's flush()
+        self.deflate = adaptive_deflate(ws)
+        self.closed = False
+        self.opened_at = time.monotonic()
+        self.sent = 0         # messages and payload bytes written, ...
+        self.bytes_sent = 0
+        self.mode_at = (self.opened_at, 0)  # ... and (time, bytes_sent) at the last set_lean()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._writer())
+
+    def push(self, payload, policy=RELIABLE, kind='other'):
+        """Queue a payload; returns False if it was dropped. `kind` is its message type, for metrics."""
+        if self.closed:
+            return False
+        if policy == SUPERSEDE:
+            if self.latest is not None:
+                self.latest[0] = None
+                self.pending -= 1
+                MESSAGES_DROPPED.inc(self.latest[2], 'superseded')
+        elif policy == DROPPABLE:
+            if self.shed(kind):
+                return False
+        elif self.pending >= self.limit:
+            MESSAGES_DROPPED.inc(kind, 'slow_consumer')
+            self.close()  # slow consumer
+            return False
+
+        SEND_QUEUE_DEPTH.observe(self.pending)
+        entry = [payload, policy, kind, time.monotonic()]
+        if policy == SUPERSEDE:
+            self.latest = entry
+        self.queue.append(entry)
+        self.pending += 1
+        self.wakeup.set()
+        return True
+
+    def defer(self, payload, policy=RELIABLE, kind='other'):
+        """Hold an encoded JSON message for this tick's batch; returns False if it was dropped."""
+        if self.closed:
+            return False
+        if policy == DROPPABLE and self.shed(kind):
+            return False
+        self.events.append((payload, kind))
+        return True
+
+    def shed(self, kind):
+        """Whether to drop a DROPPABLE message: always for idle clients, else once the queue is half full."""
+        if self.lean or self.pending >= self.limit // 2:
+            MESSAGES_DROPPED.inc(kind, 'idle' if self.lean else 'queue_full')
+            return True
+        return False
+
+    def set_lean(self, lean):
+        """
+        Switch low-footprint mode for an idle client: a short send queue,
+        a small socket write buffer and no compressor kept between messages.
+        """
+        if lean == self.lean:
+            return
+        self.lean = lean
+        self.limit = min(IDLE_QUEUE_LIMIT, self.full_limit) if lean else self.full_limit
+        self.mode_at = (time.monotonic(), self.bytes_sent)
+        if self.deflate is not None:
+            self.deflate.lean = lean
+            if lean:
+                self.deflate.encoder = None
+        transport = getattr(self.ws, 'transport', None)
+        if transport is not None and not transport.is_closing():
+            if lean:
+                transport.set_write_buffer_limits(IDLE_WRITE_BUFFER)
+            else:
+                transport.set_write_buffer_limits(self.ws.write_limit_high, self.ws.write_limit_low)
+
+    def stats(self):
+        """Bandwidth and approximate memory of this connection's outbound side."""
+        now = time.monotonic()
+        since, base = self.mode_at
+        transport = getattr(self.ws, 'transport', None)
+        memory = {
+            'queue': sum(len(e[0]) for e in self.queue if e[0] is not None) + sum(len(p) for p, _ in self.events),
+            'socket': transport.get_write_buffer_size() if transport is not None else 0,
+            'deflate': self.deflate.footprint() if self.deflate is not None else 0,
+        }
+        memory['total'] = sum(memory.values())
+        return {
+            'lean': self.lean,
+            'pending': self.pending,
+            'limit': self.limit,
+            'sent': self.sent,
+            'bytes_sent': self.bytes_sent,
+            'bytes_per_s': round(self.bytes_sent / max(now - self.opened_at, 1e-3)),
+            'mode_bytes_per_s': round((self.bytes_sent - base) / max(now - since, 1e-3)),
+            'memory': memory,
+        }
+
+    def flush(self, state=None):
+        """
+        Queue the tick's deferred events as one frame, then `state` (if
+        any). A JSON state rides inside the batch while the client keeps up;
+        otherwise it's queued on its own so a newer one can supersede it.
+        """
+        events = self.events
+        if state is not None and events and isinstance(state, str) and not self.pending:
+            events.append((state, 'state'))
+            state = None
+        if len(events) == 1:
+            self.push(events[0][0], MESSAGE_POLICY.get(events[0][1], RELIABLE), events[0][1])
+        elif events:
+            for _, kind in events:
+                EVENTS_BATCHED.inc(kind)
+            self.push('{"type": "batch", "messages": [' + ', '.join(p for p, _ in events) + ']}', RELIABLE, 'batch')
+        if events:
+            self.events = []
+        if state is not None:
+            self.push(state, SUPERSEDE, 'state')
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                entry = self.queue.popleft()
+                payload, _, kind, queued_at = entry
+                if payload is None:
+                    continue
+                self.pending -= 1
+                if entry is self.latest:
+                    self.latest = None
+                SEND_DELAY_SECONDS.observe(time.monotonic() - queued_at, kind)
+                if self.deflate is not None:
+                    self.deflate.kind = kind  # this writer is the connection's only sender
+                await self.ws.send(payload)
+                self.sent += 1
+                self.bytes_sent += len(payload)
+                MESSAGES_OUT.inc(kind)
+                BYTES_OUT.inc(kind, n=len(payload))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.close()
+
+    def close(self):
+        """Stop sending and drop the socket; the handler's cleanup does the rest."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.events = []
+        self.latest = None
+        self.task.cancel()
+        transport = getattr(self.ws, 'transport', None)
+        if transport is not None:
+            transport.abort()
+
+
+# ─── Tick Scheduler ──────────────────────────────────────────
+class TickScheduler:
+    """
+    Fixed-timestep loop on the monotonic clock. Tick n is due at
+    start + n * period, so tick cost never stretches the period. Late ticks
+    are caught up or skipped per `policy`; skipped ticks still advance the
+    tick counter so tick numbers keep tracking elapsed time.
+
+    Other periodic work registers with every() instead of running its own
+    asyncio.sleep loop. Jobs may be plain functions or coroutine functions;
+    coroutines are spawned as tasks so slow I/O never stretches a tick.
+    """
+    def __init__(self, rate=TICK_RATE, policy=TICK_POLICY, max_catchup=TICK_MAX_CATCHUP, name='room'):
+        if policy not in ('catchup', 'skip'):
+            raise ValueError(f"unknown tick policy: {policy!r}")
+        self.name = name  # metrics label
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.policy = policy
+        self.max_catchup = max_catchup
+        self.tick = 0
+        self.jobs = []  # [interval in ticks, fn]
+        self.tasks = set()  # coroutine jobs still running
+        # Counters
+        self.overruns = 0       # ticks whose work took longer than a period
+        self.skipped = 0        # ticks dropped instead of run
+        self.caught_up = 0      # ticks run late to catch up
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+
+    def every(self, seconds, fn):
+        """Call fn(tick) every `seconds` (rounded to whole ticks)."""
+        self.jobs.append([max(1, round(seconds * self.rate)), fn])
+
+    def on_tick(self, fn):
+        """Call fn(tick) on every tick."""
+        self.jobs.append([1, fn])
+
+    def stats(self):
+        return {
+            'tick': self.tick,
+            'rate': self.rate,
+            'policy': self.policy,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'caught_up': self.caught_up,
+            'last_tick_ms': round(self.last_duration * 1000, 3),
+            'max_tick_ms': round(self.max_duration * 1000, 3),
+        }
+
+    def _run_jobs(self):
+        for interval, fn in self.jobs:
+            if self.tick % interval:
+                continue
+            try:
+                result = fn(self.tick)
+                if asyncio.iscoroutine(result):
+                    task = asyncio.create_task(result)
+                    self.tasks.add(task)
+                    task.add_done_callback(partial(self._job_done, fn))
+            except Exception as e:
+                self._job_failed(fn, e)
+
+    def _job_done(self, fn, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._job_failed(fn, task.exception())
+
+    @staticmethod
+    def _job_failed(fn, error):
+        log('tick_error', '[!] Tick job {job} failed: {error}',
+            job=getattr(fn, '__name__', repr(fn)), error=str(error))
+
+    async def run(self, offset=0.0):
+        next_at = time.monotonic() + offset
+        while True:
+            now = time.monotonic()
+            if now < next_at:
+                await asyncio.sleep(next_at - now)
+                continue
+
+            behind = int((now - next_at) / self.period)  # whole periods missed
+            if behind:
+                drop = behind if self.policy == 'skip' else max(0, behind - self.max_catchup)
+                self.skipped += drop
+                self.tick += drop
+                if drop:
+                    TICKS_SKIPPED.inc(self.name, n=drop)
+                next_at += drop * self.period
+                if behind > drop:
+                    self.caught_up += 1  # this tick runs late, back to back
+
+            self.tick += 1
+            started = time.monotonic()
+            self._run_jobs()
+            self.last_duration = time.monotonic() - started
+            self.max_duration = max(self.max_duration, self.last_duration)
+            TICK_SECONDS.observe(self.last_duration, self.name)
+            if self.last_duration > self.period:
+                self.overruns += 1
+                TICK_OVERRUN_SECONDS.observe(self.last_duration - self.period, self.name)
+            next_at += self.period
+            # Let socket I/O run between back-to-back catch-up ticks
+            await asyncio.sleep(0)
+
+
+# ─── Worker Bus ──────────────────────────────────────────────
+# With WORKERS > 1 a supervisor process runs the bus hub on a Unix socket
+# and spawns WORKERS server processes sharing PORT via SO_REUSEPORT. Each
+# worker owns the players connected to it and mirrors everyone else's from
+# the bus. Frames are length-prefixed: JSON ops (join, leave, event, hello,
+# load, down, session/revoke, and world_* for the editor objects worker 0
+# owns) or packed BUS_RECORD rows of players that moved this tick.
+BUS_FRAME = struct.Struct('<IB')  # payload length, kind
+BUS_JSON = 0
+BUS_STATE = 1
+BUS_RECORD = np.dtype([
+    ('id', '<u4'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('ry', '<f4'), ('anim', 'u1')
+])
+
+
+async def read_frame(reader):
+    size, kind = BUS_FRAME.unpack(await reader.readexactly(BUS_FRAME.size))
+    return kind, await reader.readexactly(size)
+
+
+def pack_frame(kind, payload):
+    return BUS_FRAME.pack(len(payload), kind) + payload
+
+
+class BusHub:
+    """
+    Star relay in the supervisor: every frame from one worker is copied to
+    all the others. It only looks inside 'hello' (to know which worker a
+    socket belongs to, and announce 'down' when it goes) and 'load'.
+    """
+    def __init__(self, path=BUS_PATH):
+        self.path = path
+        self.peers = {}  # writer -> worker number (None until its hello)
+        self.load = {}   # worker number -> connection count
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket from a previous run
+        return await asyncio.start_unix_server(self._peer, path=self.path)
+
+    def _relay(self, frame, source=None):
+        for writer in self.peers:
+            if writer is not source:
+                writer.write(frame)
+
+    async def _peer(self, reader, writer):
+        self.peers[writer] = None
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == BUS_JSON:
+                    msg = json.loads(payload)
+                    if msg.get('op') == 'hello':
+                        self.peers[writer] = msg['worker']
+                    elif msg.get('op') == 'load':
+                        self.load[msg['worker']] = msg['connections']
+                self._relay(pack_frame(kind, payload), writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            worker = self.peers.pop(writer, None)
+            writer.close()
+            if worker is not None:
+                self.load.pop(worker, None)
+                self._relay(pack_frame(BUS_JSON, json.dumps({'op': 'down', 'worker': worker}).encode()))
+
+
+class WorkerBus:
+    """
+    A worker's connection to the hub. Publishing never blocks the game
+    loop: frames go straight into the socket's buffer and are dropped
+    while disconnected. Incoming frames are handed to `on_frame(kind, payload)`.
+    """
+    def __init__(self, worker, on_frame, path=BUS_PATH):
+        self.worker = worker
+        self.on_frame = on_frame
+        self.path = path
+        self.writer = None
+
+    async def run(self):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(0.2)  # hub not up yet
+                continue
+            self.publish({'op': 'hello', 'worker': self.worker})
+            try:
+                while True:
+                    self.on_frame(*await read_frame(reader))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                log('bus_lost', '[!] Worker {worker}: bus connection lost', worker=self.worker)
+            finally:
+                self.writer = None
+            # Everything mirrored from other workers is stale now
+            self.on_frame(BUS_JSON, json.dumps({'op': 'down', 'worker': None}).encode())
+
+    def publish(self, message):
+        self._send(BUS_JSON, json.dumps(message).encode())
+
+    def publish_state(self, records):
+        self._send(BUS_STATE, records.tobytes())
+
+    def _send(self, kind, payload):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(pack_frame(kind, payload))
+
+
+# ─── Whiteboard ──────────────────────────────────────────────
+# Each room has one board. Incoming segments are coalesced per author into
+# strokes and broadcast once per tick; history is kept for joiners, with
+# the oldest strokes flattened into a bitmap once it grows past
+# WHITEBOARD_HISTORY_POINTS. Points are integer canvas pixels.
+WHITEBOARD_WIDTH, WHITEBOARD_HEIGHT = 1200, 700   # the client's canvas
+WHITEBOARD_MAX_SIZE = 64
+RASTER_OPAQUE = 0xFF000000
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; take() grants what's available."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, n):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        granted = min(n, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+
+def parse_color(value):
+    """'#rrggbb' -> 0xRRGGBB, or None."""
+    if not isinstance(value, str) or len(value) != 7 or value[0] != '#':
+        return None
+    try:
+        return int(value[1:], 16)
+    except ValueError:
+        return None
+
+
+def stroke_points(values):
+    """Flat [x, y, ...] list clamped to the canvas, or None."""
+    if not isinstance(values, list) or len(values) < 4 or len(values) % 2:
+        return None
+    try:
+        pts = np.array(values, np.float64).reshape(-1, 2)
+    except (TypeError, ValueError):
+        return None
+    if not np.isfinite(pts).all():
+        return None
+    pts = np.rint(pts)
+    np.clip(pts[:, 0], 0, WHITEBOARD_WIDTH - 1, out=pts[:, 0])
+    np.clip(pts[:, 1], 0, WHITEBOARD_HEIGHT - 1, out=pts[:, 1])
+    return pts.astype(int).ravel().tolist()
+
+
+def rasterize(raster, strokes):
+    """Draw strokes ([color, size, points]) into an ABGR uint32 bitmap with round caps."""
+    h, w = raster.shape
+    for color, size, points in strokes:
+        rgb = parse_color(color)
+        value = RASTER_OPAQUE | ((rgb & 0xFF) << 16) | (rgb & 0xFF00) | (rgb >> 16)
+        r = size / 2
+        pts = np.array(points, np.float64).reshape(-1, 2)
+        for (x1, y1), (x2, y2) in zip(pts[:-1], pts[1:]):
+            x0, x3 = int(max(0, min(x1, x2) - r)), int(min(w, max(x1, x2) + r + 1))
+            y0, y3 = int(max(0, min(y1, y2) - r)), int(min(h, max(y1, y2) + r + 1))
+            px = np.arange(x0, x3)[None, :] - x1
+            py = np.arange(y0, y3)[:, None] - y1
+            dx, dy = x2 - x1, y2 - y1
+            t = np.clip((px * dx + py * dy) / max(dx * dx + dy * dy, 1e-9), 0, 1)
+            mask = (px - t * dx) ** 2 + (py - t * dy) ** 2 <= r * r
+            raster[y0:y3, x0:x3][mask] = value
+    return raster
+
+
+def encode_raster(raster):
+    """Run-length encode a bitmap: base64 little-endian u32 run lengths and values."""
+    flat = raster.ravel()
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    lengths = np.diff(np.append(starts, flat.size))
+    return {
+        'w': raster.shape[1],
+        'h': raster.shape[0],
+        'runs': base64.b64encode(lengths.astype('<u4').tobytes()).decode(),
+        'values': base64.b64encode(flat[starts].astype('<u4').tobytes()).decode(),
+    }
+
+
+def fold_raster(raster, strokes):
+    """Worker-thread job: the bitmap with `strokes` drawn in, and its encoding."""
+    if raster is None:
+        raster = np.zeros((WHITEBOARD_HEIGHT, WHITEBOARD_WIDTH), np.uint32)
+    else:
+        raster = raster.copy()
+    rasterize(raster, strokes)
+    return raster, encode_raster(raster)
+
+
+class Whiteboard:
+    """
+    A room's shared board. draw() only buffers; flush() (once per tick)
+    returns the strokes to broadcast and moves them into the history that
+    replay_message() sends to joiners.
+    """
+    def __init__(self):
+        self.pending = {}        # author id -> strokes drawn this tick
+        self.history = deque()   # [color, size, points], oldest first
+        self.points = 0          # points in history
+        self.last = {}           # author id -> their newest history stroke, to extend
+        self.raster = None       # bitmap of strokes folded out of history
+        self.raster_json = None
+        self.folding = False
+        self.generation = 0      # bumped by clear() to discard a fold in flight
+        self.ink = {}            # author id -> TokenBucket
+        self.replay = None       # cached replay payload
+        self.dropped = 0         # points refused by the ink limit
+
+    def __bool__(self):
+        return bool(self.history) or self.raster is not None
+
+    def draw(self, author, data):
+        """Buffer a 'stroke' (or older single-segment 'line') from a client."""
+        if not isinstance(data, dict):
+            return
+        if data.get('type') == 'line':
+            data = {**data, 'points': [data.get('x1'), data.get('y1'), data.get('x2'), data.get('y2')]}
+        elif data.get('type') != 'stroke':
+            return
+        points = stroke_points(data.get('points'))
+        color = data.get('color')
+        size = data.get('size')
+        if points is None or parse_color(color) is None or not isinstance(size, (int, float)):
+            return
+        size = max(1, min(WHITEBOARD_MAX_SIZE, round(size)))
+
+        bucket = self.ink.get(author)
+        if bucket is None:
+            bucket = self.ink[author] = TokenBucket(WHITEBOARD_INK_RATE, WHITEBOARD_INK_BURST)
+        granted = bucket.take(len(points) // 2)
+        self.dropped += len(points) // 2 - granted
+        if granted < 2:
+            return
+        points = points[:granted * 2]
+
+        strokes = self.pending.setdefault(author, [])
+        prev = strokes[-1] if strokes else None
+        if prev and prev['color'] == color and prev['size'] == size and prev['points'][-2:] == points[:2]:
+            prev['points'].extend(points[2:])
+        else:
+            strokes.append({'id': author, 'color': color, 'size': size, 'points': points})
+
+    def flush(self):
+        """Strokes buffered since the last tick (recorded into history), or []."""
+        if not self.pending:
+            return []
+        strokes = [s for batch in self.pending.values() for s in batch]
+        self.pending = {}
+        self.record(strokes)
+        return strokes
+
+    def record(self, strokes):
+        """Add broadcast strokes to the history, continuing each author's last stroke."""
+        for s in strokes:
+            last = self.last.get(s['id'])
+            pts = s['points']
+            if last and last[0] == s['color'] and last[1] == s['size'] and last[2][-2:] == pts[:2]:
+                last[2].extend(pts[2:])
+                self.points += len(pts) // 2 - 1
+            else:
+                last = self.last[s['id']] = [s['color'], s['size'], list(pts)]
+                self.history.append(last)
+                self.points += len(pts) // 2
+        self.replay = None
+        if self.points > WHITEBOARD_HISTORY_POINTS and not self.folding:
+            self.fold()
+
+    def fold(self):
+        """Flatten the oldest half of the history into the bitmap off the event loop."""
+        strokes, points = [], 0
+        for stroke in self.history:
+            if self.points - points <= WHITEBOARD_HISTORY_POINTS // 2:
+                break
+            strokes.append(stroke)
+            points += len(stroke[2]) // 2
+        # Folded strokes are frozen: nobody extends them any more
+        frozen = {id(s) for s in strokes}
+        self.last = {a: s for a, s in self.last.items() if id(s) not in frozen}
+        self.folding = True
+        future = asyncio.get_running_loop().run_in_executor(None, fold_raster, self.raster, strokes)
+        future.add_done_callback(partial(self._folded, len(strokes), points, self.generation))
+
+    def _folded(self, count, points, generation, future):
+        if generation != self.generation:
+            return
+        self.folding = False
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.raster, self.raster_json = future.result()
+        for _ in range(count):
+            self.history.popleft()
+        self.points -= points
+        self.replay = None
+
+    def clear(self):
+        self.pending = {}
+        self.history.clear()
+        self.points = 0
+        self.last = {}
+        self.raster = self.raster_json = None
+        self.folding = False
+        self.generation += 1
+        self.replay = None
+
+    def forget(self, author):
+        self.pending.pop(author, None)
+        self.last.pop(author, None)
+        self.ink.pop(author, None)
+
+    def replay_message(self):
+        """Pre-encoded board for a joiner: bitmap (if any) plus the stroke history."""
+        if self.replay is None:
+            self.replay = json.dumps({'type': 'whiteboard', 'data': {
+                'type': 'replay', 'raster': self.raster_json, 'strokes': list(self.history),
+            }}, separators=(',', ':'))
+        return self.replay
+
+    def stats(self):
+        return {'strokes': len(self.history), 'points': self.points,
+                'raster': self.raster is not None, 'dropped_points': self.dropped}
+
+
+# ─── Topics ──────────────────────────────────────────────────
+# Chat, voice, whiteboard and world events only go to connections
+# subscribed to their topic. A topic is a base name, optionally narrowed
+# as 'base:name' (a chat channel, a voice group). Clients that don't list
+# topics on join are subscribed to every base topic, as before.
+TOPICS = ('chat', 'voice', 'whiteboard', 'world')
+
+
+def topic_name(requested):
+    """Sanitized 'base' or 'base:name' topic, or None when the base is unknown."""
+    if not isinstance(requested, str):
+        return None
+    base, _, name = requested.partition(':')
+    if base not in TOPICS:
+        return None
+    name = ''.join(c for c in name.lower() if c.isalnum() or c in '-_')[:32]
+    return f'{base}:{name}' if name else base
+
+
+def topic_names(requested):
+    """Valid, de-duplicated topics from a client's list."""
+    if not isinstance(requested, list):
+        return []
+    names = (topic_name(t) for t in requested[:len(TOPICS) * 4])
+    return list(dict.fromkeys(t for t in names if t is not None))
+
+
+class Topics:
+    """Topic -> subscribed connection ids, plus the reverse for cleanup."""
+    def __init__(self):
+        self.members = {}   # topic -> set of ids
+        self.of = {}        # id -> set of topics
+
+    def __getitem__(self, topic):
+        return self.members.get(topic, ())
+
+    def subscribe(self, pid, topics):
+        """Add pid to each topic; returns the ones it wasn't already in."""
+        mine = self.of.setdefault(pid, set())
+        added = [t for t in topics if t not in mine]
+        for t in added:
+            mine.add(t)
+            self.members.setdefault(t, set()).add(pid)
+        return added
+
+    def unsubscribe(self, pid, topics):
+        mine = self.of.get(pid, set())
+        for t in topics:
+            if t in mine:
+                mine.discard(t)
+                members = self.members[t]
+                members.discard(pid)
+                if not members:
+                    del self.members[t]
+
+    def drop(self, pid):
+        self.unsubscribe(pid, list(self.of.get(pid, ())))
+        self.of.pop(pid, None)
+
+    def stats(self):
+        return {t: len(members) for t, members in sorted(self.members.items())}
+
+
+# ─── NPCs ────────────────────────────────────────────────────
+# Ambient agents are simulated once per room on the game tick rather than
+# in every browser. They live in the room's PlayerStore under reserved
+# ids, so they reach clients through the same interest, delta snapshot
+# and history paths as players; clients only render them, and pick what
+# to say when told an NPC greeted them.
+NPC_ID_BASE = 4_000_000_000   # NPC i is NPC_ID_BASE + i, far above any player id
+NPC_TURN_RATE = 2.0           # radians per second, toward the next waypoint
+NPC_FACE_RATE = 3.0           # ... and toward the nearest player in range
+NPC_ARRIVE = 0.5              # waypoint reached within this distance
+DEFAULT_NPCS = (
+    {'kind': 'topic', 'name': 'Instructor Sarah',
+     'waypoints': [[-35, 36], [-25, 30], [-30, 25], [-40, 25]]},
+    {'kind': 'fpv', 'name': 'Captain DJI',
+     'waypoints': [[0, -50], [15, -45], [15, -65], [-15, -65], [-15, -45]]},
+)
+
+
+def load_npcs(path=NPC_FILE):
+    """NPC definitions: kind, name, waypoints [[x, z], ...] and optional speed and radius."""
+    if not path:
+        return DEFAULT_NPCS
+    with open(path, encoding='utf-8') as f:
+        defs = json.load(f)
+    if not isinstance(defs, list):
+        raise ValueError(f"{path}: expected a list of NPC definitions")
+    for i, d in enumerate(defs):
+        check_npc(d, f"{path}: NPC {i}")
+    return defs
+
+
+def is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def check_npc(d, where):
+    """Raise ValueError unless `d` is a usable NPC definition (NpcCrowd does no checks of its own)."""
+    if not isinstance(d, dict):
+        raise ValueError(f"{where}: expected an object")
+    for key in ('kind', 'name'):
+        if not isinstance(d.get(key), str) or not d[key]:
+            raise ValueError(f"{where}: {key!r} must be a non-empty string")
+    points = d.get('waypoints')
+    if not isinstance(points, list) or not points:
+        raise ValueError(f"{where}: 'waypoints' must list at least one [x, z]")
+    for p in points:
+        if not (isinstance(p, list) and len(p) == 2 and all(is_number(v) for v in p)):
+            raise ValueError(f"{where}: bad waypoint {p!r}, expected [x, z]")
+    for key in ('speed', 'radius'):
+        if key in d and not (is_number(d[key]) and d[key] >= 0):
+            raise ValueError(f"{where}: {key!r} must be a number >= 0")
+
+
+class NpcCrowd:
+    """
+    A room's NPCs as arrays. step() walks each one along its waypoint loop
+    or, while players are within its radius, stops it to face the nearest
+    one; proximity is one (NPCs x players) distance matrix per tick.
+    """
+    def __init__(self, defs):
+        n = len(defs)
+        self.ids = [str(NPC_ID_BASE + i) for i in range(n)]
+        self.num_ids = np.arange(NPC_ID_BASE, NPC_ID_BASE + n, dtype=np.uint32)
+        self.profiles = [{'name': d['name'], 'npc': d['kind']} for d in defs]
+        routes = [np.asarray(d['waypoints'], np.float64).reshape(-1, 2) for d in defs]
+        self.points = np.concatenate(routes) if routes else np.zeros((0, 2))
+        self.route_len = np.array([len(r) for r in routes], np.intp)
+        self.route_start = np.cumsum(self.route_len) - self.route_len
+        self.target = np.ones(n, np.intp) % np.maximum(self.route_len, 1)
+        self.pos = self.points[self.route_start].copy()
+        self.ry = np.zeros(n)
+        self.speed = np.array([d.get('speed', 1.5) for d in defs], np.float64)
+        self.radius2 = np.array([d.get('radius', 5) for d in defs], np.float64) ** 2
+        self.in_range = NO_KEYS   # sorted pair keys (npc, player) within radius last tick
+        self.slots = NO_SLOTS
+        self.greetings = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def spawn(self, store):
+        self.slots = np.array([store.add(pid, profile, x, 0, z)
+                               for pid, profile, (x, z) in zip(self.ids, self.profiles, self.pos.tolist())], np.intp)
+
+    def step(self, store, dt):
+        """Advance every NPC one tick; returns pair keys (npc, player) of players who just came in range."""
+        if not len(self):
+            return NO_KEYS
+        n = store.size
+        mask = store.active[:n].copy()
+        mask[self.slots] = False
+        players = np.flatnonzero(mask)
+
+        # Proximity: squared distance from every NPC to every player
+        dx = store.x[players][None, :] - self.pos[:, 0:1]
+        dz = store.z[players][None, :] - self.pos[:, 1:2]
+        d2 = dx * dx + dz * dz
+        near = d2 < self.radius2[:, None]
+        busy = near.any(axis=1)
+
+        # Free NPCs head for their waypoint, advancing the route on arrival
+        goal = self.points[self.route_start + self.target]
+        gx, gz = goal[:, 0] - self.pos[:, 0], goal[:, 1] - self.pos[:, 1]
+        arrived = ~busy & (gx * gx + gz * gz < NPC_ARRIVE * NPC_ARRIVE)
+        self.target[arrived] = (self.target[arrived] + 1) % self.route_len[arrived]
+        walking = ~busy & ~arrived
+
+        # Turn toward the goal (or the nearest player), then walk forward
+        heading = np.arctan2(gx, gz)
+        if busy.any():
+            rows = np.flatnonzero(busy)
+            cols = np.where(near[rows], d2[rows], np.inf).argmin(axis=1)
+            heading[rows] = np.arctan2(dx[rows, cols], dz[rows, cols])
+        rate = np.where(busy, NPC_FACE_RATE, NPC_TURN_RATE)
+        diff = (heading - self.ry + np.pi) % (2 * np.pi) - np.pi
+        self.ry = (self.ry + diff * np.minimum(rate * dt, 1) + np.pi) % (2 * np.pi) - np.pi
+        step = np.where(walking, self.speed * dt, 0)
+        self.pos[:, 0] += np.sin(self.ry) * step
+        self.pos[:, 1] += np.cos(self.ry) * step
+
+        anim = np.where(walking, ANIM_INDEX['walk'], ANIM_INDEX['idle']).astype(np.uint8)
+        store.write(self.slots, self.pos[:, 0].astype(np.float32), np.float32(0),
+                    self.pos[:, 1].astype(np.float32), self.ry.astype(np.float32), anim)
+
+        # Greet whoever is in range now but wasn't last tick
+        rows, cols = np.nonzero(near)
+        keys = np.sort(pair_keys(self.num_ids[rows], store.num_id[players[cols]]))
+        entered = keys[~in_sorted(keys, self.in_range)]
+        self.in_range = keys
+        self.greetings += len(entered)
+        return entered
+
+    def stats(self):
+        return {'npcs': len(self), 'in_range': len(self.in_range), 'greetings': self.greetings}
+
+
+NPC_DEFS = load_npcs()
+
+
+# ─── Rooms ───────────────────────────────────────────────────
+def room_name(requested):
+    """Sanitized room name from a join message ('lobby' when absent or invalid)."""
+    if not isinstance(requested, str):
+        return DEFAULT_ROOM
+    name = ''.join(c for c in requested.lower() if c.isalnum() or c in '-_')[:32]
+    return name or DEFAULT_ROOM
+
+
+class Room:
+    """
+    One instance of a world: its own player table, interest tracker,
+    connections and tick loop. A busy room only overruns (and skips) its
+    own ticks; room ticks are phase-shifted so they interleave instead of
+    all landing on the same instant.
+
+    With WORKERS > 1 the player table also mirrors players connected to
+    other workers, but connections only ever holds local ones.
+    """
+    def __init__(self, key, server):
+        self.key = key            # 'lobby', 'lobby#2', ...
+        self.server = server      # GameServer, for the worker bus
+        self.players = PlayerStore()
+        self.tracker = InterestTracker()
+        self.connections = {}     # id -> Outbox
+        self.baselines = {}       # id -> ClientBaseline
+        self.binary = set()       # ids of clients that negotiated WIRE_PROTOCOL
+        self.topics = Topics()    # chat / voice / whiteboard / world subscriptions
+        self.board = Whiteboard()
+        self.listing = {}         # id -> deque of player ids still to send in its player_list
+        self.moves = {}           # id -> (latest move since the last tick, ms it arrived)
+        self.idle = {}            # id -> 'afk' or 'hidden', for clients in low-footprint mode
+        self.active_at = {}       # id -> tick of the client's last reported input
+        self.idle_ids = None      # sorted numeric ids of idle, and which are hidden (rebuilt on change)
+        self.idle_hidden = None
+        self.history = SnapshotHistory()
+        self.npcs = NpcCrowd(NPC_DEFS)
+        self.npcs.spawn(self.players)
+        self.scheduler = TickScheduler()
+        self.scheduler.on_tick(self.apply_moves)
+        self.scheduler.on_tick(self.step_npcs)
+        self.scheduler.on_tick(self.publish_state)
+        self.scheduler.on_tick(self.flush_whiteboard)
+        self.scheduler.on_tick(self.send_player_lists)
+        self.scheduler.on_tick(self.record_history)
+        self.scheduler.on_tick(self.send_interest_updates)
+        self.scheduler.on_tick(self.flush_events)
+        self.scheduler.every(1, self.check_idle)
+        self.idle_period = round(IDLE_STATE_INTERVAL * self.scheduler.rate)  # ticks between an AFK client's states
+        self.task = None
+
+    def start(self):
+        offset = random.random() * self.scheduler.period
+        self.task = asyncio.create_task(self.scheduler.run(offset))
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    @property
+    def population(self):
+        """Players in the room, local or mirrored from other workers, but not NPCs."""
+        return len(self.players) - len(self.npcs)
+
+    def queue_move(self, player_id, data):
+        """Hold a decoded 'move' for the next tick; a newer one overrides it field by field."""
+        queued = self.moves.get(player_id)
+        if queued is not None:
+            queued[0].update(data)
+            data = queued[0]
+            MOVES_COALESCED.inc()
+        self.moves[player_id] = (data, time.time() * 1000)
+
+    def apply_moves(self, tick):
+        """Apply each client's latest move, once per tick however many it sent."""
+        moves, self.moves = self.moves, {}
+        for player_id, (data, received_ms) in moves.items():
+            if player_id in self.connections:
+                if self.apply_move(player_id, data, received_ms) and self.idle.get(player_id) == 'afk':
+                    self.wake(player_id)
+
+    def step_npcs(self, tick):
+        """Move the NPCs and tell players an NPC just greeted them (skipped with nobody here to see)."""
+        if not self.connections:
+            return
+        entered = self.npcs.step(self.players, self.scheduler.period)
+        for npc, pid in zip(key_viewers(entered).tolist(), key_others(entered).tolist()):
+            self.send_to(str(pid), {'type': 'npc_greet', 'id': str(npc)})
+
+    def apply_move(self, player_id, data, received_ms=None):
+        """Copy position/animation from a decoded 'move' and ack its snapshot; True if the player moved."""
+        fields = {}
+        for k in ('x', 'y', 'z', 'ry'):
+            if k in data:
+                try:
+                    v = float(data[k])
+                except (TypeError, ValueError):
+                    continue
+                if math.isfinite(v):
+                    fields[k] = max(-POS_LIMIT, min(POS_LIMIT, v))
+        if isinstance(data.get('anim'), str):
+            fields['anim'] = data['anim']
+        moved = self.players.move(player_id, **fields)
+        seq = data.get('seq')
+        self.players.stamp_move(player_id, seq if isinstance(seq, int) and 0 <= seq < 2 ** 32 else None,
+                                received_ms if received_ms is not None else time.time() * 1000)
+        if 'ack' in data:
+            self.baselines[player_id].ack(data['ack'])
+        return moved
+
+    def drop(self, pid):
+        """
+        Forget a player: connection, state and per-client bookkeeping. Its
+        interest pairs drop out on the next tick.
+        """
+        self.players.remove(pid)
+        box = self.connections.pop(pid, None)
+        if box is not None:
+            box.close()
+        self.baselines.pop(pid, None)
+        self.binary.discard(pid)
+        self.listing.pop(pid, None)
+        self.moves.pop(pid, None)
+        if self.idle.pop(pid, None) is not None:
+            self.idle_ids = None
+        self.active_at.pop(pid, None)
+        self.topics.drop(pid)
+        self.board.forget(pid)
+
+    def introduce(self, pid):
+        """
+        Tell local clients about a player that just joined here or on
+        another worker. Everyone in the room hears about the join, but only
+        nearby players spawn the avatar (visible=False elsewhere).
+        Returns (record, ids of players near it).
+        """
+        store = self.players
+        slot = store.slot_of[pid]
+        me = store.record(pid)
+        near_ids = self.tracker.visible_from(store, slot)
+        near = store.ids_of(near_ids)
+        # Both directions are announced; the next tick only reports them
+        # again if they leave the area of interest
+        me_id = np.full(len(near_ids), store.num_id[slot])
+        self.tracker.announce(np.concatenate([
+            pair_keys(me_id, near_ids), pair_keys(near_ids, me_id)
+        ]), store.tick)
+        join_msg = {
+            'type': 'player_join',
+            'id': pid,
+            'name': me['name'],
+            'color': me['color'],
+            'x': me['x'],
+            'y': 0,
+            'z': me['z'],
+        }
+        far = set(self.connections) - set(near) - {pid}
+        self.broadcast({**join_msg, 'visible': True}, only=near)
+        self.broadcast({**join_msg, 'visible': False}, only=far)
+        return me, near
+
+    def check_idle(self, tick):
+        """Put clients that neither moved nor reported input for IDLE_AFTER seconds in low-footprint mode."""
+        if not IDLE_AFTER:
+            return
+        store = self.players
+        pids = [pid for pid in self.connections if pid not in self.idle]
+        if not pids:
+            return
+        last = store.field_tick[[store.slot_of[pid] for pid in pids]].max(axis=1)
+        cutoff = tick - IDLE_AFTER * self.scheduler.rate
+        for pid, moved_at in zip(pids, last.tolist()):
+            if max(moved_at, self.active_at.get(pid, moved_at)) < cutoff:
+                self.sleep(pid, 'afk')
+
+    def report_input(self, pid, hidden=False):
+        """A client reported user input, or (hidden=True) that its tab went into the background."""
+        if hidden:
+            self.sleep(pid, 'hidden')
+        else:
+            self.active_at[pid] = self.scheduler.tick
+            self.wake(pid)
+
+    def sleep(self, pid, mode):
+        """
+        Put a client in low-footprint mode: its interest pairs are frozen
+        (see InterestTracker.update) and its Outbox goes lean.
+        """
+        box = self.connections.get(pid)
+        if box is None or self.idle.get(pid) == mode:
+            return
+        self.idle[pid] = mode
+        self.idle_ids = None
+        box.set_lean(True)
+        IDLE_TRANSITIONS.inc(mode)
+
+    def wake(self, pid):
+        """Back to full updates; the next tick brings the client's view up to date with a full snapshot."""
+        if self.idle.pop(pid, None) is None:
+            return
+        self.idle_ids = None
+        self.connections[pid].set_lean(False)
+        self.baselines[pid].reset()
+
+    def frozen_viewers(self, tick):
+        """Sorted numeric ids of the idle clients that get no update this tick."""
+        if not self.idle:
+            return NO_IDS
+        if self.idle_ids is None:
+            ids = sorted(int(pid) for pid in self.idle)
+            self.idle_ids = np.array(ids, np.uint32)
+            self.idle_hidden = np.array([self.idle[str(i)] == 'hidden' for i in ids], np.bool_)
+        if self.idle_period <= 0:
+            return self.idle_ids
+        # AFK clients take turns, so their updates are spread over the period
+        due = ~self.idle_hidden & ((self.idle_ids.astype(np.int64) + tick) % self.idle_period == 0)
+        return self.idle_ids[~due]
+
+    def send_to(self, pid, message):
+        box = self.connections.get(pid)
+        if box is not None:
+            box.defer(json.dumps(message), MESSAGE_POLICY.get(message['type'], RELIABLE), message['type'])
+
+    def broadcast(self, message, exclude=None, only=None, topic=None):
+        """
+        Serialize once and add the same payload to this tick's batch for
+        every target connection: `only`, the subscribers of `topic`, or everyone.
+        """
+        started = time.perf_counter()
+        kind = message['type']
+        payload = json.dumps(message)
+        policy = MESSAGE_POLICY.get(kind, RELIABLE)
+        targets = only if only is not None else self.topics[topic] if topic is not None else self.connections
+        for pid in targets:
+            box = self.connections.get(pid)
+            if box is not None and pid != exclude:
+                box.defer(payload, policy, kind)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started, kind)
+
+    def relay(self, message, exclude=None, topic=None):
+        """broadcast() in this room here and on every other worker."""
+        self.broadcast(message, exclude=exclude, topic=topic)
+        self.server.publish({'op': 'event', 'room': self.key, 'msg': message, 'topic': topic})
+
+    def subscribe(self, pid, topics, joining=False):
+        """
+        Subscribe a local client, catching it up on state it missed while
+        it wasn't listening: the editor world and the whiteboard.
+        """
+        box = self.connections[pid]
+        for topic in self.topics.subscribe(pid, topics):
+            if topic == 'world':
+                box.defer(self.server.world.join_message(), RELIABLE, 'world')
+            elif topic == 'whiteboard' and (self.board or not joining):
+                box.defer(self.board.replay_message(), RELIABLE, 'whiteboard')
+
+    def send_player_list(self, pid, ids):
+        """Queue a joiner's player_list; past PLAYER_LIST_PAGE players the rest follows a page per tick."""
+        self.listing[pid] = deque(ids)
+        self.send_player_list_page(pid)
+
+    def send_player_list_page(self, pid):
+        pending = self.listing[pid]
+        ids = [pending.popleft() for _ in range(min(PLAYER_LIST_PAGE, len(pending)))]
+        if not pending:
+            del self.listing[pid]
+        # Players that left meanwhile are skipped; the joiner already got their player_leave
+        self.send_to(pid, {
+            'type': 'player_list',
+            'players': [self.players.record(i) for i in ids if i in self.players],
+            **({'more': True} if pending else {})
+        })
+
+    def send_player_lists(self, tick):
+        for pid in list(self.listing):
+            self.send_player_list_page(pid)
+
+    def flush_events(self, tick):
+        """Send whatever was deferred this tick to clients that got no state frame."""
+        for box in self.connections.values():
+            if box.events:
+                box.flush()
+
+    def flush_whiteboard(self, tick):
+        """One message per tick with every stroke drawn since the last."""
+        strokes = self.board.flush()
+        if strokes:
+            self.relay({'type': 'whiteboard', 'data': {'type': 'strokes', 'strokes': strokes}}, topic='whiteboard')
+
+    def publish_state(self, tick):
+        """Send other workers the local players that moved this tick."""
+        bus = self.server.bus
+        if bus is None or not self.connections:
+            return
+        store = self.players
+        n = store.size
+        moved = np.flatnonzero(store.active[:n] & (store.field_tick[:n] == store.tick).any(axis=1))
+        slots = np.array([s for s in moved.tolist() if store.pid_at[s] in self.connections], np.intp)
+        if not slots.size:
+            return
+        records = np.empty(len(slots), BUS_RECORD)
+        for name in ('x', 'y', 'z', 'ry', 'anim'):
+            records[name] = getattr(store, name)[slots]
+        records['id'] = store.num_id[slots]
+        bus.publish_state(records)
+
+    def record_history(self, tick):
+        """Add this tick's positions to the snapshot history."""
+        store = self.players
+        if store:
+            slots = np.flatnonzero(store.active[:store.size])
+            self.history.record(tick, time.time() * 1000, player_records(store, slots))
+
+    def view_tick(self, pid):
+        """
+        Tick a client was displaying as of its latest move: the newest
+        snapshot it acked, minus the interpolation delay it renders behind.
+        """
+        baseline = self.baselines.get(pid)
+        if baseline is None or baseline.acked_tick < 0:
+            return self.scheduler.tick
+        return baseline.acked_tick - round(INTERP_DELAY_MS * self.scheduler.rate / 1000)
+
+    def positions_at(self, tick, ids):
+        """{id: (x, y, z)} as of `tick`, for the given ids that were in the room then."""
+        found, x, y, z = self.history.positions(tick, [int(i) for i in ids])
+        return {pid: (float(x[i]), float(y[i]), float(z[i])) for i, pid in enumerate(ids) if found[i]}
+
+    def nearby_at(self, pid, radius, tick=None):
+        """
+        Ids within `radius` of pid, with everyone else rewound to what pid
+        was seeing (view_tick, unless `tick` is given): the check for a
+        proximity interaction made by a client running behind the server.
+        """
+        tick = self.view_tick(pid) if tick is None else tick
+        x0, z0 = self.players.position(pid)
+        others = [i for i in self.players if i != pid]
+        found, x, _, z = self.history.positions(tick, [int(i) for i in others])
+        near = found & ((x - x0) ** 2 + (z - z0) ** 2 <= radius * radius)
+        return [others[i] for i in np.flatnonzero(near).tolist()]
+
+    def send_interest_updates(self, tick):
+        """
+        Send each client a delta of the players in its area of interest,
+        preceded by an 'interest' event when players entered or left it.
+
+        Visibility, changed fields and gone players are computed for every
+        (viewer, player) pair at once; the per-client loop only slices out
+        and queues frames for clients whose view changed since their acked
+        baseline. Idle clients are skipped except on their turn (see
+        frozen_viewers).
+        """
+        store = self.players
+        if not store:
+            store.advance(tick)
+            return
+        now_ms = round(time.time() * 1000)
+        frozen = self.frozen_viewers(tick)
+        keys, viewers, others, since, entered, exited = self.tracker.update(store, tick, frozen, self.npcs.num_ids)
+
+        # Acked snapshot tick per connected client, looked up by numeric id
+        for base in self.baselines.values():
+            base.expire(tick)
+        conn_ids = np.array(sorted(int(p) for p in self.baselines), np.uint32)
+        conn_acked = np.array([self.baselines[str(i)].acked_tick for i in conn_ids.tolist()], np.int64)
+
+        def acked_of(pair_keys_):
+            found, pos = lookup_sorted(key_viewers(pair_keys_), conn_ids)
+            return found, conn_acked[pos] if conn_ids.size else np.full(len(pair_keys_), -1)
+
+        connected, acked = acked_of(keys)
+        fields = store.changed_since(acked[:, None], others)
+        fields[since > acked] = True
+        changed = connected & fields.any(axis=1)
+
+        tracker = self.tracker
+        found, exit_acked = acked_of(tracker.exit_keys)
+        if frozen.size:
+            found &= ~in_sorted(key_viewers(tracker.exit_keys), frozen)
+        gone_keys = np.sort(tracker.exit_keys[
+            found & (tracker.exit_since <= exit_acked) & (exit_acked < tracker.exit_tick)
+            & ~in_sorted(tracker.exit_keys, keys)
+        ])
+
+        rows = np.flatnonzero(changed)
+        changed_bounds = group_bounds(key_viewers(keys[rows]))
+        records = player_records(store, others[rows])
+        entries = None
+        if len(self.binary) < len(self.connections):
+            entries = json_entries(store, others[rows], fields[rows])
+        gone_ids = key_others(gone_keys)
+        gone_bounds = group_bounds(key_viewers(gone_keys))
+        enter_rows = np.flatnonzero(entered)
+        enter_bounds = group_bounds(key_viewers(keys[enter_rows]))
+        exit_ids = key_others(exited)
+        exit_bounds = group_bounds(key_viewers(exited))
+
+        for vid in changed_bounds.keys() | gone_bounds.keys() | enter_bounds.keys() | exit_bounds.keys():
+            pid = str(vid)
+            box = self.connections.get(pid)
+            if box is None or pid not in self.baselines:
+                continue
+            a, b = enter_bounds.get(vid, (0, 0))
+            c, d = exit_bounds.get(vid, (0, 0))
+            enter = store.ids_of(store.num_id[others[enter_rows[a:b]]])
+            exit_ = [i for i in store.ids_of(exit_ids[c:d]) if i in store]  # leavers get player_leave
+            if enter or exit_:
+                box.defer(json.dumps({
+                    'type': 'interest',
+                    'enter': [store.record(i) for i in enter],
+                    'exit': exit_
+                }), RELIABLE, 'interest')
+            a, b = changed_bounds.get(vid, (0, 0))
+            c, d = gone_bounds.get(vid, (0, 0))
+            if a == b and c == d:
+                continue
+            seq, base = self.baselines[pid].next_seq(tick)
+            if pid in self.binary:
+                box.flush(encode_state(seq, base, tick, now_ms, records[a:b], gone_ids[c:d]))
+            else:
+                box.flush(encode_json_state(seq, base, tick, now_ms, entries[a:b], gone_ids[c:d]))
+        store.advance(tick)
+
+
+# ─── World State ─────────────────────────────────────────────
+# Editor objects live in memory; every accepted edit becomes a sequenced op
+# {'seq', 'action', 'oid', 'data'}. Persisting an op costs one appended
+# line, so disk work follows the edit rate rather than the world size, and
+# joiners get the last compacted snapshot plus the ops after it.
+WORLD_ACTIONS = ('spawn', 'delete', 'move')
+WORLD_VECTORS = ('pos', 'rot', 'scl')
+
+
+def world_vector(value):
+    """{'x', 'y', 'z'} of finite floats, or None."""
+    if not isinstance(value, dict):
+        return None
+    try:
+        vec = {k: float(value[k]) for k in ('x', 'y', 'z')}
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not all(math.isfinite(v) and abs(v) <= POS_LIMIT for v in vec.values()):
+        return None
+    return vec
+
+
+def world_fields(data):
+    """The valid pos/rot/scl vectors of an edit's data."""
+    fields = {}
+    for key in WORLD_VECTORS:
+        vec = world_vector(data.get(key))
+        if vec is not None:
+            fields[key] = vec
+    return fields
+
+
+def world_object(data):
+    """Sanitized object for a spawn (type plus pos/rot/scl), or None."""
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+        return None
+    fields = world_fields(data)
+    if 'pos' not in fields:
+        return None
+    fields.setdefault('rot', {'x': 0.0, 'y': 0.0, 'z': 0.0})
+    fields.setdefault('scl', {'x': 1.0, 'y': 1.0, 'z': 1.0})
+    return {'type': data['type'][:32], **fields}
+
+
+def encode_world_objects(items):
+    """JSON list of (oid, object) pairs; runs off the event loop."""
+    return json.dumps([{'oid': oid, **obj} for oid, obj in items])
+
+
+class WorldLog:
+    """
+    Append-only op log plus snapshot file. All file work happens on one
+    writer thread: ops queued within WORLD_FLUSH_INTERVAL share a write and
+    an fsync, and compaction is queued behind them, so truncating the log
+    never loses an op that isn't in the new snapshot.
+    """
+    def __init__(self, log_path=WORLD_LOG_PATH, snapshot_path=WORLD_SNAPSHOT_PATH):
+        self.log_path = Path(log_path)
+        self.snapshot_path = Path(snapshot_path)
+        self.file = None
+        self.pending = []         # encoded lines waiting for the next flush
+        self.flush_handle = None
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix='world-log')
+        self.fsyncs = 0
+        self.compactions = 0
+
+    def load(self):
+        """(snapshot, ops after it) from disk; runs in a worker thread."""
+        snapshot = {'seq': 0, 'next_oid': 1, 'objects': []}
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path) as f:
+                snapshot.update(json.load(f))
+        ops, good = [], 0
+        if self.log_path.exists():
+            data = self.log_path.read_bytes()
+            for line in data.splitlines(keepends=True):
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break  # torn write from a crash: drop it and what follows
+                if not line.endswith(b'\n'):
+                    break
+                good += len(line)
+                if op['seq'] > snapshot['seq']:
+                    ops.append(op)
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.log_path, 'ab')
+        self.file.truncate(good)
+        return snapshot, ops
+
+    def append(self, line):
+        self.pending.append(line.encode() + b'\n')
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(WORLD_FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending:
+            batch, self.pending = b''.join(self.pending), []
+            self.writer.submit(self._write, batch)
+
+    def _write(self, batch):
+        try:
+            self.file.write(batch)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+        except OSError as e:
+            log('world_log_error', '[!] World log write failed: {error}', error=str(e))
+
+    def compact(self, seq, next_oid, items):
+        """Future for the encoded objects once the snapshot at `seq` is on disk."""
+        self.flush()
+        return asyncio.wrap_future(self.writer.submit(self._compact, seq, next_oid, items))
+
+    def _compact(self, seq, next_oid, items):
+        objects_json = encode_world_objects(items)
+        tmp = self.snapshot_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            f.write(f'{{"seq": {seq}, "next_oid": {next_oid}, "objects": {objects_json}}}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # Everything in the log is now <= seq: later ops are queued behind us
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+        self.compactions += 1
+        return objects_json
+
+    def stats(self):
+        return {'fsyncs': self.fsyncs, 'compactions': self.compactions, 'pending': len(self.pending)}
+
+
+class WorldState:
+    """
+    The world editor's object table. The authority applies client edits
+    with edit(); followers (and recovery) apply sequenced ops with replay().
+    Objects are replaced, never mutated, so compaction can encode a shallow
+    copy of the table off the event loop.
+    """
+    def __init__(self, log=None):
+        self.log = log              # WorldLog on the authority, None on followers
+        self.objects = {}           # oid -> {'type', 'pos', 'rot', 'scl'}, in spawn order
+        self.seq = 0
+        self.next_oid = 1
+        self.snapshot_seq = 0       # ops up to here are folded into snapshot_json
+        self.snapshot_json = '[]'
+        self.tail = []              # encoded ops after snapshot_seq
+        self.generation = 0         # bumped by restore() to discard stale compactions
+        self.compacting = False
+
+    def __len__(self):
+        return len(self.objects)
+
+    def restore(self, snapshot, ops=()):
+        """Replace the table with a snapshot, then replay `ops` on top."""
+        self.objects = {}
+        self.next_oid = snapshot.get('next_oid', 1)
+        for obj in snapshot.get('objects', []):
+            entry = world_object(obj)
+            if entry is None:
+                continue
+            oid = obj.get('oid')
+            if not isinstance(oid, int):
+                oid = self.next_oid  # saved before objects had ids
+            self.objects[oid] = entry
+            self.next_oid = max(self.next_oid, oid + 1)
+        self.seq = self.snapshot_seq = snapshot.get('seq', 0)
+        self.snapshot_json = encode_world_objects(self.objects.items())
+        self.tail = []
+        self.generation += 1
+        self.compacting = False
+        for op in ops:
+            self.replay(op)
+
+    def resolve(self, data):
+        """Object id an edit refers to, by 'oid' or (older clients) list 'index'."""
+        oid = data.get('oid')
+        if isinstance(oid, int) and oid in self.objects:
+            return oid
+        index = data.get('index')
+        if isinstance(index, int) and 0 <= index < len(self.objects):
+            return list(self.objects)[index]
+        return None
+
+    def edit(self, action, data):
+        """Validate and apply a client edit; returns the op, or None if rejected."""
+        if action not in WORLD_ACTIONS or not isinstance(data, dict):
+            return None
+        if action == 'spawn':
+            obj = world_object(data)
+            if obj is None or len(self.objects) >= WORLD_MAX_OBJECTS:
+                return None
+            op = {'seq': self.seq + 1, 'action': action, 'oid': self.next_oid, 'data': obj}
+        else:
+            oid = self.resolve(data)
+            fields = world_fields(data) if action == 'move' else {}
+            if oid is None or (action == 'move' and not fields):
+                return None
+            op = {'seq': self.seq + 1, 'action': action, 'oid': oid, 'data': fields}
+        line = self._apply(op)
+        if self.log is not None:
+            self.log.append(line)
+        self._maybe_compact()
+        return op
+
+    def replay(self, op):
+        """Apply an op sequenced elsewhere; False if it isn't the next one."""
+        if op.get('seq') != self.seq + 1:
+            return False
+        self._apply(op)
+        self._maybe_compact()
+        return True
+
+    def _apply(self, op):
+        oid = op['oid']
+        if op['action'] == 'spawn':
+            self.objects[oid] = op['data']
+            self.next_oid = max(self.next_oid, oid + 1)
+        elif op['action'] == 'delete':
+            self.objects.pop(oid, None)
+        elif oid in self.objects:
+            self.objects[oid] = {**self.objects[oid], **op['data']}
+        self.seq = op['seq']
+        line = json.dumps(op)
+        self.tail.append(line)
+        return line
+
+    def _maybe_compact(self):
+        if len(self.tail) >= WORLD_COMPACT_OPS and not self.compacting:
+            self.compact()
+
+    def compact(self):
+        """Fold the tail into a new snapshot in the background."""
+        self.compacting = True
+        items = list(self.objects.items())
+        if self.log is not None:
+            future = self.log.compact(self.seq, self.next_oid, items)
+        else:
+            future = asyncio.get_running_loop().run_in_executor(None, encode_world_objects, items)
+        future.add_done_callback(partial(self._compacted, self.seq, self.generation))
+
+    def _compacted(self, seq, generation, future):
+        if generation != self.generation:
+            return
+        self.compacting = False
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            log('world_compact_error', '[!] World compaction failed: {error}', error=str(future.exception()))
+            return
+        self.tail = self.tail[seq - self.snapshot_seq:]
+        self.snapshot_seq = seq
+        self.snapshot_json = future.result()
+
+    def join_message(self):
+        """Pre-encoded 'world' message: the snapshot plus the ops after it."""
+        return (f'{{"type": "world", "seq": {self.snapshot_seq}, '
+                f'"objects": {self.snapshot_json}, "ops": [{", ".join(self.tail)}]}}')
 
-init_db()
+    def sync_message(self):
+        """Bus op carrying the whole table, for a follower that (re)connected or fell behind."""
+        return {'op': 'world_sync', 'seq': self.seq, 'next_oid': self.next_oid,
+                'objects': [{'oid': oid, **obj} for oid, obj in self.objects.items()]}
 
-MIME_MAP = {
-    '.html': 'text/html; charset=utf-8',
-    '.css': 'text/css; charset=utf-8',
-    '.js': 'application/javascript; charset=utf-8',
-    '.mjs': 'application/javascript; charset=utf-8',
-    '.json': 'application/json',
-    '.png': 'image/png',
-    '.jpg': 'image/jpeg',
-    '.jpeg': 'image/jpeg',
-    '.gif': 'image/gif',
-    '.svg': 'image/svg+xml',
-    '.ico': 'image/x-icon',
-    '.woff': 'font/woff',
-    '.woff2': 'font/woff2',
-    '.glb': 'model/gltf-binary',
-    '.gltf': 'model/gltf+json',
-    '.obj': 'text/plain',
-    '.mtl': 'text/plain',
+    def stats(self):
+        stats = {'objects': len(self.objects), 'seq': self.seq, 'tail': len(self.tail)}
+        if self.log is not None:
+            stats['log'] = self.log.stats()
+        return stats
+
+
+# ─── Inbound Messages ────────────────────────────────────────
+# Client messages are looked up in INBOUND: the GameServer method that
+# handles the type, the rate-limit class it draws from, a byte cap and
+# the types of the fields it reads. Nothing past the table ever sees a
+# message that failed those checks. bool is a subclass of int, so JSON
+# true/false only pass fields that list bool itself.
+NUMBER = (int, float)
+OPTIONAL_STR = (str, type(None))
+
+
+def parse_rates(spec):
+    """'class=rate/burst;...' -> {class: (rate, burst)}."""
+    rates = {}
+    for rule in spec.split(';'):
+        name, sep, value = rule.partition('=')
+        rate, slash, burst = value.partition('/')
+        if sep and slash and name.strip():
+            rates[name.strip()] = (float(rate), int(burst))
+    return rates
+
+
+INBOUND_LIMITS = parse_rates(INBOUND_RATES)
+
+
+class Inbound:
+    """How one client message type is checked and handled."""
+    __slots__ = ('handler', 'limit', 'max_bytes', 'fields', 'bools')
+
+    def __init__(self, handler, limit, max_bytes, **fields):
+        self.handler = handler      # GameServer method name
+        self.limit = limit          # INBOUND_LIMITS class
+        self.max_bytes = max_bytes
+        self.fields = fields        # field -> type (or tuple of types) when present
+        self.bools = {name for name, types in fields.items()
+                      if types is bool or (isinstance(types, tuple) and bool in types)}
+
+    def check(self, data, size):
+        """None if the message may be handled, else why it's rejected."""
+        if size > self.max_bytes:
+            return 'size'
+        for name, types in self.fields.items():
+            if name not in data:
+                continue
+            value = data[name]
+            if not isinstance(value, types) or (type(value) is bool and name not in self.bools):
+                return 'schema'
+        return None
+
+
+INBOUND = {
+    'join': Inbound('on_join', 'control', 4096, name=str, color=(int, str), room=OPTIONAL_STR,
+                    token=OPTIONAL_STR, topics=list, proto=OPTIONAL_STR),
+    'move': Inbound('on_move', 'move', 512, x=NUMBER, y=NUMBER, z=NUMBER, ry=NUMBER, anim=str,
+                    ack=int, seq=int),
+    'ack': Inbound('on_ack', 'control', 128, seq=int),
+    'resync': Inbound('on_resync', 'control', 128),
+    'presence': Inbound('on_presence', 'control', 128, hidden=bool),
+    'subscribe': Inbound('on_subscribe', 'control', 1024, topics=list),
+    'unsubscribe': Inbound('on_unsubscribe', 'control', 1024, topics=list),
+    'appearance_update': Inbound('on_appearance_update', 'profile', 2048, data=dict),
+    'chat': Inbound('on_chat', 'chat', 1024, message=str, channel=OPTIONAL_STR),
+    'whiteboard': Inbound('on_whiteboard', 'draw', 16384, data=dict),
+    'world_edit': Inbound('on_world_edit', 'world', 8192, action=str, data=dict),
+    'voice_talking': Inbound('on_voice_talking', 'voice', 256, talking=bool, group=OPTIONAL_STR),
+    'voice_ready': Inbound('on_voice_ready', 'voice', 256, group=OPTIONAL_STR),
 }
+# Largest frame the server reads at all; websockets closes the connection
+# (1009) on anything bigger before buffering it
+INBOUND_MAX_BYTES = max(spec.max_bytes for spec in INBOUND.values())
+
+
+class Client:
+    """A connection's inbound side: the player it joined as, its rate limits and traffic."""
+    __slots__ = ('websocket', 'player_id', 'room', 'buckets', 'strikes', 'received', 'bytes_received')
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.player_id = None
+        self.room = None
+        self.received = 0
+        self.bytes_received = 0
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in INBOUND_LIMITS.items()}
+        self.strikes = TokenBucket(INBOUND_STRIKE_RATE, INBOUND_STRIKE_BURST)
+
+    def admit(self, limit):
+        bucket = self.buckets.get(limit)
+        return bucket is None or bucket.take(1) == 1
+
+    def reject(self, kind, reason):
+        """Count a dropped message; True once the client is out of strikes."""
+        INBOUND_REJECTED.inc(kind, reason)
+        return self.strikes.take(1) == 0
 
 
 # ─── Game Server (Multiplayer) ───────────────────────────────
 class GameServer:
-    def __init__(self):
-        self.players = {}
-        self.next_id = 1
-        self.connections = {}
+    def __init__(self, worker=0):
+        self.worker = worker   # ids are worker + 1 + k * WORKERS, unique across workers
+        self.next_id = worker + 1
+        self.rooms = {}        # room key -> Room
+        self.room_of = {}      # player id -> Room
+        self.clients = {}      # player id -> Client, for connections on this worker
+        self.bus = None        # WorkerBus when running with WORKERS > 1
+        self.remote = {}       # id -> worker owning that player's connection
+        self.worker_load = {}  # worker -> connection count, from the bus
+        self.tasks = set()     # long-lived tasks from start_task()
+        self.failed = asyncio.Event()  # set when an essential one stops
+        self.world = WorldState()  # editor objects, shared by every room
+        # Opened here, not at import: spawned children that only import this
+        # module (the model converter pool) never touch the database
+        init_db()
+        self.db = UserDB()
+        self.sessions = Sessions(self.db)
+        self.dispatch = {msg_type: getattr(self, spec.handler) for msg_type, spec in INBOUND.items()}
+        # Server-wide periodic jobs; each room runs its own game tick
+        self.scheduler = TickScheduler(name='server')
+        self.scheduler.every(BUS_REPORT_INTERVAL, self.publish_load)
+        self.scheduler.every(STATS_INTERVAL, self.log_stats)
         self.colors = [
             0x42a5f5, 0xef5350, 0x66bb6a, 0xffee58,
             0xab47bc, 0xff7043, 0x26c6da, 0xec407a,
             0x5c6bc0, 0x8d6e63, 0xffa726, 0x78909c
         ]
+        metrics.gauge('metaverse_connections', 'Open WebSocket connections on this worker',
+                      lambda: self.connection_count)
+        metrics.gauge('metaverse_players', 'Players online (every worker)', lambda: self.online)
+        metrics.gauge('metaverse_rooms', 'Open room instances', lambda: len(self.rooms))
+        metrics.gauge('metaverse_send_queue_max', 'Deepest connection send queue right now',
+                      lambda: max((box.pending for room in self.rooms.values()
+                                   for box in room.connections.values()), default=0))
+        metrics.gauge('metaverse_session_cache_lookups_total', 'Session cache lookups',
+                      lambda: [(('hit',), self.sessions.cache.hits), (('miss',), self.sessions.cache.misses)],
+                      ('result',), kind='counter')
+
+    def start_task(self, coro, essential=True):
+        """
+        Run a task for the life of the worker. Failures are logged; when an
+        essential one (the tick, the bus) stops for any reason, main()
+        exits so the worker is restarted instead of serving half-broken.
+        """
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(partial(self._task_done, essential))
+        return task
+
+    def _task_done(self, essential, task):
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None and not essential:
+            return
+        log('task_error', '[!] Worker {worker}: {task} stopped: {error}',
+            worker=self.worker, task=task.get_coro().__qualname__, error=repr(error))
+        if essential:
+            self.failed.set()
 
     def get_id(self):
         pid = self.next_id
-        self.next_id += 1
+        self.next_id += WORKERS
         return str(pid)
 
+    @property
+    def online(self):
+        return len(self.room_of)
+
+    @property
+    def connection_count(self):
+        return sum(len(room.connections) for room in self.rooms.values())
+
+    def open_room(self, key):
+        room = self.rooms.get(key)
+        if room is None:
+            room = self.rooms[key] = Room(key, self)
+            room.start()
+            log('room_open', '[🏠] Room {room} opened — {rooms} rooms', room=key, rooms=len(self.rooms))
+        return room
+
+    def close_room_if_empty(self, room):
+        if not room.population and self.rooms.get(room.key) is room:
+            room.stop()
+            del self.rooms[room.key]
+            log('room_close', '[🏠] Room {room} closed — {rooms} rooms', room=room.key, rooms=len(self.rooms))
+
+    def assign_room(self, requested):
+        """First instance of the requested room with space, opening a new one if all are full."""
+        name = room_name(requested)
+        n = 1
+        while True:
+            key = name if n == 1 else f'{name}#{n}'
+            room = self.rooms.get(key)
+            if room is None or room.population < ROOM_CAPACITY:
+                return self.open_room(key)
+            n += 1
+
     async def handler(self, websocket):
         """Main WebSocket connection handler."""
-        player_id = None
+        client = Client(websocket)
+        dispatch = self.dispatch
+        kicked = False
         try:
             async for message in websocket:
-                try:
-                    data = json.loads(message)
-                except json.JSONDecodeError:
-                    continue
+                client.received += 1
+                client.bytes_received += len(message)
+                if isinstance(message, bytes):
+                    # Binary frames are only ever packed moves
+                    kind = 'move_bin'
+                    MESSAGES_IN.inc(kind)
+                    BYTES_IN.inc(kind, n=len(message))
+                    move = decode_move(message)
+                    if move is None:
+                        reason = 'schema'
+                    elif not (client.admit('frame') and client.admit('move')):
+                        reason = 'rate'
+                    else:
+                        if client.room is not None:
+                            client.room.queue_move(client.player_id, move)
+                        continue
+                else:
+                    try:
+                        data = json.loads(message)
+                    except json.JSONDecodeError:
+                        data = None
+                    msg_type = data.get('type') if isinstance(data, dict) else None
+                    spec = INBOUND.get(msg_type) if isinstance(msg_type, str) else None
+                    kind = msg_type if spec is not None else 'other'
+                    MESSAGES_IN.inc(kind)
+                    BYTES_IN.inc(kind, n=len(message))
+                    if spec is None:
+                        reason = 'unknown' if isinstance(msg_type, str) else 'schema'
+                    elif (client.room is None) != (msg_type == 'join'):
+                        continue  # everything but join needs a joined player, and join comes once
+                    else:
+                        reason = spec.check(data, len(message))
+                        if reason is None and not (client.admit('frame') and client.admit(spec.limit)):
+                            reason = 'rate'
+                        if reason is None:
+                            result = dispatch[msg_type](client, data)
+                            if result is not None:
+                                await result
+                            continue
 
-                msg_type = data.get('type')
-
-                if msg_type == 'join':
-                    player_id = self.get_id()
-                    self.connections[player_id] = websocket
-                    player_color = data.get('color', random.choice(self.colors))
-                    self.players[player_id] = {
-                        'id': player_id,
-                        'name': data.get('name', f'Player {player_id}'),
-                        'color': player_color,
-                        'x': random.uniform(6, 10),
-                        'y': 0,
-                        'z': random.uniform(6, 10),
-                        'ry': 0,
-                        'anim': 'idle'
-                    }
-
-                    await websocket.send(json.dumps({
-                        'type': 'welcome',
-                        'id': player_id,
-                        'you': self.players[player_id]
-                    }))
-                    await websocket.send(json.dumps({
-                        'type': 'player_list',
-                        'players': list(self.players.values())
-                    }))
-                    await self.broadcast({
-                        'type': 'player_join',
-                        'id': player_id,
-                        'name': self.players[player_id]['name'],
-                        'color': player_color,
-                        'x': self.players[player_id]['x'],
-                        'y': 0,
-                        'z': self.players[player_id]['z'],
-                    }, exclude=player_id)
-                    print(f"  [+] {self.players[player_id]['name']} joined — {len(self.players)} online")
-
-                elif msg_type == 'move' and player_id and player_id in self.players:
-                    p = self.players[player_id]
-                    for k in ('x', 'y', 'z', 'ry', 'anim'):
-                        if k in data:
-                            p[k] = data[k]
-
-                elif msg_type == 'chat' and player_id and player_id in self.players:
-                    msg_text = data.get('message', '')[:200]
-                    if msg_text.strip():
-                        await self.broadcast({
-                            'type': 'chat',
-                            'id': player_id,
-                            'name': self.players[player_id]['name'],
-                            'message': msg_text,
-                            'color': self.players[player_id].get('color', 0xffffff)
-                        })
-                        print(f"  [💬] {self.players[player_id]['name']}: {msg_text}")
-
-                elif msg_type == 'whiteboard' and player_id:
-                    # Relay whiteboard data to all OTHER players
-                    await self.broadcast({
-                        'type': 'whiteboard',
-                        'data': data.get('data', {})
-                    }, exclude=player_id)
-
-                elif msg_type == 'world_edit' and player_id:
-                    # Relay world edits (spawn, delete, move)
-                    await self.broadcast({
-                        'type': 'world_edit',
-                        'id': player_id,
-                        'action': data.get('action'),
-                        'data': data.get('data', {})
-                    }, exclude=player_id)
-
-                elif msg_type == 'voice_talking' and player_id:
-                    # Broadcast who is talking for proximity indicators
-                    await self.broadcast({
-                        'type': 'voice_talking',
-                        'id': player_id,
-                        'talking': data.get('talking', False)
-                    }, exclude=player_id)
-
-                elif msg_type == 'voice_ready' and player_id:
-                    await self.broadcast({
-                        'type': 'voice_ready',
-                        'id': player_id
-                    }, exclude=player_id)
+                if client.reject(kind, reason):
+                    log('kick', '[!] Disconnecting {player}: too many rejected messages',
+                        player=client.player_id or websocket.remote_address)
+                    kicked = True
+                    break
 
         except websockets.exceptions.ConnectionClosed:
             pass
         except Exception as e:
-            print(f"  [!] Error: {e}")
+            log('error', '[!] Error: {error}', player=client.player_id, error=str(e))
         finally:
-            if player_id:
-                name = self.players.get(player_id, {}).get('name', '?')
-                self.players.pop(player_id, None)
-                self.connections.pop(player_id, None)
-                await self.broadcast({'type': 'player_leave', 'id': player_id})
-                print(f"  [-] {name} left — {len(self.players)} online")
-
-    async def broadcast(self, message, exclude=None):
-        msg_str = json.dumps(message)
-        dead = []
-        for pid, ws in self.connections.items():
-            if pid == exclude:
+            room, player_id = client.room, client.player_id
+            if room is not None:
+                name = room.players.profiles.get(player_id, {}).get('name', '?')
+                self.room_of.pop(player_id, None)
+                self.clients.pop(player_id, None)
+                room.drop(player_id)
+                room.broadcast({'type': 'player_leave', 'id': player_id})
+                self.publish({'op': 'leave', 'id': player_id})
+                self.publish_load(self.scheduler.tick)
+                self.close_room_if_empty(room)
+                log('leave', '[-] {name} left {room} — {online} online',
+                    player=player_id, name=name, room=room.key, online=self.online)
+        if kicked:
+            # Its unread frames hold up the close handshake, so don't wait long for it
+            websocket.close_timeout = 1
+            await websocket.close(1008, 'too many rejected messages')  # policy violation
+
+    # ── Inbound handlers (see INBOUND) ──
+    async def on_join(self, client, data):
+        # A session token makes the account's name and color
+        # authoritative; without one (or with a bad one) it's a guest
+        account = await self.sessions.validate(data['token']) if data.get('token') else None
+        player_id = client.player_id = self.get_id()
+        room = client.room = self.assign_room(data.get('room'))
+        self.room_of[player_id] = room
+        self.clients[player_id] = client
+        room.connections[player_id] = box = Outbox(client.websocket)
+        if box.deflate is not None and COMPRESSION_PRIME:
+            box.push(COMPRESSION_PRIMER, RELIABLE, 'dict')
+        player_color = data.get('color', random.choice(self.colors))
+        player_name = data.get('name', f'Player {player_id}')
+        if account is not None:
+            player_name = account['name']
+            if account['color'] is not None:
+                player_color = account['color']
+        room.players.add(player_id, {
+            'name': player_name,
+            'color': player_color,
+        }, random.uniform(6, 10), 0, random.uniform(6, 10))
+        me, near = room.introduce(player_id)
+        room.baselines[player_id] = ClientBaseline()
+        proto = 'json'
+        if data.get('proto') == WIRE_PROTOCOL:
+            proto = WIRE_PROTOCOL
+            room.binary.add(player_id)
+
+        room.send_to(player_id, {
+            'type': 'welcome',
+            'id': player_id,
+            'you': me,
+            'proto': proto,
+            'room': room.key,
+            'tick': room.scheduler.tick,
+            'tickRate': room.scheduler.rate,
+            'interpDelay': INTERP_DELAY_MS,
+            'npcs': len(room.npcs),
+            'idleAfter': IDLE_AFTER,
+            'worker': self.worker,
+            'account': account['id'] if account else None
+        })
+        room.send_player_list(player_id, [player_id] + near)
+        topics = topic_names(data['topics']) if 'topics' in data else list(TOPICS)
+        room.subscribe(player_id, topics, joining=True)
+
+        self.publish({'op': 'join', 'room': room.key, 'player': me, 'worker': self.worker})
+        self.publish_load(self.scheduler.tick)
+        log('join', '[+] {name} joined {room} — {in_room} in room, {online} online',
+            player=player_id, name=me['name'], room=room.key, in_room=room.population,
+            online=self.online, account=account['id'] if account else None)
+
+    def on_move(self, client, data):
+        client.room.queue_move(client.player_id, data)
+
+    def on_subscribe(self, client, data):
+        client.room.subscribe(client.player_id, topic_names(data.get('topics')))
+
+    def on_unsubscribe(self, client, data):
+        client.room.topics.unsubscribe(client.player_id, topic_names(data.get('topics')))
+
+    def on_ack(self, client, data):
+        client.room.baselines[client.player_id].ack(data.get('seq'))
+
+    def on_resync(self, client, data):
+        # Client lost its baseline; next state frame is a full snapshot
+        client.room.baselines[client.player_id].reset()
+
+    def on_presence(self, client, data):
+        # Sent on user input (throttled) and when the tab is hidden or shown
+        client.room.report_input(client.player_id, hidden=data.get('hidden', False))
+
+    def on_appearance_update(self, client, data):
+        room, player_id = client.room, client.player_id
+        update_data = {k: v for k, v in data.get('data', {}).items() if k in APPEARANCE_FIELDS}
+        room.players.profile(player_id).update(update_data)
+        room.relay({
+            'type': 'appearance_update',
+            'id': player_id,
+            'data': update_data
+        }, exclude=player_id)
+
+    def on_chat(self, client, data):
+        room, player_id = client.room, client.player_id
+        msg_text = data.get('message', '')[:200]
+        channel = topic_name(f"chat:{data['channel']}" if data.get('channel') else 'chat')
+        if msg_text.strip() and channel:
+            profile = room.players.profile(player_id)
+            room.relay({
+                'type': 'chat',
+                'id': player_id,
+                'name': profile['name'],
+                'message': msg_text,
+                'color': profile.get('color', 0xffffff),
+                **({'channel': channel[5:]} if channel != 'chat' else {})
+            }, topic=channel)
+            log('chat', '[💬] {name}: {message}', player=player_id, name=profile['name'],
+                room=room.key, message=msg_text)
+
+    def on_whiteboard(self, client, data):
+        # Strokes are buffered and go out with the next tick; a
+        # clear is immediate and also drops the history
+        room = client.room
+        draw = data.get('data')
+        if isinstance(draw, dict) and draw.get('type') == 'clear':
+            room.board.clear()
+            room.relay({'type': 'whiteboard', 'data': {'type': 'clear'}}, exclude=client.player_id,
+                       topic='whiteboard')
+        else:
+            room.board.draw(client.player_id, draw)
+
+    def on_world_edit(self, client, data):
+        # Edits (spawn, delete, move) go through the world's owner,
+        # which echoes the sequenced op to everyone, editor included
+        edit = data.get('data')
+        ref = edit.get('ref') if isinstance(edit, dict) else None
+        if self.worker == 0:
+            self.apply_world_edit(data.get('action'), edit, client.player_id, ref)
+        else:
+            self.publish({'op': 'world_edit', 'action': data.get('action'), 'data': edit,
+                          'by': client.player_id, 'ref': ref})
+
+    def on_voice_talking(self, client, data):
+        # Tell the voice group who is talking, for proximity indicators
+        group = topic_name(f"voice:{data['group']}" if data.get('group') else 'voice')
+        if group:
+            client.room.relay({
+                'type': 'voice_talking',
+                'id': client.player_id,
+                'talking': data.get('talking', False)
+            }, exclude=client.player_id, topic=group)
+
+    def on_voice_ready(self, client, data):
+        group = topic_name(f"voice:{data['group']}" if data.get('group') else 'voice')
+        if group:
+            client.room.relay({
+                'type': 'voice_ready',
+                'id': client.player_id
+            }, exclude=client.player_id, topic=group)
+
+    # ── World ──
+    def apply_world_edit(self, action, data, by, ref=None):
+        """Apply an edit as the world's owner and send the op everywhere."""
+        op = self.world.edit(action, data)
+        if op is None:
+            return
+        self.broadcast_world_op(op, by, ref)
+        self.publish({'op': 'world', 'entry': op, 'by': by, 'ref': ref})
+
+    def broadcast_world_op(self, op, by, ref):
+        """Queue a world_edit for every 'world' subscriber; `ref` lets the editor match its own object."""
+        self.broadcast_all(json.dumps({'type': 'world_edit', 'id': by, 'ref': ref, **op}), 'world_edit', 'world')
+
+    def broadcast_all(self, payload, kind, topic):
+        """Queue an encoded payload for the subscribers of `topic` in every room."""
+        started = time.perf_counter()
+        for room in self.rooms.values():
+            for pid in room.topics[topic]:
+                room.connections[pid].defer(payload, RELIABLE, kind)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started, kind)
+
+    # ── Worker bus ──
+    def publish(self, message):
+        if self.bus is not None:
+            self.bus.publish(message)
+
+    def publish_load(self, tick):
+        self.worker_load[self.worker] = self.connection_count
+        self.publish({'op': 'load', 'worker': self.worker, 'connections': self.connection_count})
+
+    def on_bus_frame(self, kind, payload):
+        """Apply a frame another worker published."""
+        if kind == BUS_STATE:
+            records = np.frombuffer(payload, BUS_RECORD)
+            rows_by_room = {}
+            for row, pid in enumerate(records['id'].tolist()):
+                room = self.room_of.get(str(pid))
+                if room is not None:
+                    rows_by_room.setdefault(room, []).append(row)
+            for room, rows in rows_by_room.items():
+                rec = records[rows]
+                slots = np.array([room.players.slot_of[str(i)] for i in rec['id'].tolist()], np.intp)
+                room.players.write(slots, rec['x'], rec['y'], rec['z'], rec['ry'], rec['anim'])
+            return
+
+        msg = json.loads(payload)
+        op = msg.get('op')
+        if op == 'event':
+            room = self.rooms.get(msg['room'])
+            if room is None:
+                return
+            event = msg['msg']
+            if event['type'] == 'appearance_update' and event['id'] in room.players:
+                room.players.profile(event['id']).update(event['data'])
+            elif event['type'] == 'whiteboard':
+                if event['data']['type'] == 'clear':
+                    room.board.clear()
+                else:
+                    room.board.record(event['data']['strokes'])
+            room.broadcast(event, topic=msg.get('topic'))
+        elif op == 'join':
+            player = msg['player']
+            pid = player['id']
+            if pid in self.room_of:
+                return  # already mirrored (replayed after a 'hello')
+            room = self.open_room(msg['room'])
+            profile = {k: v for k, v in player.items() if k not in DYNAMIC_FIELDS and k != 'id'}
+            room.players.add(pid, profile, player['x'], player['y'], player['z'], player['ry'], player['anim'])
+            self.room_of[pid] = room
+            self.remote[pid] = msg['worker']
+            room.introduce(pid)
+        elif op == 'leave':
+            self._drop_remote(msg['id'])
+        elif op == 'hello':
+            # A worker (re)connected: replay our players so it can mirror them
+            for room in self.rooms.values():
+                for pid in room.connections:
+                    self.publish({'op': 'join', 'room': room.key, 'player': room.players.record(pid),
+                                  'worker': self.worker})
+            self.publish_load(self.scheduler.tick)
+            if self.worker == 0:
+                self.publish(self.world.sync_message())
+        elif op == 'session':
+            self.sessions.cache.put(msg['sid'], msg['user'])
+        elif op == 'revoke':
+            self.sessions.cache.revoke(msg['sid'])
+        elif op == 'world_edit':
+            if self.worker == 0:
+                self.apply_world_edit(msg['action'], msg['data'], msg['by'], msg['ref'])
+        elif op == 'world':
+            if self.world.replay(msg['entry']):
+                self.broadcast_world_op(msg['entry'], msg['by'], msg['ref'])
+            elif msg['entry']['seq'] > self.world.seq + 1:
+                self.publish({'op': 'world_resync'})  # missed ops: ask for the whole table
+        elif op == 'world_resync':
+            if self.worker == 0:
+                self.publish(self.world.sync_message())
+        elif op == 'world_sync':
+            if self.worker != 0:
+                self.world.restore(msg)
+                self.broadcast_all(self.world.join_message(), 'world', 'world')
+        elif op == 'load':
+            self.worker_load[msg['worker']] = msg['connections']
+        elif op == 'down':
+            # A worker (or, with worker None, the whole bus) went away
+            gone = [pid for pid, w in self.remote.items() if msg['worker'] in (None, w)]
+            for pid in gone:
+                self._drop_remote(pid)
+            if msg['worker'] is None:
+                self.worker_load = {self.worker: self.connection_count}
+            else:
+                self.worker_load.pop(msg['worker'], None)
+            if gone:
+                log('worker_down', '[!] Worker {worker} down — dropped {players} players',
+                    worker=msg['worker'], players=len(gone))
+
+    def _drop_remote(self, pid):
+        if self.remote.pop(pid, None) is None:
+            return
+        room = self.room_of.pop(pid, None)
+        if room is not None:
+            room.drop(pid)
+            room.broadcast({'type': 'player_leave', 'id': pid})
+            self.close_room_if_empty(room)
+
+    def log_stats(self, tick):
+        for room in list(self.rooms.values()):
+            st = room.scheduler.stats()
+            moved = len(room.players.take_dirty())
+            log('tick_stats', '[⏱] {room} tick {tick} — {players} players ({moved} moved), '
+                '{overruns} overruns, {skipped} skipped, max {max_tick_ms} ms',
+                room=room.key, players=room.population, moved=moved,
+                **{k: st[k] for k in ('tick', 'overruns', 'skipped', 'max_tick_ms')})
+        if self.bus is not None:
+            load = ', '.join(f"#{w}: {n}" for w, n in sorted(self.worker_load.items()))
+            log('worker_load', '[⚙] worker {worker} — connections per worker {load}',
+                worker=self.worker, load=load)
+
+    def stats(self):
+        self.worker_load[self.worker] = self.connection_count
+        return {
+            'online': self.online,
+            'worker': self.worker,
+            'workers': {str(w): n for w, n in sorted(self.worker_load.items())},
+            'world': self.world.stats(),
+            'rooms': {
+                key: {
+                    'players': room.population,
+                    'connections': len(room.connections),
+                    'idle': {mode: sum(1 for m in room.idle.values() if m == mode) for mode in ('afk', 'hidden')},
+                    'npcs': room.npcs.stats(),
+                    'tick': room.scheduler.stats(),
+                    'whiteboard': room.board.stats(),
+                    'topics': room.topics.stats(),
+                    'history': room.history.stats(),
+                }
+                for key, room in self.rooms.items()
+            },
+        }
+
+    def connection_stats(self):
+        """
+        Per local connection: idle mode, traffic both ways and approximate
+        outbound memory, plus per-mode averages to compare them by.
+        """
+        conns = []
+        for pid, client in self.clients.items():
+            box = client.room.connections.get(pid)
+            if box is not None:
+                conns.append({'id': pid, 'room': client.room.key, 'mode': client.room.idle.get(pid, 'active'),
+                              'received': client.received, 'bytes_received': client.bytes_received,
+                              **box.stats()})
+        modes = {}
+        for conn in conns:
+            modes.setdefault(conn['mode'], []).append(conn)
+        summary = {mode: {
+            'connections': len(group),
+            'bytes_per_s': round(sum(c['mode_bytes_per_s'] for c in group) / len(group)),
+            'memory': round(sum(c['memory']['total'] for c in group) / len(group)),
+        } for mode, group in modes.items()}
+        return {'worker': self.worker, 'modes': summary, 'connections': conns}
+
+
+# ─── Static Asset Cache ──────────────────────────────────────
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'model/gltf+json',
+                      'model/gltf-binary')
+
+
+def parse_cache_control(spec):
+    """'pattern=value;pattern=value' -> [(pattern, value)], first match wins."""
+    rules = []
+    for rule in spec.split(';'):
+        pattern, sep, value = rule.partition('=')
+        if sep and pattern.strip():
+            rules.append((pattern.strip(), value.strip()))
+    return rules
+
+
+CACHE_CONTROL_RULES = parse_cache_control(STATIC_CACHE_CONTROL)
+
+
+def parse_static_paths(spec):
+    """STATIC_PATHS -> (set of file paths, tuple of directory prefixes)."""
+    paths = [p.strip() for p in spec.split(';') if p.strip()]
+    return {p for p in paths if not p.endswith('/')}, tuple(p for p in paths if p.endswith('/'))
+
+
+STATIC_FILES, STATIC_DIRS = parse_static_paths(STATIC_PATHS)
+
+
+def static_allowed(url_path):
+    """Whether a URL path may be served: listed in STATIC_PATHS, with no dotfile or *.db* part."""
+    for part in url_path.split('/'):
+        if part.startswith('.') or fnmatch.fnmatchcase(part.lower(), '*.db*'):
+            return False
+    return url_path in STATIC_FILES or url_path.startswith(STATIC_DIRS)
+
+
+def cache_control_for(url_path):
+    for pattern, value in CACHE_CONTROL_RULES:
+        if fnmatch.fnmatchcase(url_path, pattern):
+            return value
+    return 'no-cache'
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts (q > 0), from Accept-Encoding."""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
                 continue
+        if q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def etag_matches(header, etag):
+    """If-None-Match check (weak comparison, as RFC 9110 requires for it)."""
+    if header.strip() == '*':
+        return True
+    bare = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == bare for tag in header.split(','))
+
+
+def parse_range(header, size):
+    """
+    Inclusive (start, end) for a single 'bytes=' range, None to ignore the
+    header (absent, malformed or multi-range: send the whole file), or
+    False when no byte of the file is in range.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = size - int(last), size - 1  # suffix: the last N bytes
+            if end < start:
+                return False
+            start = max(start, 0)
+    except ValueError:
+        return None
+    if start >= size:
+        return False
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def request_range(request, etag, size):
+    """parse_range() for the request, unless an If-Range validator no longer matches."""
+    header = request.headers.get('Range', '')
+    if not header:
+        return None
+    if_range = request.headers.get('If-Range', '')
+    if if_range and if_range.strip() != etag:
+        return None  # changed since the first part was fetched: start over
+    return parse_range(header, size)
+
+
+class StaticAsset:
+    """A file as loaded from disk: body, strong ETag and compressed variants."""
+    __slots__ = ('path', 'mtime_ns', 'size', 'content_type', 'etag', 'body', 'variants')
+
+    def __init__(self, path, st, content_type, body):
+        self.path = path
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.content_type = content_type
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.variants = {}  # content coding -> compressed body
+        if len(body) >= STATIC_COMPRESS_MIN and content_type.startswith(COMPRESSIBLE_TYPES):
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants['gzip'] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.variants['br'] = br
+
+    @property
+    def cost(self):
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+    def fresh(self, st):
+        return st.st_mtime_ns == self.mtime_ns and st.st_size == self.size
+
+    def select(self, accept_encoding):
+        """(coding or None, body, etag) for the best representation the client accepts."""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ('br', 'gzip'):
+            if coding in self.variants and coding in accepted:
+                return coding, self.variants[coding], self.etag[:-1] + '-' + coding + '"'
+        return None, self.body, self.etag
+
+
+class StaticCache:
+    """
+    LRU of StaticAssets keyed by URL path, bounded by total bytes (bodies
+    plus compressed variants). A hit costs one stat() to check mtime and
+    size; misses read and compress in a worker thread, off the event loop.
+    Files over STATIC_CACHE_MAX_FILE are served but never cached (those
+    of STATIC_STREAM_MIN and up are streamed and never get here).
+    """
+    def __init__(self, budget=STATIC_CACHE_BYTES, max_file=STATIC_CACHE_MAX_FILE):
+        self.budget = budget
+        self.max_file = max_file
+        self.entries = OrderedDict()  # url path -> StaticAsset
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, url_path, file_path):
+        """StaticAsset for an already-resolved file, or None if it isn't a readable file."""
+        entry = self.entries.get(url_path)
+        if entry is not None and entry.path != file_path:
+            # A converted model whose source changed: the URL now maps to another file
+            self._discard(url_path)
+            entry = None
+        try:
+            st = os.stat(entry.path if entry else file_path)
+        except OSError:
+            self._discard(url_path)
+            return None
+        if entry is not None and entry.fresh(st):
+            self.entries.move_to_end(url_path)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        self._discard(url_path)
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        content_type = MIME_MAP.get(file_path.suffix.lower(), 'application/octet-stream')
+        try:
+            entry = await asyncio.to_thread(load_asset, file_path, content_type)
+        except OSError:
+            return None
+        if entry.size <= self.max_file:
+            self.entries[url_path] = entry
+            self.bytes += entry.cost
+            while self.bytes > self.budget and self.entries:
+                _, old = self.entries.popitem(last=False)
+                self.bytes -= old.cost
+                self.evictions += 1
+        return entry
+
+    def lookup(self, url_path):
+        """Cached file path for a URL, skipping resolve() on repeat requests."""
+        entry = self.entries.get(url_path)
+        return entry.path if entry else None
+
+    def _discard(self, url_path):
+        old = self.entries.pop(url_path, None)
+        if old is not None:
+            self.bytes -= old.cost
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def load_asset(path, content_type):
+    """Read and compress a file (runs in a worker thread)."""
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        body = f.read()
+    return StaticAsset(path, st, content_type, body)
+
+
+static_cache = StaticCache()
+
+
+class StaticStreamer:
+    """
+    Sends large files from disk without buffering them. The handshake
+    aborts any connection that doesn't upgrade to WebSocket, so the
+    socket is dup()ed away from the websockets transport first; the body
+    then goes out with loop.sock_sendfile() (zero-copy sendfile(), or
+    chunked reads in a worker thread where that isn't available). At most
+    `limit` streams run at once and up to `backlog` more wait for a slot.
+    """
+    def __init__(self, limit=STATIC_STREAM_CONCURRENCY, backlog=STATIC_STREAM_BACKLOG):
+        self.limit = limit
+        self.backlog = backlog
+        self.slots = asyncio.Semaphore(limit)
+        self.tasks = set()
+        self.active = 0
+        self.completed = 0
+        self.aborted = 0
+        self.rejected = 0
+
+    def full(self):
+        if len(self.tasks) < self.limit + self.backlog:
+            return False
+        self.rejected += 1
+        return True
+
+    async def start(self, connection, head, file, offset, count):
+        """Take over the connection's socket and send head, then count bytes of file from offset."""
+        sock = connection.transport.get_extra_info('socket').dup()
+        sock.setblocking(False)
+        task = asyncio.create_task(self._send(sock, head, file, offset, count))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        # Once the transport is closed the handshake sends nothing itself
+        connection.transport.abort()
+        await connection.wait_closed()
+
+    async def _send(self, sock, head, file, offset, count):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.slots:
+                self.active += 1
+                try:
+                    await loop.sock_sendall(sock, head)
+                    if count:
+                        STATIC_STREAM_BYTES.inc(n=await loop.sock_sendfile(sock, file, offset, count))
+                    self.completed += 1
+                except OSError:
+                    self.aborted += 1  # client went away mid-download
+                finally:
+                    self.active -= 1
+        finally:
+            file.close()
+            sock.close()
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'waiting': len(self.tasks) - self.active,
+            'limit': self.limit,
+            'completed': self.completed,
+            'aborted': self.aborted,
+            'rejected': self.rejected,
+        }
+
+
+static_streamer = StaticStreamer()
+
+
+# ─── Model Conversion ────────────────────────────────────────
+# OBJ text is slow to download and slower to parse on a phone, so models
+# are converted once into GLB: one mesh, a primitive per material, with
+# vertices deduplicated behind an index buffer and quantized as allowed
+# by KHR_mesh_quantization (int16 positions scaled by the node, int8
+# normals, uint16 texcoords when they fit). Materials keep only the .mtl
+# diffuse color and opacity; texture maps aren't carried over.
+MODEL_FORMAT_VERSION = 1   # bump when convert_model's output changes, to invalidate the cache
+GL_BYTE, GL_SHORT, GL_UNSIGNED_SHORT, GL_UNSIGNED_INT, GL_FLOAT = 5120, 5122, 5123, 5125, 5126
+GL_ARRAY_BUFFER, GL_ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+
+def model_key(path):
+    """
+    (content hash, input files) for an OBJ: the file itself plus the .mtl
+    files it names, including any that don't exist (yet).
+    """
+    data = path.read_bytes()
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(f'v{MODEL_FORMAT_VERSION}'.encode())
+    inputs = [path]
+    for names in re.findall(rb'^mtllib[ \t]+(.+?)\s*$', data, re.M):
+        for name in names.decode('utf-8', 'replace').split():
+            mtl = (path.parent / name).resolve()
+            if mtl.is_relative_to(path.parent) and mtl not in inputs:
+                inputs.append(mtl)
+                if mtl.is_file():
+                    h.update(mtl.read_bytes())
+    return h.hexdigest(), inputs
+
+
+def srgb_to_linear(c):
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def parse_mtl(text, materials):
+    """Add each newmtl's diffuse color and opacity, as a linear RGBA list, to `materials`."""
+    name = None
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == 'newmtl' and len(parts) > 1:
+            name = parts[1]
+            materials[name] = [0.8, 0.8, 0.8, 1.0]
+        elif name is None:
+            continue
+        elif parts[0] == 'Kd' and len(parts) >= 4:
+            materials[name][:3] = [srgb_to_linear(min(max(float(c), 0.0), 1.0)) for c in parts[1:4]]
+        elif parts[0] == 'd' and len(parts) > 1:
+            materials[name][3] = min(max(float(parts[1]), 0.0), 1.0)
+        elif parts[0] == 'Tr' and len(parts) > 1:
+            materials[name][3] = 1.0 - min(max(float(parts[1]), 0.0), 1.0)
+
+
+def parse_obj(text):
+    """
+    Vertex data and faces of an OBJ: (v, vt, vn, {material: corners}),
+    where corners is a flat list of (v, vt, vn) 1-based index triples,
+    three per triangle, with 0 for a missing index.
+    """
+    v, vt, vn = [], [], []
+    faces = {}
+    corners = faces.setdefault(None, [])
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        tag = parts[0]
+        if tag == 'v':
+            v.append(parts[1:4])
+        elif tag == 'vt':
+            vt.append((parts[1:3] + ['0'])[:2])
+        elif tag == 'vn':
+            vn.append(parts[1:4])
+        elif tag == 'f':
+            face = []
+            for corner in parts[1:]:
+                refs = corner.split('/')
+                triple = []
+                for i, count in enumerate((len(v), len(vt), len(vn))):
+                    ref = int(refs[i]) if i < len(refs) and refs[i] else 0
+                    triple.append(ref + count + 1 if ref < 0 else ref)
+                face.append(tuple(triple))
+            for i in range(1, len(face) - 1):
+                corners += (face[0], face[i], face[i + 1])
+        elif tag == 'usemtl':
+            corners = faces.setdefault(parts[1] if len(parts) > 1 else None, [])
+    return v, vt, vn, faces
+
+
+def quantize_unit(values, dtype, limit, width=4):
+    """Round [-1, 1] (or [0, 1]) floats to normalized integers, padded to `width` components."""
+    out = np.zeros((len(values), width), dtype)
+    out[:, :values.shape[1]] = np.rint(np.clip(values, -1, 1) * limit)
+    return out
+
+
+class GlbWriter:
+    """Collects accessors over one binary buffer and packs the .glb."""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.views = []
+        self.accessors = []
+
+    def add(self, array, component, kind, count, target, stride=None, normalized=False, bounds=None):
+        data = np.ascontiguousarray(array).tobytes()
+        view = {'buffer': 0, 'byteOffset': self.size, 'byteLength': len(data), 'target': target}
+        if stride:
+            view['byteStride'] = stride
+        self.views.append(view)
+        pad = -len(data) % 4
+        self.chunks.append(data + b'\0' * pad)
+        self.size += len(data) + pad
+        accessor = {'bufferView': len(self.views) - 1, 'componentType': component, 'count': count, 'type': kind}
+        if normalized:
+            accessor['normalized'] = True
+        if bounds is not None:
+            accessor['min'], accessor['max'] = bounds
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def pack(self, gltf):
+        gltf.update(bufferViews=self.views, accessors=self.accessors, buffers=[{'byteLength': self.size}])
+        doc = json.dumps(gltf, separators=(',', ':')).encode()
+        doc += b' ' * (-len(doc) % 4)
+        body = b''.join(self.chunks)
+        return b''.join((
+            struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(doc) + 8 + len(body)),
+            struct.pack('<I4s', len(doc), b'JSON'), doc,
+            struct.pack('<I4s', len(body), b'BIN\0'), body,
+        ))
+
+
+def convert_model(obj_path, mtl_paths, out_path):
+    """
+    Process-pool job: convert an OBJ to GLB at out_path (written
+    atomically). Returns (vertices, triangles, input bytes, output bytes).
+    """
+    text = Path(obj_path).read_text('utf-8', 'replace')
+    materials = {}
+    for mtl in mtl_paths:
+        if not os.path.isfile(mtl):
+            continue
+        parse_mtl(Path(mtl).read_text('utf-8', 'replace'), materials)
+    v, vt, vn, faces = parse_obj(text)
+    pos = np.array(v, np.float64).reshape(-1, 3)
+    uvs = np.array(vt, np.float64).reshape(-1, 2)
+    nrm = np.array(vn, np.float64).reshape(-1, 3)
+    groups = [(name, np.array(c, np.int64).reshape(-1, 3)) for name, c in faces.items() if c]
+    if not groups:
+        raise ValueError('no faces')
+    refs = np.concatenate([c for _, c in groups])
+    for col, count in ((0, len(pos)), (1, len(uvs)), (2, len(nrm))):
+        if refs[:, col].max() > count or (col == 0 and refs[:, 0].min() < 1):
+            raise ValueError('face index out of range')
+
+    # Positions are stored relative to the model's center, in units of its
+    # half-extent; the node transform scales them back
+    used = pos[np.unique(refs[:, 0]) - 1]
+    lo, hi = used.min(axis=0), used.max(axis=0)
+    center = (lo + hi) / 2
+    scale = float((hi - lo).max() / 2) or 1.0
+
+    glb = GlbWriter()
+    primitives, gltf_materials = [], []
+    vertices = 0
+    for name, corners in groups:
+        unique, inverse = np.unique(corners, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        n = len(unique)
+        vertices += n
+        qpos = quantize_unit((pos[unique[:, 0] - 1] - center) / scale, '<i2', 32767)
+        attributes = {'POSITION': glb.add(
+            qpos, GL_SHORT, 'VEC3', n, GL_ARRAY_BUFFER, stride=8, normalized=True,
+            bounds=(qpos[:, :3].min(axis=0).tolist(), qpos[:, :3].max(axis=0).tolist()))}
+        if (unique[:, 2] > 0).all():
+            normals = nrm[unique[:, 2] - 1]
+            normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+            attributes['NORMAL'] = glb.add(quantize_unit(normals, '<i1', 127), GL_BYTE, 'VEC3', n,
+                                           GL_ARRAY_BUFFER, stride=4, normalized=True)
+        if (unique[:, 1] > 0).all():
+            uv = uvs[unique[:, 1] - 1].copy()
+            uv[:, 1] = 1 - uv[:, 1]   # OBJ's v runs bottom-up, glTF's top-down
+            if (uv >= 0).all() and (uv <= 1).all():
+                attributes['TEXCOORD_0'] = glb.add(quantize_unit(uv, '<u2', 65535, 2), GL_UNSIGNED_SHORT,
+                                                   'VEC2', n, GL_ARRAY_BUFFER, stride=4, normalized=True)
+            else:
+                attributes['TEXCOORD_0'] = glb.add(uv.astype('<f4'), GL_FLOAT, 'VEC2', n,
+                                                   GL_ARRAY_BUFFER, stride=8)
+        wide = n > 65535
+        indices = glb.add(inverse.astype('<u4' if wide else '<u2'), GL_UNSIGNED_INT if wide else GL_UNSIGNED_SHORT,
+                          'SCALAR', len(inverse), GL_ELEMENT_ARRAY_BUFFER)
+
+        r, g, b, a = materials.get(name, [srgb_to_linear(c / 255) for c in (0x7c, 0x8e, 0xa6)] + [1.0])
+        material = {'name': name or 'default', 'doubleSided': True, 'pbrMetallicRoughness': {
+            'baseColorFactor': [r, g, b, a], 'metallicFactor': 0.3, 'roughnessFactor': 0.55}}
+        if a < 1:
+            material['alphaMode'] = 'BLEND'
+        gltf_materials.append(material)
+        primitives.append({'attributes': attributes, 'indices': indices,
+                           'material': len(gltf_materials) - 1, 'mode': 4})
+
+    data = glb.pack({
+        'asset': {'version': '2.0', 'generator': '13metaverse online_server'},
+        'extensionsUsed': ['KHR_mesh_quantization'],
+        'extensionsRequired': ['KHR_mesh_quantization'],
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'name': Path(obj_path).stem,
+                   'translation': center.tolist(), 'scale': [scale] * 3}],
+        'meshes': [{'primitives': primitives}],
+        'materials': gltf_materials,
+    })
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(f'{out_path.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, out_path)
+    return vertices, len(refs) // 3, len(text), len(data)
+
+
+def exit_with_parent():
+    """
+    Pool initializer: exit when the process that started the pool does.
+    A server that is killed never shuts its pool down, and the pool's
+    processes hold both ends of their queue, so they'd wait forever.
+    """
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class ModelConverter:
+    """
+    Hands out the GLB for an OBJ, converting it in a process pool on first
+    use. Output is cached in `cache_dir` by content hash (so it survives
+    restarts and is shared by workers); concurrent requests for the same
+    model share one job, and a model that fails to convert is served as
+    the original OBJ.
+    """
+    def __init__(self, cache_dir=MODEL_CACHE_DIR, workers=MODEL_WORKERS):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.pool = None
+        self.jobs = {}    # content hash -> conversion future
+        self.known = {}   # obj path -> (content hash, [(input path, mtime_ns, size)])
+        self.converted = 0
+        self.hits = 0
+        self.failed = 0
+
+    def _stamp(self, inputs):
+        stamps = []
+        for path in inputs:
             try:
-                await ws.send(msg_str)
-            except Exception:
-                dead.append(pid)
-        for pid in dead:
-            self.connections.pop(pid, None)
-            self.players.pop(pid, None)
-
-    async def state_loop(self):
-        """Broadcast all player positions at 20Hz."""
-        while True:
-            if self.players:
-                await self.broadcast({
-                    'type': 'state',
-                    'players': list(self.players.values())
-                })
-            await asyncio.sleep(0.05)
+                st = os.stat(path)
+            except FileNotFoundError:
+                stamps.append((path, None, None))
+            else:
+                stamps.append((path, st.st_mtime_ns, st.st_size))
+        return stamps
+
+    async def _key(self, path):
+        """Content hash of an OBJ and its materials, rehashed only when one of them changes."""
+        known = self.known.get(path)
+        if known is not None:
+            key, stamps = known
+            inputs = [p for p, _, _ in stamps]
+            if self._stamp(inputs) == stamps:
+                return key, inputs
+        key, inputs = await asyncio.to_thread(model_key, path)
+        self.known[path] = (key, self._stamp(inputs))
+        return key, inputs
+
+    async def glb_for(self, path):
+        """Path of the converted GLB for an OBJ file, or None if it isn't available."""
+        try:
+            key, inputs = await self._key(path)
+        except OSError:
+            return None
+        out = self.cache_dir / f'{key}.glb'
+        if out.is_file():
+            self.hits += 1
+            return out
+        job = self.jobs.get(key)
+        if job is None:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=exit_with_parent)
+            started = time.perf_counter()
+            job = asyncio.get_running_loop().run_in_executor(
+                self.pool, convert_model, str(path), [str(p) for p in inputs[1:]], str(out))
+            self.jobs[key] = job
+            job.add_done_callback(partial(self._done, key, path, started))
+        try:
+            await asyncio.shield(job)
+        except Exception:
+            return None
+        return out
 
+    def _done(self, key, path, started, job):
+        self.jobs.pop(key, None)
+        if job.cancelled():
+            return
+        if job.exception() is not None:
+            self.failed += 1
+            log('model_error', '[!] Could not convert {path}: {error}', path=str(path), error=str(job.exception()))
+            return
+        self.converted += 1
+        vertices, triangles, size_in, size_out = job.result()
+        log('model_convert', '[🧊] {path} → GLB: {triangles} triangles, {size_in} → {size_out} bytes in {ms} ms',
+            path=str(path.relative_to(ROOT_DIR)) if path.is_relative_to(ROOT_DIR) else str(path),
+            vertices=vertices, triangles=triangles, size_in=size_in, size_out=size_out,
+            ms=round((time.perf_counter() - started) * 1000))
 
-# ─── HTTP Static File Handler (websockets v13-v15) ──────────
-def serve_file(connection, request):
+    async def preconvert(self, root=ROOT_DIR):
+        """Convert every .obj under `root` (skipping the cache itself)."""
+        paths = await asyncio.to_thread(
+            lambda: [p for p in root.rglob('*.obj') if not p.is_relative_to(self.cache_dir)])
+        await asyncio.gather(*(self.glb_for(p.resolve()) for p in paths))
+
+    def stats(self):
+        return {'converted': self.converted, 'cache_hits': self.hits, 'failed': self.failed,
+                'in_progress': len(self.jobs)}
+
+
+model_converter = ModelConverter()
+
+
+# ─── HTTP Static File Handler (websockets v17+) ─────────────
+async def serve_file(connection, request, game):
     """
     process_request handler for websockets.serve().
     In v13+, signature is (connection, request) where request is a Request object.
     Return a Response to serve HTTP, or None to proceed with WebSocket.
+    `game` is bound with functools.partial so API routes can report on it.
     """
-    # Only intercept non-WebSocket requests (normal HTTP GET)
+    # Only intercept non-WebSocket requests (plain HTTP GET, or POST/PUT for the API)
     if request.headers.get('Upgrade', '').lower() == 'websocket':
         return None  # Let it be handled as WebSocket
 
     url_path = request.path.split('?')[0]
-
-    # ─── API Routes ────────────────────────────────────────
+    started = time.perf_counter()
     if url_path.startswith('/api/'):
-        return handle_api(request, url_path)
+        route = url_path if url_path in API_ROUTES else '/api/other'
+        if url_path in ADMIN_ROUTES and not admin_allowed(connection, request):
+            response = Response(HTTPStatus.FORBIDDEN, "Forbidden\r\n", websockets.Headers())
+        else:
+            response = await handle_api(request, url_path, game)
+    else:
+        route = 'static'
+        response = await serve_static(connection, request, url_path)
+    HTTP_SECONDS.observe(time.perf_counter() - started, route)
+    HTTP_RESPONSES.inc(route, response.status_code)
+    return response
 
-    # ─── Static Files ──────────────────────────────────────
+
+async def serve_static(connection, request, url_path):
     if url_path == '/':
         url_path = '/index.html'
 
-    file_path = (ROOT_DIR / url_path.lstrip('/')).resolve()
+    # Security: only the client's own files, never server state
+    if not static_allowed(url_path):
+        return Response(HTTPStatus.NOT_FOUND, "Not Found\r\n", websockets.Headers())
 
-    # Security: no directory traversal
-    if not str(file_path).startswith(str(ROOT_DIR)):
-        return Response(HTTPStatus.FORBIDDEN, "Forbidden\r\n", websockets.Headers())
+    file_path = static_cache.lookup(url_path)
+    if file_path is None:
+        file_path = (ROOT_DIR / url_path.lstrip('/')).resolve()
 
-    if not file_path.is_file():
-        return Response(HTTPStatus.NOT_FOUND, "Not Found\r\n", websockets.Headers())
+        # Security: no directory traversal
+        if not file_path.is_relative_to(ROOT_DIR):
+            return Response(HTTPStatus.FORBIDDEN, "Forbidden\r\n", websockets.Headers())
 
-    try:
-        body = file_path.read_bytes()
-    except Exception:
-        return Response(HTTPStatus.INTERNAL_SERVER_ERROR, "Server Error\r\n", websockets.Headers())
+    # Models: clients that accept GLB get the converted file in place of the OBJ
+    cache_control = cache_control_for(url_path)
+    vary = 'Accept-Encoding'
+    if file_path.suffix.lower() == '.obj':
+        vary = 'Accept, Accept-Encoding'
+        if 'model/gltf-binary' in request.headers.get('Accept', ''):
+            glb = await model_converter.glb_for(file_path)
+            if glb is not None:
+                url_path, file_path = url_path + '#glb', glb
+
+    if static_cache.lookup(url_path) != file_path:
+        # Cached files are all small; anything else is checked for size first
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            st = None
+        if st is not None and stat.S_ISREG(st.st_mode) and st.st_size >= STATIC_STREAM_MIN:
+            return await stream_static(connection, request, file_path, cache_control, vary)
 
-    ext = file_path.suffix.lower()
-    content_type = MIME_MAP.get(ext, 'application/octet-stream')
+    asset = await static_cache.get(url_path, file_path)
+    if asset is None:
+        return Response(HTTPStatus.NOT_FOUND, "Not Found\r\n", websockets.Headers())
 
+    coding, body, etag = asset.select(request.headers.get('Accept-Encoding', ''))
     headers = websockets.Headers([
-        ('Content-Type', content_type),
-        ('Content-Length', str(len(body))),
-        ('Cache-Control', 'no-cache'),
+        ('Content-Type', asset.content_type),
+        ('Cache-Control', cache_control),
+        ('ETag', etag),
+        ('Vary', vary),
+        ('Accept-Ranges', 'bytes'),
         ('Access-Control-Allow-Origin', '*'),
     ])
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return Response(HTTPStatus.NOT_MODIFIED, "Not Modified", headers)
 
+    # Ranges are always of the identity body
+    span = request_range(request, asset.etag, asset.size)
+    if span is False:
+        headers['Content-Range'] = f'bytes */{asset.size}'
+        return Response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, "", headers)
+    if span is not None:
+        start, end = span
+        del headers['ETag']
+        headers['ETag'] = asset.etag
+        headers['Content-Range'] = f'bytes {start}-{end}/{asset.size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return Response(HTTPStatus.PARTIAL_CONTENT, "", headers, asset.body[start:end + 1])
+
+    if coding:
+        headers['Content-Encoding'] = coding
+    headers['Content-Length'] = str(len(body))
     return Response(HTTPStatus.OK, "", headers, body)
 
 
-def handle_api(request, url_path):
+async def stream_static(connection, request, file_path, cache_control, vary):
+    """
+    Large file: the response head and (part of) the body are sent by
+    static_streamer; the returned Response is only for metrics.
+    """
+    if static_streamer.full():
+        headers = websockets.Headers([('Retry-After', '5')])
+        return Response(HTTPStatus.SERVICE_UNAVAILABLE, "", headers, b'Busy\r\n')
+    try:
+        file = open(file_path, 'rb')
+    except OSError:
+        return Response(HTTPStatus.NOT_FOUND, "Not Found\r\n", websockets.Headers())
+
+    st = os.fstat(file.fileno())
+    size = st.st_size
+    # Hashing the body would mean reading it all; mtime and size stand in
+    etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+    headers = websockets.Headers([
+        ('Content-Type', MIME_MAP.get(file_path.suffix.lower(), 'application/octet-stream')),
+        ('Cache-Control', cache_control),
+        ('ETag', etag),
+        ('Vary', vary),
+        ('Accept-Ranges', 'bytes'),
+        ('Access-Control-Allow-Origin', '*'),
+    ])
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        file.close()
+        return Response(HTTPStatus.NOT_MODIFIED, "Not Modified", headers)
+
+    span = request_range(request, etag, size)
+    if span is False:
+        file.close()
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, "", headers)
+    if span is None:
+        status, start, end = HTTPStatus.OK, 0, size - 1
+    else:
+        status, (start, end) = HTTPStatus.PARTIAL_CONTENT, span
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Connection'] = 'close'
+    response = Response(status, status.phrase, headers)
+    await static_streamer.start(connection, response.serialize(), file, start, end - start + 1)
+    return response
+
+
+def request_credentials(request, data):
+    """
+    (email, password) from the JSON body or, since the websockets HTTP
+    parser rejects request bodies, from an 'Authorization: Basic' header.
+    """
+    email = data.get('email', '')
+    password = data.get('password', '')
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'basic' and token:
+        try:
+            email, _, password = base64.b64decode(token).decode().partition(':')
+        except (ValueError, UnicodeDecodeError):
+            pass
+    return email.strip(), password
+
+
+def request_token(request):
+    """Session token from an 'Authorization: Bearer' header, or ''."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else ''
+
+
+def admin_allowed(connection, request):
+    """
+    True if the request may read an admin route: it carries ADMIN_TOKEN
+    or, when none is configured, comes straight from a loopback address
+    (a proxy in front of the server sets X-Forwarded-For).
+    """
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request_token(request).encode(), ADMIN_TOKEN.encode())
+    if 'X-Forwarded-For' in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(connection.remote_address[0])
+    except (TypeError, IndexError, ValueError):
+        return False
+    return (getattr(address, 'ipv4_mapped', None) or address).is_loopback
+
+
+async def start_session(user, game):
+    """The user dict plus a fresh session token; other workers cache the session too."""
+    token, sid, expires = await game.sessions.issue(user)
+    game.publish({'op': 'session', 'sid': sid, 'user': game.sessions.session_user(user)})
+    return {**user, 'token': token, 'expires': expires}
+
+
+async def handle_api(request, url_path, game):
     """Handle JSON API endpoints."""
     json_headers = websockets.Headers([
         ('Content-Type', 'application/json'),
         ('Access-Control-Allow-Origin', '*'),
-        ('Access-Control-Allow-Headers', 'Content-Type'),
+        ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
     ])
 
     # Parse body for POST requests
@@ -302,56 +4480,79 @@ def handle_api(request, url_path):
         data = json.loads(body_str) if body_str else {}
     except Exception:
         data = {}
+    query = parse_qs(request.path.partition('?')[2])
+    if url_path in ('/api/register', '/api/login', '/api/logout'):
+        # These responses carry (or end) sessions: never cache them
+        json_headers['Cache-Control'] = 'no-store'
 
     if url_path == '/api/register':
-        email = data.get('email', '').strip()
-        password = data.get('password', '')
-        name = data.get('name', '')
+        # Creating an account must not be a GET, which links, prefetchers
+        # and crawlers may issue; credentials stay in the Basic header
+        if request.method not in ('POST', 'PUT'):
+            json_headers['Allow'] = 'POST, PUT'
+            resp_body = json.dumps({'error': 'method not allowed'}).encode()
+            return Response(HTTPStatus.METHOD_NOT_ALLOWED, "", json_headers, resp_body)
+        email, password = request_credentials(request, data)
+        name = data.get('name') or query.get('name', [''])[0]
         if not email or not password:
             resp_body = json.dumps({'error': 'กรุณากรอกอีเมลและรหัสผ่าน'}).encode()
             return Response(HTTPStatus.BAD_REQUEST, "", json_headers, resp_body)
-        result = register_user(email, password, name)
+        result = await game.db.register(email, password, name)
         if result:
+            result = await start_session(result, game)
             resp_body = json.dumps(result).encode()
-            print(f"  [📝] Registered: {email}")
+            log('register', '[📝] Registered: {email}', email=email)
             return Response(HTTPStatus.OK, "", json_headers, resp_body)
         else:
             resp_body = json.dumps({'error': 'อีเมลนี้ถูกใช้แล้ว'}).encode()
             return Response(HTTPStatus.CONFLICT, "", json_headers, resp_body)
 
     elif url_path == '/api/login':
-        email = data.get('email', '').strip()
-        password = data.get('password', '')
+        email, password = request_credentials(request, data)
         if not email or not password:
             resp_body = json.dumps({'error': 'กรุณากรอกอีเมลและรหัสผ่าน'}).encode()
             return Response(HTTPStatus.BAD_REQUEST, "", json_headers, resp_body)
-        result = login_user(email, password)
+        result = await game.db.login(email, password)
         if result:
+            result = await start_session(result, game)
             resp_body = json.dumps(result).encode()
-            print(f"  [🔑] Login: {email}")
+            log('login', '[🔑] Login: {email}', email=email)
             return Response(HTTPStatus.OK, "", json_headers, resp_body)
         else:
             resp_body = json.dumps({'error': 'อีเมลหรือรหัสผ่านไม่ถูกต้อง'}).encode()
             return Response(HTTPStatus.UNAUTHORIZED, "", json_headers, resp_body)
 
+    elif url_path == '/api/logout':
+        sid = await game.sessions.revoke(request_token(request))
+        if sid is None:
+            resp_body = json.dumps({'error': 'invalid session'}).encode()
+            return Response(HTTPStatus.UNAUTHORIZED, "", json_headers, resp_body)
+        game.publish({'op': 'revoke', 'sid': sid})
+        return Response(HTTPStatus.OK, "", json_headers, b'{"success":true}')
+
+    elif url_path == '/api/metrics':
+        headers = websockets.Headers([('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+        return Response(HTTPStatus.OK, "", headers, metrics.render().encode())
+
     elif url_path == '/api/world':
-        world_file = ROOT_DIR / 'world.json'
-        if request.method == 'POST':
-            # Save world state
-            try:
-                with open(world_file, 'w') as f:
-                    json.dump(data, f)
-                return Response(HTTPStatus.OK, "", json_headers, b'{"success":true}')
-            except Exception as e:
-                resp_body = json.dumps({'error': str(e)}).encode()
-                return Response(HTTPStatus.INTERNAL_SERVER_ERROR, "", json_headers, resp_body)
-        else:
-            # Load world state
-            if world_file.exists():
-                body = world_file.read_bytes()
-                return Response(HTTPStatus.OK, "", json_headers, body)
-            else:
-                return Response(HTTPStatus.OK, "", json_headers, b'{"objects":[]}')
+        # Edits are persisted as they happen, so this only reports the
+        # current table (encoded off the event loop)
+        world = game.world
+        objects_json = await asyncio.to_thread(encode_world_objects, list(world.objects.items()))
+        resp_body = f'{{"seq": {world.seq}, "objects": {objects_json}}}'.encode()
+        return Response(HTTPStatus.OK, "", json_headers, resp_body)
+
+    elif url_path == '/api/stats':
+        resp_body = json.dumps({
+            **game.stats(), 'static': static_cache.stats(), 'streams': static_streamer.stats(),
+            'models': model_converter.stats(), 'db': game.db.stats(),
+            'sessions': game.sessions.stats(), 'compression': compression_stats()
+        }).encode()
+        return Response(HTTPStatus.OK, "", json_headers, resp_body)
+
+    elif url_path == '/api/connections':
+        resp_body = json.dumps(game.connection_stats()).encode()
+        return Response(HTTPStatus.OK, "", json_headers, resp_body)
 
     else:
         resp_body = json.dumps({'error': 'Not found'}).encode()
@@ -359,31 +4560,97 @@ def handle_api(request, url_path):
 
 
 # ─── Main ────────────────────────────────────────────────────
-async def main():
-    game = GameServer()
-    asyncio.create_task(game.state_loop())
+async def main(worker=0):
+    game = GameServer(worker)
+    metrics.const_labels['worker'] = str(worker)
+    log('sessions_warm', '[🔑] Worker {worker}: {sessions} sessions cached',
+        worker=worker, sessions=await game.sessions.warm())
+    if worker == 0:
+        game.world.log = WorldLog()
+        game.world.restore(*await asyncio.to_thread(game.world.log.load))
+        log('world_load', '[🌍] World loaded — {objects} objects at op {seq}',
+            objects=len(game.world), seq=game.world.seq)
+    game.start_task(game.scheduler.run())
+    if WORKERS > 1:
+        game.bus = WorkerBus(worker, game.on_bus_frame)
+        game.start_task(game.bus.run())
+    if MODEL_PRECONVERT and worker == 0:
+        game.start_task(model_converter.preconvert(), essential=False)
 
     async with websockets.serve(
         game.handler,
         "0.0.0.0",
         PORT,
-        process_request=serve_file,
-        max_size=2**20,
+        process_request=partial(serve_file, game=game),
+        max_size=INBOUND_MAX_BYTES,
         ping_interval=30,
         ping_timeout=10,
+        reuse_port=WORKERS > 1,
+        **compression_options(),
     ):
-        print()
-        print("=" * 56)
-        print("  🌐 13Store Metaverse — Online Server")
-        print("=" * 56)
-        print(f"  📡 http://localhost:{PORT}")
-        print(f"  🔌 WebSocket on same port")
-        print()
-        print("  Deploy to Render.com or use ngrok for public access")
-        print("=" * 56)
-        print()
-        await asyncio.Future()
+        if worker == 0:
+            print()
+            print("=" * 56)
+            print("  🌐 13Store Metaverse — Online Server")
+            print("=" * 56)
+            print(f"  📡 http://localhost:{PORT}")
+            print(f"  🔌 WebSocket on same port")
+            if WORKERS > 1:
+                print(f"  ⚙  {WORKERS} workers, bus at {BUS_PATH}")
+            print()
+            print("  Deploy to Render.com or use ngrok for public access")
+            print("=" * 56)
+            print()
+        await game.failed.wait()
+    # Exit non-zero: supervise() (or the process manager) starts a fresh worker
+    sys.exit(1)
+
+
+def run_worker(worker):
+    try:
+        asyncio.run(main(worker))
+    except KeyboardInterrupt:
+        pass
+
+
+async def supervise():
+    """
+    Run the bus hub and WORKERS server processes. If any worker dies the
+    others are stopped too, so the process manager restarts a clean set.
+    """
+    hub = BusHub()
+    server = await hub.start()
+    ctx = multiprocessing.get_context('spawn')
+    # Not daemonic: workers run their own process pool for model conversion,
+    # and the finally below stops them either way
+    procs = [ctx.Process(target=run_worker, args=(w,)) for w in range(WORKERS)]
+    for proc in procs:
+        proc.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set() and all(proc.is_alive() for proc in procs):
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        dead = [w for w, proc in enumerate(procs) if not proc.is_alive()]
+        if dead:
+            log('worker_exit', '[!] Worker(s) {workers} exited — shutting down', workers=dead)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        # Let the hub see each worker hang up before the loop goes away
+        for _ in range(40):
+            if not any(proc.is_alive() for proc in procs) and not hub.peers:
+                break
+            await asyncio.sleep(0.05)
+        server.close()
+        if os.path.exists(hub.path):
+            os.unlink(hub.path)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    asyncio.run(supervise() if WORKERS > 1 else main())
@@ -1,3 +1,4 @@
+import * as THREE from 'three';
 import { Avatar } from './Avatar.js';
 import { npcMemory } from './NPCMemorySystem.js';
 
@@ -76,13 +77,19 @@ export class AIAgent extends Avatar {
         this.isMoving = points.length > 0;
     }
 
-    updateAgent(dt, playerPosition) {
+    /** Per-frame animation only; enough for an NPC the server moves. */
+    animate(dt) {
         this.update(dt);
 
         // Animate Mood Icon
         if (this.moodIcon) {
             this.moodIcon.position.y = 2.5 + Math.sin(Date.now() * 0.003) * 0.1;
         }
+    }
+
+    /** Offline: walk the waypoints and react to the local player here. */
+    updateAgent(dt, playerPosition) {
+        this.animate(dt);
 
         const dist = this.group.position.distanceTo(playerPosition);
 
@@ -1,11 +1,44 @@
 import * as THREE from 'three';
 import { OBJLoader } from 'three/addons/loaders/OBJLoader.js';
 import { MTLLoader } from 'three/addons/loaders/MTLLoader.js';
+import { GLTFLoader } from 'three/addons/loaders/GLTFLoader.js';
 
 export class ModelLoader {
     constructor() {
         this.objLoader = new OBJLoader();
         this.mtlLoader = new MTLLoader();
+        this.gltfLoader = new GLTFLoader();
+    }
+
+    /**
+     * Load a model served by the online server. For an .obj URL the server
+     * answers with a converted, quantized GLB when we say we accept one,
+     * falling back to the OBJ text otherwise.
+     * @param {string} url - URL of the .obj (or .glb) file
+     * @param {Function} onProgress - Progress callback (0-100)
+     * @returns {Promise<THREE.Group>}
+     */
+    async loadFromUrl(url, onProgress = () => { }) {
+        onProgress(5);
+        const response = await fetch(url, {
+            headers: { 'Accept': 'model/gltf-binary, text/plain;q=0.5' }
+        });
+        if (!response.ok) {
+            throw new Error(`Failed to load ${url}: ${response.status}`);
+        }
+        onProgress(30);
+
+        if ((response.headers.get('Content-Type') || '').startsWith('model/gltf-binary')) {
+            const data = await response.arrayBuffer();
+            onProgress(60);
+            const gltf = await this.gltfLoader.parseAsync(data, '');
+            onProgress(100);
+            return gltf.scene;
+        }
+
+        // Plain OBJ: parse it like a local file
+        const blob = await response.blob();
+        return this.loadFromFile(blob, null, (p) => onProgress(30 + p * 0.7));
     }
 
     /**
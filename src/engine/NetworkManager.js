@@ -1,33 +1,86 @@
 /**
  * NetworkManager — WebSocket multiplayer client
  */
+
+// Binary wire format for 'move'/'state' (must match online_server.py)
+const WIRE_PROTOCOL = 'bin1';
+const POS_SCALE = 64;
+const RY_SCALE = 32768 / Math.PI;
+const ANIM_STATES = ['idle', 'walk', 'run', 'jump', 'wave', 'dance', 'sit'];
+const MSG_STATE = 1;
+const MSG_MOVE = 2;
+const STATE_HEADER_SIZE = 25;  // u8 kind, u32 seq, base, tick, f64 server ms, u16 players, gone
+const PLAYER_RECORD_SIZE = 13; // u32 id, i16 x, y, z, ry, u8 anim
+const MOVE_RECORD_SIZE = 18;   // u8 kind, i16 x, y, z, ry, u8 anim, u32 ack, u32 move seq
+const TRACK_MS = 1000;         // remote position history kept for interpolation
+const PRESENCE_INPUT_EVENTS = ['keydown', 'pointerdown', 'pointermove', 'wheel', 'touchstart'];
+
+const clampI16 = (v) => Math.max(-32768, Math.min(32767, Math.round(v)));
+
 export class NetworkManager {
-    constructor() {
+    constructor({ binary = true } = {}) {
         this.ws = null;
         this.playerId = null;
         this.isConnected = false;
+        this.useBinary = binary;    // offer WIRE_PROTOCOL on join
+        this.protocol = 'json';     // what the server agreed to
+        this.room = null;           // room instance the server placed us in
+        this.serverTick = 0;        // tick / server time (ms) of the newest state frame
+        this.serverTime = 0;
+        this.tickRate = 20;
+        this.interpDelay = 100;     // ms remote players are rendered behind the newest snapshot
+        this.serverNpcs = false;    // the server simulates the NPCs and streams them like players
+        this.idleAfter = 0;         // s without input before the server slows our updates (0 = never)
+        // Event topics we listen to; the server only sends chat, voice,
+        // whiteboard and world edits to subscribers
+        this.topics = new Set(['chat', 'world']);
 
         // Callbacks
         this.onConnect = null;
         this.onDisconnect = null;
         this.onPlayerJoin = null;
         this.onPlayerLeave = null;
+        this.onPlayerEnter = null;  // came into our area of interest
+        this.onPlayerExit = null;   // moved out of our area of interest
         this.onPlayerUpdate = null;
         this.onChatMessage = null;
         this.onPlayerList = null;
         this.onWhiteboard = null;
         this.onWorldEdit = null;
+        this.onWorldState = null;   // full editor world: snapshot + ops after it
         this.onVoiceTalking = null;
         this.onVoiceReady = null;
         this.onAppearanceUpdate = null;
+        this.onNpcGreet = null;     // a server-run NPC just greeted us (its id)
 
         this._sendInterval = null;
+
+        // Delta snapshots: seq -> Map(id -> per-tick fields). Seq 0 is the
+        // empty baseline, so a frame based on it is a full snapshot.
+        this._snapshots = new Map([[0, new Map()]]);
+        this._ackSeq = 0;
+        this._resyncPending = false;
+        // id -> static fields (name, color, appearance), sent once per player
+        this._profiles = new Map();
+
+        // Interpolation: id -> [{t, x, y, z, ry}] by server time, and the
+        // estimated server clock minus performance.now()
+        this._tracks = new Map();
+        this._clockOffset = null;
+        this._moveSeq = 0;
+
+        // Presence: user input and tab visibility, reported so the server
+        // can put an idle or hidden client in its low-footprint mode
+        this._lastInputReport = 0;
+        this._onVisibility = () => this._reportPresence(true);
+        this._onInput = () => this._reportPresence(false);
     }
 
     connect(serverUrl, playerInfo) {
         return new Promise((resolve, reject) => {
             try {
                 this.ws = new WebSocket(serverUrl);
+                this.ws.binaryType = 'arraybuffer';
 
                 this.ws.onopen = () => {
                     console.log('[Network] Connected to server');
@@ -39,17 +92,29 @@ export class NetworkManager {
                         color: playerInfo.color,
                         hairStyle: playerInfo.hairStyle || 'short',
                         hairColor: playerInfo.hairColor || 0x3e2723,
-                        shirtType: playerInfo.shirtType || 'tshirt'
+                        shirtType: playerInfo.shirtType || 'tshirt',
+                        ...(playerInfo.room ? { room: playerInfo.room } : {}),
+                        ...(playerInfo.token ? { token: playerInfo.token } : {}),
+                        topics: [...this.topics],
+                        ...(this.useBinary ? { proto: WIRE_PROTOCOL } : {})
                     });
                 };
 
                 this.ws.onmessage = (event) => {
                     try {
+                        if (event.data instanceof ArrayBuffer) {
+                            this._handleMessage(this._decodeState(event.data));
+                            return;
+                        }
+                        // One frame per server tick carries that tick's events as a 'batch'
                         const data = JSON.parse(event.data);
-                        this._handleMessage(data);
-                        if (data.type === 'welcome') {
-                            this.playerId = data.id;
-                            resolve(data.id);
+                        const messages = data.type === 'batch' ? data.messages : [data];
+                        for (const message of messages) {
+                            this._handleMessage(message);
+                            if (message.type === 'welcome') {
+                                this.playerId = message.id;
+                                resolve(message.id);
+                            }
                         }
                     } catch (e) {
                         console.warn('[Network] Bad message:', e);
@@ -60,6 +125,7 @@ export class NetworkManager {
                     console.log('[Network] Disconnected');
                     this.isConnected = false;
                     this._stopSendLoop();
+                    this._unwatchPresence();
                     if (this.onDisconnect) this.onDisconnect();
                 };
 
@@ -84,29 +150,58 @@ export class NetworkManager {
     _handleMessage(data) {
         switch (data.type) {
             case 'welcome':
+                this.protocol = data.proto || 'json';
+                this.room = data.room || null;
+                this.tickRate = data.tickRate || this.tickRate;
+                this.interpDelay = data.interpDelay ?? this.interpDelay;
+                this.serverNpcs = data.npcs !== undefined;
+                this.idleAfter = data.idleAfter || 0;
+                this._watchPresence();
+                this._rememberProfile(data.you);
                 if (this.onConnect) this.onConnect(data);
                 break;
             case 'player_join':
+                this._rememberProfile(data);
                 if (this.onPlayerJoin) this.onPlayerJoin(data);
                 break;
             case 'player_leave':
+                this._profiles.delete(data.id);
+                this._tracks.delete(data.id);
                 if (this.onPlayerLeave) this.onPlayerLeave(data.id);
                 break;
+            case 'interest':
+                data.enter.forEach(p => this._rememberProfile(p));
+                data.exit.forEach(id => this._tracks.delete(id));
+                if (this.onPlayerExit) data.exit.forEach(id => this.onPlayerExit(id));
+                if (this.onPlayerEnter) data.enter.forEach(p => this.onPlayerEnter(p));
+                break;
             case 'state':
-                if (this.onPlayerUpdate) this.onPlayerUpdate(data.players);
+                if (data.seq === undefined) {
+                    // Full-state server (multiplayer_server.py)
+                    if (this.onPlayerUpdate) this.onPlayerUpdate(data.players);
+                } else {
+                    this._applyDelta(data);
+                }
                 break;
             case 'chat':
                 if (this.onChatMessage) this.onChatMessage(data);
                 break;
             case 'player_list':
+                data.players.forEach(p => this._rememberProfile(p));
                 if (this.onPlayerList) this.onPlayerList(data.players);
                 break;
             case 'whiteboard':
                 if (this.onWhiteboard) this.onWhiteboard(data.data);
                 break;
+            case 'world':
+                if (this.onWorldState) this.onWorldState(data);
+                break;
             case 'world_edit':
                 if (this.onWorldEdit) this.onWorldEdit(data);
                 break;
+            case 'dict':
+                // Compression primer: only there to seed the deflate window
+                break;
             case 'voice_talking':
                 if (this.onVoiceTalking) this.onVoiceTalking(data);
                 break;
@@ -114,24 +209,206 @@ export class NetworkManager {
                 if (this.onVoiceReady) this.onVoiceReady(data);
                 break;
             case 'appearance_update':
+                this._rememberProfile({ id: data.id, ...data.data });
                 if (this.onAppearanceUpdate) this.onAppearanceUpdate(data.id, data.data);
                 break;
+            case 'npc_greet':
+                if (this.onNpcGreet) this.onNpcGreet(data.id);
+                break;
+        }
+    }
+
+    _rememberProfile(p) {
+        if (!p) return;
+        const { x, y, z, ry, anim, type, ...profile } = p;
+        this._profiles.set(p.id, { ...this._profiles.get(p.id), ...profile });
+    }
+
+    /**
+     * Rebuild snapshot `seq` from its acked baseline plus the delta, and
+     * report only the players that changed (merged with their profile).
+     */
+    _applyDelta(data) {
+        const base = this._snapshots.get(data.base);
+        if (!base) {
+            // Baseline already discarded: ask the server for a full snapshot
+            if (!this._resyncPending) this._send({ type: 'resync' });
+            this._resyncPending = true;
+            return;
+        }
+        this._resyncPending = false;
+
+        // Players whose profile hasn't arrived yet (a later player_list
+        // page) are tracked but not reported until it does
+        const snap = new Map(base);
+        (data.gone || []).forEach(id => {
+            snap.delete(id);
+            this._tracks.delete(id);
+        });
+        this._syncClock(data.t);
+        const changed = [];
+        data.players.forEach(delta => {
+            const fields = { ...snap.get(delta.id), ...delta };
+            snap.set(delta.id, fields);
+            this._addSample(delta.id, data.t, fields);
+            const profile = this._profiles.get(delta.id);
+            if (profile) changed.push({ ...profile, ...fields });
+        });
+        this._snapshots.set(data.seq, snap);
+        this._ackSeq = data.seq;
+        this.serverTick = data.tick;
+        this.serverTime = data.t;
+
+        // The server never sends deltas against anything older than this base again
+        for (const seq of this._snapshots.keys()) {
+            if (seq !== 0 && seq < data.base) this._snapshots.delete(seq);
+        }
+
+        if (this.onPlayerUpdate && changed.length) this.onPlayerUpdate(changed);
+    }
+
+    /** Track server time from snapshot timestamps, smoothing out arrival jitter. */
+    _syncClock(serverTime) {
+        const offset = serverTime - performance.now();
+        if (this._clockOffset === null || Math.abs(offset - this._clockOffset) > 1000) {
+            this._clockOffset = offset;
+        } else {
+            this._clockOffset += (offset - this._clockOffset) * 0.05;
         }
     }
 
+    _addSample(id, t, fields) {
+        let track = this._tracks.get(id);
+        if (!track) this._tracks.set(id, track = []);
+        const last = track[track.length - 1];
+        if (last && t <= last.t) return;
+        // Unchanged players aren't sent: after a pause, hold the old position
+        // until one tick before the new sample instead of gliding across the gap
+        const period = 1000 / this.tickRate;
+        if (last && t - last.t > period * 1.5) track.push({ ...last, t: t - period });
+        track.push({ t, x: fields.x, y: fields.y, z: fields.z, ry: fields.ry });
+        while (track.length > 2 && track[1].t < t - TRACK_MS) track.shift();
+    }
+
+    /**
+     * Interpolated {x, y, z, ry} of a remote player at interpDelay ms
+     * behind the estimated server time, or null if it isn't tracked.
+     */
+    sampleRemote(id) {
+        const track = this._tracks.get(id);
+        if (!track || !track.length || this._clockOffset === null) return null;
+        const t = performance.now() + this._clockOffset - this.interpDelay;
+        let b = track.findIndex(s => s.t >= t);
+        if (b === -1) return track[track.length - 1];
+        if (b === 0) return track[0];
+        const p = track[b - 1], q = track[b];
+        const k = (t - p.t) / (q.t - p.t);
+        let dry = q.ry - p.ry;
+        if (dry > Math.PI) dry -= Math.PI * 2;
+        if (dry < -Math.PI) dry += Math.PI * 2;
+        return {
+            x: p.x + (q.x - p.x) * k,
+            y: p.y + (q.y - p.y) * k,
+            z: p.z + (q.z - p.z) * k,
+            ry: p.ry + dry * k
+        };
+    }
+
+    /** Unpack a binary 'state' frame into the JSON delta shape. */
+    _decodeState(buffer) {
+        const view = new DataView(buffer);
+        if (view.getUint8(0) !== MSG_STATE) throw new Error('unknown binary message');
+        const seq = view.getUint32(1, true);
+        const base = view.getUint32(5, true);
+        const tick = view.getUint32(9, true);
+        const t = view.getFloat64(13, true);
+        const count = view.getUint16(21, true);
+        const goneCount = view.getUint16(23, true);
+        const players = new Array(count);
+        let o = STATE_HEADER_SIZE;
+        for (let i = 0; i < count; i++, o += PLAYER_RECORD_SIZE) {
+            players[i] = {
+                id: String(view.getUint32(o, true)),
+                x: view.getInt16(o + 4, true) / POS_SCALE,
+                y: view.getInt16(o + 6, true) / POS_SCALE,
+                z: view.getInt16(o + 8, true) / POS_SCALE,
+                ry: view.getInt16(o + 10, true) / RY_SCALE,
+                anim: ANIM_STATES[view.getUint8(o + 12)] || 'idle'
+            };
+        }
+        const gone = new Array(goneCount);
+        for (let i = 0; i < goneCount; i++, o += 4) {
+            gone[i] = String(view.getUint32(o, true));
+        }
+        return { type: 'state', seq, base, tick, t, players, gone };
+    }
+
+    _encodeMove(state) {
+        const view = new DataView(new ArrayBuffer(MOVE_RECORD_SIZE));
+        const ry = ((state.ry + Math.PI) % (Math.PI * 2) + Math.PI * 2) % (Math.PI * 2) - Math.PI;
+        view.setUint8(0, MSG_MOVE);
+        view.setInt16(1, clampI16(state.x * POS_SCALE), true);
+        view.setInt16(3, clampI16(state.y * POS_SCALE), true);
+        view.setInt16(5, clampI16(state.z * POS_SCALE), true);
+        view.setInt16(7, clampI16(ry * RY_SCALE), true);
+        view.setUint8(9, Math.max(0, ANIM_STATES.indexOf(state.anim)));
+        view.setUint32(10, this._ackSeq, true);
+        view.setUint32(14, this._moveSeq, true);
+        return view.buffer;
+    }
+
     startSendLoop(getStateFn, fps = 20) {
         this._stopSendLoop();
         this._sendInterval = setInterval(() => {
             if (this.isConnected) {
                 const state = getStateFn();
-                this._send({
-                    type: 'move',
-                    ...state
-                });
+                this._moveSeq = (this._moveSeq + 1) >>> 0;
+                if (this.protocol === WIRE_PROTOCOL) {
+                    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+                        this.ws.send(this._encodeMove(state));
+                    }
+                } else {
+                    this._send({
+                        type: 'move',
+                        ...state,
+                        ack: this._ackSeq,
+                        seq: this._moveSeq
+                    });
+                }
             }
         }, 1000 / fps);
     }
 
+    _watchPresence() {
+        document.addEventListener('visibilitychange', this._onVisibility);
+        for (const type of PRESENCE_INPUT_EVENTS) {
+            window.addEventListener(type, this._onInput, { passive: true });
+        }
+        if (document.hidden) this._reportPresence(true);
+    }
+
+    _unwatchPresence() {
+        document.removeEventListener('visibilitychange', this._onVisibility);
+        for (const type of PRESENCE_INPUT_EVENTS) {
+            window.removeEventListener(type, this._onInput);
+        }
+    }
+
+    /**
+     * Tell the server the tab was hidden or shown (always) or that the
+     * user did something (at most a few times per idle period).
+     */
+    _reportPresence(visibilityChanged) {
+        if (!this.isConnected) return;
+        const now = performance.now();
+        if (!visibilityChanged) {
+            if (!this.idleAfter || document.hidden) return;
+            if (now - this._lastInputReport < this.idleAfter * 1000 / 4) return;
+        }
+        this._lastInputReport = document.hidden ? 0 : now;
+        this._send({ type: 'presence', hidden: document.hidden });
+    }
+
     _stopSendLoop() {
         if (this._sendInterval) {
             clearInterval(this._sendInterval);
@@ -145,6 +422,17 @@ export class NetworkManager {
         }
     }
 
+    subscribe(topic) {
+        if (this.topics.has(topic)) return;
+        this.topics.add(topic);
+        this._send({ type: 'subscribe', topics: [topic] });
+    }
+
+    unsubscribe(topic) {
+        if (!this.topics.delete(topic)) return;
+        this._send({ type: 'unsubscribe', topics: [topic] });
+    }
+
     send(data) {
         this._send(data);
     }
@@ -157,6 +445,7 @@ export class NetworkManager {
 
     disconnect() {
         this._stopSendLoop();
+        this._unwatchPresence();
         if (this.ws) {
             this.ws.close();
             this.ws = null;
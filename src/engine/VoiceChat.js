@@ -124,7 +124,8 @@ export class VoiceChat {
 
             document.getElementById('voice-toggle').classList.add('on');
 
-            // Announce to other players
+            // Listen to the voice topic and announce ourselves on it
+            this.network?.subscribe('voice');
             this.network?.send({ type: 'voice_ready' });
         } catch (err) {
             console.warn('[VoiceChat] Microphone access denied:', err);
@@ -133,6 +134,7 @@ export class VoiceChat {
 
     _disableVoice() {
         this.enabled = false;
+        this.network?.unsubscribe('voice');
         if (this.localStream) {
             this.localStream.getTracks().forEach(t => t.stop());
             this.localStream = null;
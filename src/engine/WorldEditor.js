@@ -25,6 +25,7 @@ export class WorldEditor {
         this.network = network;
         this.active = false;
         this.placedObjects = [];
+        this._nextRef = 1;      // tags our own spawns until the server assigns an oid
         this.selectedObject = null;
         this.gizmoMode = 'translate'; // translate, rotate, scale
         this._raycaster = new THREE.Raycaster();
@@ -167,6 +168,10 @@ export class WorldEditor {
             this._onDragMove(e);
         });
         this.renderer.domElement.addEventListener('mouseup', () => {
+            if (this._isDragging && this.selectedObject) {
+                const { pos, rot, scl } = this._serializeObject(this.selectedObject);
+                this._broadcastObjectAction('move', { oid: this.selectedObject.userData.worldId, pos, rot, scl });
+            }
             this._isDragging = false;
         });
 
@@ -214,7 +219,7 @@ export class WorldEditor {
         this._selectObject(mesh);
 
         // Broadcast spawn
-        this._broadcastObjectAction('spawn', this._serializeObject(mesh));
+        this._broadcastSpawn(mesh);
 
         this._updateInfo(`✅ วาง ${item.name} แล้ว`);
     }
@@ -301,7 +306,7 @@ export class WorldEditor {
         if (obj.geometry) obj.geometry.dispose();
         if (obj.material) obj.material.dispose();
         this.placedObjects.splice(id, 1);
-        this._broadcastObjectAction('delete', { index: id });
+        this._broadcastObjectAction('delete', { oid: obj.userData.worldId, index: id });
         this._updateInfo('🗑 ลบวัตถุแล้ว');
     }
 
@@ -310,11 +315,12 @@ export class WorldEditor {
         const src = this.selectedObject;
         const clone = src.clone();
         clone.position.x += 2;
-        clone.userData = { ...src.userData };
+        const { worldId, worldRef, ...userData } = src.userData;
+        clone.userData = userData;
         this.scene.add(clone);
         this.placedObjects.push(clone);
         this._selectObject(clone);
-        this._broadcastObjectAction('spawn', this._serializeObject(clone));
+        this._broadcastSpawn(clone);
         this._updateInfo('📋 คัดลอกวัตถุแล้ว');
     }
 
@@ -331,16 +337,18 @@ export class WorldEditor {
         this.network?.send({ type: 'world_edit', action, data });
     }
 
+    _broadcastSpawn(mesh) {
+        mesh.userData.worldRef = this._nextRef++;
+        this._broadcastObjectAction('spawn', { ...this._serializeObject(mesh), ref: mesh.userData.worldRef });
+    }
+
     async _saveWorld() {
-        const worldData = this.placedObjects.map(o => this._serializeObject(o));
+        // The server persists every edit as it happens; this confirms what it holds
         try {
-            const resp = await fetch('/api/world', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ objects: worldData }),
-            });
+            const resp = await fetch('/api/world');
             if (resp.ok) {
-                this._updateInfo('💾 บันทึกโลกสำเร็จ!');
+                const data = await resp.json();
+                this._updateInfo(`💾 บันทึกโลกสำเร็จ! (${data.objects.length})`);
             } else {
                 this._updateInfo('❌ บันทึกล้มเหลว');
             }
@@ -349,54 +357,81 @@ export class WorldEditor {
         }
     }
 
+    _createObject(obj) {
+        const item = OBJECT_PALETTE.find(p => p.id === obj.type);
+        if (!item) return null;
+        const geo = item.geo();
+        const mat = new THREE.MeshStandardMaterial({ color: item.color, metalness: 0.2, roughness: 0.6 });
+        if (item.emissive) { mat.emissive = new THREE.Color(item.color); mat.emissiveIntensity = 0.8; }
+        const mesh = new THREE.Mesh(geo, mat);
+        mesh.castShadow = true;
+        mesh.receiveShadow = true;
+        this._placeObject(mesh, obj);
+        mesh.userData.editorObject = true;
+        mesh.userData.objectType = item.id;
+        mesh.userData.objectName = item.name;
+        if (obj.oid !== undefined) mesh.userData.worldId = obj.oid;
+        this.scene.add(mesh);
+        this.placedObjects.push(mesh);
+        return mesh;
+    }
+
+    _placeObject(mesh, obj) {
+        if (obj.pos) mesh.position.set(obj.pos.x, obj.pos.y, obj.pos.z);
+        if (obj.rot) mesh.rotation.set(obj.rot.x, obj.rot.y, obj.rot.z);
+        if (obj.scl) mesh.scale.set(obj.scl.x, obj.scl.y, obj.scl.z);
+    }
+
+    _removeObject(mesh) {
+        if (mesh === this.selectedObject) this._deselectAll();
+        this.scene.remove(mesh);
+        if (mesh.geometry) mesh.geometry.dispose();
+        if (mesh.material) mesh.material.dispose();
+        this.placedObjects.splice(this.placedObjects.indexOf(mesh), 1);
+    }
+
+    _findObject(oid) {
+        return this.placedObjects.find(o => o.userData.worldId === oid);
+    }
+
+    /** Replace everything with the server's world: snapshot objects, then the ops after it. */
+    loadState({ objects, ops }) {
+        [...this.placedObjects].forEach(o => this._removeObject(o));
+        objects.forEach(obj => this._createObject(obj));
+        ops.forEach(op => this.handleRemoteEdit(op));
+    }
+
     async loadWorld() {
         try {
             // Using a local file instead of an API to prevent 404 on simple development server
             const resp = await fetch('./world_data.json');
             if (!resp.ok) return;
             const data = await resp.json();
-            if (data.objects) {
-                data.objects.forEach(obj => {
-                    const item = OBJECT_PALETTE.find(p => p.id === obj.type);
-                    if (!item) return;
-                    const geo = item.geo();
-                    const mat = new THREE.MeshStandardMaterial({ color: item.color, metalness: 0.2, roughness: 0.6 });
-                    if (item.emissive) { mat.emissive = new THREE.Color(item.color); mat.emissiveIntensity = 0.8; }
-                    const mesh = new THREE.Mesh(geo, mat);
-                    mesh.castShadow = true;
-                    mesh.receiveShadow = true;
-                    mesh.position.set(obj.pos.x, obj.pos.y, obj.pos.z);
-                    mesh.rotation.set(obj.rot.x, obj.rot.y, obj.rot.z);
-                    mesh.scale.set(obj.scl.x, obj.scl.y, obj.scl.z);
-                    mesh.userData.editorObject = true;
-                    mesh.userData.objectType = item.id;
-                    mesh.userData.objectName = item.name;
-                    this.scene.add(mesh);
-                    this.placedObjects.push(mesh);
-                });
+            // The server's 'world' message replaces this once we're connected
+            if (data.objects && !this.placedObjects.length) {
+                data.objects.forEach(obj => this._createObject(obj));
             }
         } catch { /* first time, no saved world */ }
     }
 
-    handleRemoteEdit(action, data) {
-        if (action === 'spawn' && data.type) {
-            const item = OBJECT_PALETTE.find(p => p.id === data.type);
-            if (!item) return;
-            const geo = item.geo();
-            const mat = new THREE.MeshStandardMaterial({ color: item.color, metalness: 0.2, roughness: 0.6 });
-            const mesh = new THREE.Mesh(geo, mat);
-            mesh.castShadow = true;
-            mesh.position.set(data.pos.x, data.pos.y, data.pos.z);
-            mesh.userData.editorObject = true;
-            mesh.userData.objectType = item.id;
-            this.scene.add(mesh);
-            this.placedObjects.push(mesh);
-        } else if (action === 'delete' && data.index !== undefined) {
-            const obj = this.placedObjects[data.index];
-            if (obj) {
-                this.scene.remove(obj);
-                this.placedObjects.splice(data.index, 1);
+    handleRemoteEdit({ id, ref, action, oid, data }) {
+        if (action === 'spawn') {
+            // Our own spawn coming back: just learn the id the server gave it
+            const own = id === this.network?.playerId && ref !== null &&
+                this.placedObjects.find(o => o.userData.worldRef === ref && o.userData.worldId === undefined);
+            if (own) {
+                own.userData.worldId = oid;
+            } else if (!this._findObject(oid)) {
+                this._createObject({ ...data, oid });
             }
+            return;
+        }
+        const obj = this._findObject(oid);
+        if (!obj) return;
+        if (action === 'delete') {
+            this._removeObject(obj);
+        } else if (action === 'move' && !(obj === this.selectedObject && this._isDragging)) {
+            this._placeObject(obj, data);
         }
     }
 
@@ -9,7 +9,7 @@ import { DayNightCycle } from './engine/DayNightCycle.js';
 import { WeatherSystem } from './engine/WeatherSystem.js';
 import { ChatPanel } from './ui/ChatPanel.js';
 import { ProductPopup } from './ui/ProductPopup.js';
-import { LoginScreen } from './ui/LoginScreen.js';
+import { LoginScreen, SESSION_KEY } from './ui/LoginScreen.js';
 import { Whiteboard } from './ui/Whiteboard.js';
 import { EmoteSystem } from './ui/EmoteSystem.js';
 import { MiniMap } from './ui/MiniMap.js';
@@ -18,6 +18,8 @@ import { Lobby } from './ui/Lobby.js';
 import { WorldEditor } from './engine/WorldEditor.js';
 import { ShoppingCart } from './ui/ShoppingCart.js';
 import { NPCGuide } from './engine/NPCGuide.js';
+import { TopicAgent } from './engine/TopicAgent.js';
+import { FPVInstructor } from './engine/FPVInstructor.js';
 import { VoiceChat } from './engine/VoiceChat.js';
 import { ScreenshotSystem } from './ui/ScreenshotSystem.js';
 import { AvatarCustomizer } from './ui/AvatarCustomizer.js';
@@ -25,6 +27,10 @@ import { DroneSimulator } from './engine/DroneSimulator.js';
 import { npcMemory } from './engine/NPCMemorySystem.js';
 import { NPCSettingsPanel } from './ui/NPCSettingsPanel.js';
 
+// Server-run NPC kinds -> the agent that renders them
+const NPC_KINDS = { topic: TopicAgent, fpv: FPVInstructor };
+const NPC_MOODS = { topic: 0x7cfc00, fpv: 0xe2001a };
+
 /**
  * 13Store Metaverse — Main Game
  */
@@ -55,7 +61,8 @@ class Game {
         this.voiceChat = null;
         this.screenshotSystem = null;
         this.customizer = null;
-        this.aiAgents = [];
+        this.aiAgents = [];          // simulated here when playing offline
+        this.npcs = new Map();       // id -> AIAgent placed by the server
         this.droneSim = null;
         this.npcSettings = null;
         this._inMeetingZone = false;
@@ -243,8 +250,8 @@ class Game {
 
         this.state = 'playing';
 
-        // Init AI Agents
-        this._initAIAgents();
+        // Init AI Agents (the online server runs its own and streams them)
+        if (!this.network.serverNpcs) this._initAIAgents();
 
         // Init Drone Simulator
         this.droneSim = new DroneSimulator(this.scene, this.camera, this.controller);
@@ -369,12 +376,32 @@ class Game {
         // Network callbacks
         this.network.onPlayerJoin = (data) => {
             if (data.id === this.network.playerId) return;
-            this._spawnRemotePlayer(data);
+            // visible=false: joined outside our area of interest
+            if (data.visible !== false && !this.remotePlayers.has(data.id)) {
+                this._spawnRemotePlayer(data);
+            }
             this.chat.addSystemMessage(`${data.name} joined the world!`);
             this._updatePlayerList();
         };
 
+        this.network.onPlayerEnter = (data) => {
+            if (data.id === this.network.playerId || this.remotePlayers.has(data.id)) return;
+            this._spawnRemotePlayer(data);
+            this._updatePlayerList();
+        };
+
+        this.network.onPlayerExit = (id) => {
+            if (this._removeNpc(id)) return;
+            const avatar = this.remotePlayers.get(id);
+            if (avatar) {
+                avatar.dispose();
+                this.remotePlayers.delete(id);
+                this._updatePlayerList();
+            }
+        };
+
         this.network.onPlayerLeave = (id) => {
+            if (this._removeNpc(id)) return;
             const avatar = this.remotePlayers.get(id);
             if (avatar) {
                 this.chat.addSystemMessage(`${avatar.name} left the world.`);
@@ -387,16 +414,16 @@ class Game {
         this.network.onPlayerUpdate = (players) => {
             players.forEach(p => {
                 if (p.id === this.network.playerId) return;
-                let avatar = this.remotePlayers.get(p.id);
+                let avatar = this.remotePlayers.get(p.id) || this.npcs.get(p.id);
                 if (!avatar) {
                     // Spawn new remote player
                     this._spawnRemotePlayer(p);
-                    avatar = this.remotePlayers.get(p.id);
+                    avatar = this.remotePlayers.get(p.id) || this.npcs.get(p.id);
                 }
                 if (avatar) {
                     avatar.setTargetPosition(p.x, p.y, p.z);
                     avatar.setTargetRotation(p.ry);
-                    avatar.setAnimState(p.anim || 'idle');
+                    if (!avatar.isTalking) avatar.setAnimState(p.anim || 'idle');
                 }
             });
             this._updatePlayerCount();
@@ -415,9 +442,13 @@ class Game {
             }
         };
 
+        this.network.onWorldState = (data) => {
+            this.worldEditor?.loadState(data);
+        };
+
         this.network.onWorldEdit = (data) => {
             if (this.worldEditor) {
-                this.worldEditor.handleRemoteEdit(data.action, data.data);
+                this.worldEditor.handleRemoteEdit(data);
             }
         };
 
@@ -430,7 +461,7 @@ class Game {
         this.network.onPlayerList = (players) => {
             players.forEach(p => {
                 if (p.id === this.network.playerId) return;
-                if (!this.remotePlayers.has(p.id)) {
+                if (!this.remotePlayers.has(p.id) && !this.npcs.has(p.id)) {
                     this._spawnRemotePlayer(p);
                 }
             });
@@ -447,9 +478,16 @@ class Game {
             this.chat.addSystemMessage('Disconnected from server.');
             this.remotePlayers.forEach(avatar => avatar.dispose());
             this.remotePlayers.clear();
+            this.npcs.forEach(agent => agent.dispose());
+            this.npcs.clear();
             this._updatePlayerList();
         };
 
+        // The server decides when an NPC greets us; what it says depends on our own memory
+        this.network.onNpcGreet = (id) => {
+            this.npcs.get(id)?.sayNext();
+        };
+
         this.network.onAppearanceUpdate = (id, appearanceData) => {
             const avatar = this.remotePlayers.get(id);
             if (avatar) {
@@ -466,14 +504,20 @@ class Game {
         const wsProtocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
         const wsUrl = `${wsProtocol}//${location.host}`;
 
-        // Connect
-        await this.network.connect(wsUrl, { name, color });
+        // Connect (?room=name picks a showroom; the server may place us in an overflow instance)
+        const room = new URLSearchParams(location.search).get('room') || undefined;
+        const token = localStorage.getItem(SESSION_KEY) || undefined;
+        await this.network.connect(wsUrl, { name, color, room, token });
 
         // Start position broadcasting
         this.network.startSendLoop(() => this.controller.getState(), 20);
     }
 
     _spawnRemotePlayer(data) {
+        if (data.npc) {
+            this._spawnNpc(data);
+            return;
+        }
         const avatar = new Avatar({
             name: data.name || `Player ${data.id}`,
             shirtColor: data.color || 0x42a5f5,
@@ -489,6 +533,25 @@ class Game {
         this.remotePlayers.set(data.id, avatar);
     }
 
+    _spawnNpc(data) {
+        if (this.npcs.has(data.id)) return;
+        const Agent = NPC_KINDS[data.npc] || TopicAgent;
+        const agent = new Agent({ name: data.name });
+        agent.setMoodColor(NPC_MOODS[data.npc] ?? 0x7cfc00);
+        agent.setPosition(data.x || 0, data.y || 0, data.z || 0);
+        agent.setTargetPosition(data.x || 0, data.y || 0, data.z || 0);
+        this.scene.add(agent.group);
+        this.npcs.set(data.id, agent);
+    }
+
+    _removeNpc(id) {
+        const agent = this.npcs.get(id);
+        if (!agent) return false;
+        agent.dispose();
+        this.npcs.delete(id);
+        return true;
+    }
+
     _updatePlayerCount() {
         const count = this.remotePlayers.size + 1;
         if (this.playerCountEl) {
@@ -619,10 +682,28 @@ class Game {
             }
         }
 
-        // Update remote avatars
-        this.remotePlayers.forEach(avatar => {
+        // Update remote avatars, placed by snapshot interpolation when the
+        // server timestamps its frames
+        this.remotePlayers.forEach((avatar, id) => {
+            const s = this.network?.sampleRemote(id);
+            if (s) {
+                avatar.setPosition(s.x, s.y, s.z);
+                avatar.setTargetPosition(s.x, s.y, s.z);
+                avatar.setRotation(s.ry);
+                avatar.setTargetRotation(s.ry);
+            }
             avatar.update(dt);
         });
+        this.npcs.forEach((agent, id) => {
+            const s = this.network?.sampleRemote(id);
+            if (s) {
+                agent.setPosition(s.x, s.y, s.z);
+                agent.setTargetPosition(s.x, s.y, s.z);
+                agent.setRotation(s.ry);
+                agent.setTargetRotation(s.ry);
+            }
+            agent.animate(dt);
+        });
 
         // Update day/night cycle
         if (this.dayNight) {
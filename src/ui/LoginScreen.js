@@ -2,6 +2,8 @@
  * LoginScreen — Email/password login + registration
  * Replaces lobby name input for authenticated users
  */
+export const SESSION_KEY = '13metaverse-session';
+
 export class LoginScreen {
     constructor() {
         this._createDOM();
@@ -158,6 +160,7 @@ export class LoginScreen {
 
         // Skip (guest)
         this.el.querySelector('#login-skip').addEventListener('click', () => {
+            localStorage.removeItem(SESSION_KEY);
             this.hide();
             // Show lobby as guest
         });
@@ -173,15 +176,16 @@ export class LoginScreen {
             return;
         }
 
-        const endpoint = this.mode === 'register' ? '/api/register' : '/api/login';
-        const body = { email, password };
-        if (this.mode === 'register' && displayName) body.name = displayName;
+        let endpoint = this.mode === 'register' ? '/api/register' : '/api/login';
+        if (this.mode === 'register' && displayName) endpoint += `?name=${encodeURIComponent(displayName)}`;
+        // The server's HTTP parser takes no request bodies: credentials go in Basic auth
+        const credentials = new TextEncoder().encode(`${email}:${password}`);
 
         try {
             const res = await fetch(endpoint, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(body),
+                // Registering creates an account, so it is a POST (with no body)
+                method: this.mode === 'register' ? 'POST' : 'GET',
+                headers: { Authorization: `Basic ${btoa(String.fromCharCode(...credentials))}` },
             });
             const data = await res.json();
 
@@ -190,8 +194,9 @@ export class LoginScreen {
                 return;
             }
 
-            // Success — store user data and go to lobby
+            // Success — store user data (the token lets join skip the login) and go to lobby
             this.userData = data;
+            if (data.token) localStorage.setItem(SESSION_KEY, data.token);
             this.hide();
             if (this.onLogin) this.onLogin(data);
         } catch (err) {
@@ -2,6 +2,9 @@
  * Whiteboard — Collaborative drawing canvas
  * Synced across all players via WebSocket
  */
+const SEND_INTERVAL = 50;
+const BACKGROUND = '#222222';
+
 export class Whiteboard {
     constructor(networkManager) {
         this.network = networkManager;
@@ -11,6 +14,10 @@ export class Whiteboard {
         this.brushSize = 3;
         this.tool = 'pen'; // pen, eraser
         this.lastPoint = null;
+        // Points drawn since the last send; flushed as one 'stroke' every
+        // SEND_INTERVAL ms, starting from the previous piece's last point
+        this._outgoing = null;
+        this._sendTimer = null;
         this._createDOM();
     }
 
@@ -144,6 +151,7 @@ export class Whiteboard {
         // Clear
         document.getElementById('wb-clear').addEventListener('click', () => {
             ctx.clearRect(0, 0, canvas.width, canvas.height);
+            this._outgoing = null;
             this._sendDraw({ type: 'clear' });
         });
 
@@ -164,29 +172,86 @@ export class Whiteboard {
 
     _startDraw(e) {
         this.isDrawing = true;
-        this.lastPoint = this._getCanvasPos(e);
+        this.lastPoint = this._roundPos(this._getCanvasPos(e));
+    }
+
+    _roundPos(pos) {
+        return { x: Math.round(pos.x), y: Math.round(pos.y) };
     }
 
     _draw(e) {
         if (!this.isDrawing || !this.lastPoint) return;
-        const pos = this._getCanvasPos(e);
+        const pos = this._roundPos(this._getCanvasPos(e));
+        if (pos.x === this.lastPoint.x && pos.y === this.lastPoint.y) return;
         const drawData = {
             type: 'line',
             x1: this.lastPoint.x, y1: this.lastPoint.y,
             x2: pos.x, y2: pos.y,
-            color: this.tool === 'eraser' ? '#222222' : this.currentColor,
+            color: this.tool === 'eraser' ? BACKGROUND : this.currentColor,
             size: this.tool === 'eraser' ? this.brushSize * 4 : this.brushSize,
         };
         this._drawLine(drawData);
-        this._sendDraw(drawData);
+        this._queuePoint(drawData);
         this.lastPoint = pos;
     }
 
     _endDraw() {
+        this._flushStroke();
         this.isDrawing = false;
         this.lastPoint = null;
     }
 
+    _queuePoint(seg) {
+        const out = this._outgoing;
+        if (out && (out.color !== seg.color || out.size !== seg.size)) this._flushStroke();
+        if (!this._outgoing) {
+            this._outgoing = { type: 'stroke', color: seg.color, size: seg.size, points: [seg.x1, seg.y1] };
+        }
+        this._outgoing.points.push(seg.x2, seg.y2);
+        if (!this._sendTimer) this._sendTimer = setTimeout(() => this._flushStroke(), SEND_INTERVAL);
+    }
+
+    _flushStroke() {
+        clearTimeout(this._sendTimer);
+        this._sendTimer = null;
+        const out = this._outgoing;
+        this._outgoing = null;
+        if (out && out.points.length >= 4) this._sendDraw(out);
+    }
+
+    _drawStroke(color, size, points) {
+        const ctx = this.ctx;
+        ctx.beginPath();
+        ctx.moveTo(points[0], points[1]);
+        for (let i = 2; i < points.length; i += 2) ctx.lineTo(points[i], points[i + 1]);
+        ctx.strokeStyle = color;
+        ctx.lineWidth = size;
+        ctx.lineCap = 'round';
+        ctx.lineJoin = 'round';
+        ctx.stroke();
+    }
+
+    /** Paint a run-length encoded bitmap (u32 run lengths and ABGR values). */
+    _drawRaster(raster) {
+        const decode = (b64) => {
+            const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+            return new Uint32Array(bytes.buffer);
+        };
+        const runs = decode(raster.runs);
+        const values = decode(raster.values);
+        const image = this.ctx.createImageData(raster.w, raster.h);
+        const pixels = new Uint32Array(image.data.buffer);
+        for (let i = 0, o = 0; i < runs.length; o += runs[i], i++) {
+            if (values[i]) pixels.fill(values[i], o, o + runs[i]);
+        }
+        // putImageData replaces pixels, so go through a canvas to keep the background
+        const layer = document.createElement('canvas');
+        layer.width = raster.w;
+        layer.height = raster.h;
+        layer.getContext('2d').putImageData(image, 0, 0);
+        this.ctx.drawImage(layer, 0, 0);
+    }
+
     _drawLine(data) {
         const ctx = this.ctx;
         ctx.beginPath();
@@ -211,6 +276,15 @@ export class Whiteboard {
     receiveDrawData(data) {
         if (data.type === 'clear') {
             this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
+        } else if (data.type === 'strokes') {
+            // Everyone's strokes from one server tick; ours are already drawn
+            data.strokes.forEach(s => {
+                if (s.id !== this.network?.playerId) this._drawStroke(s.color, s.size, s.points);
+            });
+        } else if (data.type === 'replay') {
+            this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
+            if (data.raster) this._drawRaster(data.raster);
+            data.strokes.forEach(([color, size, points]) => this._drawStroke(color, size, points));
         } else if (data.type === 'line') {
             this._drawLine(data);
         }
@@ -220,12 +294,15 @@ export class Whiteboard {
         if (this.isOpen) return;
         this.isOpen = true;
         this.el.classList.remove('hidden');
+        // The server replays the board when we subscribe
+        this.network?.subscribe('whiteboard');
     }
 
     close() {
         if (!this.isOpen) return;
         this.isOpen = false;
         this.el.classList.add('hidden');
+        this.network?.unsubscribe('whiteboard');
     }
 
     toggle() {
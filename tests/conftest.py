@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The servers are top-level scripts, not an installed package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import online_server as S  # noqa: E402
+
+
+# Helpers shared by test modules (from conftest import ...)
+def make_store(points):
+    """PlayerStore with player i + 1 at points[i] = (x, z)."""
+    store = S.PlayerStore()
+    for i, (x, z) in enumerate(points):
+        store.add(str(i + 1), {'name': f'p{i + 1}'}, x, 0, z)
+    return store
+
+
+def visible_ids(keys):
+    return sorted(zip(S.key_viewers(keys).tolist(), S.key_others(keys).tolist()))
+
+
+@pytest.fixture
+def game(tmp_path, monkeypatch):
+    """A GameServer whose database and session key live in tmp_path."""
+    monkeypatch.setattr(S, 'DB_PATH', tmp_path / 'users.db')
+    monkeypatch.setattr(S, 'SESSION_SECRET_PATH', tmp_path / 'session_secret')
+    return S.GameServer()
@@ -0,0 +1,81 @@
+import json
+import zlib
+
+from websockets.frames import Frame, Opcode
+
+import online_server as S
+
+
+class Client:
+    """The browser's side: one inflater across every compressed message."""
+    def __init__(self):
+        self.inflater = zlib.decompressobj(-15)
+
+    def receive(self, frame):
+        if not frame.rsv1:
+            return frame.data
+        return self.inflater.decompress(frame.data + b'\x00\x00\xff\xff')
+
+
+def codec():
+    return S.AdaptiveDeflate(False, False, 15, 15, {'memLevel': 5})
+
+
+def send(deflate, kind, payload, opcode=Opcode.TEXT):
+    deflate.kind = kind
+    return deflate.encode(Frame(opcode, payload))
+
+
+def state(n):
+    return json.dumps({'type': 'state', 'seq': n, 'players': [
+        {'id': str(i), 'x': i * 1.5, 'z': n * 0.25, 'anim': 'walk'} for i in range(40)]}).encode()
+
+
+def test_small_and_level_zero_messages_go_out_uncompressed():
+    deflate = codec()
+    assert not send(deflate, 'chat', b'{"type": "chat"}').rsv1
+    assert not send(deflate, 'voice_talking', b'x' * 10_000).rsv1
+    assert not send(deflate, 'state', b'\x01' * 600, Opcode.BINARY).rsv1  # 'state:bin' needs 1024
+    assert send(deflate, 'state', b'\x01' * 2000, Opcode.BINARY).rsv1
+    assert deflate.encode(Frame(Opcode.PING, b'x' * 5000)).data == b'x' * 5000
+
+
+def test_level_switches_keep_the_client_stream_decodable():
+    deflate, client = codec(), Client()
+    messages = [('state', state(1)), ('world', json.dumps({'type': 'world', 'objects': [1] * 500}).encode()),
+                ('chat', b'{"type": "chat"}'), ('state', state(2)), ('player_list', state(3)),
+                ('state', state(4))]
+    levels = []
+    for kind, payload in messages:
+        frame = send(deflate, kind, payload)
+        levels.append(deflate.level)
+        assert client.receive(frame) == payload
+    assert levels == [3, 9, 9, 3, 9, 3]
+
+
+def test_context_makes_repeated_state_cheap():
+    deflate = codec()
+    send(deflate, 'state', state(1))
+    warm = len(send(deflate, 'state', state(2)).data)
+    cold = len(send(codec(), 'state', state(2)).data)
+    assert warm < cold * 0.6
+
+
+def test_lean_mode_drops_the_compressor_between_messages():
+    deflate, client = codec(), Client()
+    deflate.lean = True
+    for n in range(3):
+        assert client.receive(send(deflate, 'state', state(n))) == state(n)
+        assert deflate.encoder is None
+    assert deflate.footprint() == len(deflate.window) <= S.COMPRESSION_WINDOW
+    deflate.lean = False
+    send(deflate, 'state', state(9))
+    assert deflate.footprint() > len(deflate.window)
+
+
+def test_compression_options_modes():
+    assert S.compression_options('off') == {'compression': None}
+    assert S.compression_options('deflate') == {'compression': 'deflate'}
+    adaptive = S.compression_options('adaptive')
+    assert adaptive['compression'] is None
+    assert isinstance(adaptive['extensions'][0], S.AdaptiveDeflateFactory)
@@ -0,0 +1,62 @@
+import online_server as S
+
+
+def test_next_seq_is_based_on_the_acked_snapshot():
+    base = S.ClientBaseline()
+    assert base.next_seq(10) == (1, 0)  # nothing acked: a full snapshot
+    assert base.next_seq(11) == (2, 0)
+    base.ack(1)
+    assert (base.acked_seq, base.acked_tick) == (1, 10)
+    assert base.next_seq(12) == (3, 1)
+    assert sorted(base.sent) == [2, 3]
+
+
+def test_ack_ignores_stale_unknown_and_non_int_seqs():
+    base = S.ClientBaseline()
+    for tick in (1, 2, 3):
+        base.next_seq(tick)
+    base.ack(2)
+    base.ack(1)        # older than the current baseline
+    base.ack(99)       # never sent
+    base.ack('3')
+    base.ack(None)
+    assert (base.acked_seq, base.acked_tick) == (2, 2)
+    base.ack(3)
+    assert (base.acked_seq, base.acked_tick) == (3, 3)
+
+
+def test_expire_falls_back_to_a_full_snapshot():
+    base = S.ClientBaseline()
+    base.next_seq(1)
+    base.ack(1)
+    base.expire(1 + S.SNAPSHOT_WINDOW)
+    assert base.acked_seq == 1
+    base.expire(2 + S.SNAPSHOT_WINDOW)
+    assert (base.acked_seq, base.acked_tick) == (0, -1)
+    assert base.next_seq(3 + S.SNAPSHOT_WINDOW)[1] == 0
+
+
+def test_expire_trims_unacked_history():
+    base = S.ClientBaseline()
+    for tick in range(1, 2 * S.SNAPSHOT_WINDOW + 1):
+        base.next_seq(tick)
+    base.expire(2 * S.SNAPSHOT_WINDOW)
+    assert len(base.sent) == S.SNAPSHOT_WINDOW
+    assert min(base.sent.values()) == S.SNAPSHOT_WINDOW + 1
+
+
+def test_changed_since_reports_only_fields_written_after_the_baseline():
+    store = S.PlayerStore()
+    store.add('1', {'name': 'a'}, 0, 0, 0)
+    store.add('2', {'name': 'b'}, 0, 0, 0)
+    store.advance(1)
+    store.move('1', x=1.0)
+    store.move('2', x=0.0, anim='walk')  # x unchanged: not stamped
+    store.advance(2)
+
+    fields = dict(zip(S.DYNAMIC_FIELDS, range(5)))
+    changed = store.changed_since(1)
+    assert changed[0].tolist() == [i == fields['x'] for i in range(5)]
+    assert changed[1].tolist() == [i == fields['anim'] for i in range(5)]
+    assert not store.changed_since(2).any()
+    assert store.changed_since(0).all()  # a full snapshot sends everything
@@ -0,0 +1,47 @@
+import numpy as np
+
+import online_server as S
+
+
+def records(tick, ids):
+    """PLAYER_RECORD rows with player i at x = tick + i (in wire units)."""
+    rows = np.zeros(len(ids), S.PLAYER_RECORD)
+    rows['id'] = ids
+    rows['x'] = [(tick + i) * S.POS_SCALE for i in ids]
+    return rows
+
+
+def test_ring_buffer_keeps_the_last_size_ticks():
+    history = S.SnapshotHistory(size=4)
+    assert history.oldest is None and history.at(10) is None
+    for tick in range(1, 8):
+        history.record(tick, tick * 50.0, records(tick, [3, 1]))
+    assert history.oldest == 4
+    tick, frame = history.at(6)
+    assert tick == 6 and frame['id'].tolist() == [1, 3]  # sorted by id
+    assert history.at(100)[0] == 7
+    assert history.at(2) is None
+    assert history.stats() == {'ticks': 4, 'oldest': 4, 'bytes': 4 * 2 * S.PLAYER_RECORD.itemsize}
+
+
+def test_tick_at_maps_server_time_to_a_tick():
+    history = S.SnapshotHistory(size=8)
+    for tick in range(1, 6):
+        history.record(tick, 1000.0 + tick * 50, records(tick, [1]))
+    assert history.tick_at(1000.0 + 175) == 3
+    assert history.tick_at(1000.0 + 250) == 5
+    assert history.tick_at(1000.0) is None
+
+
+def test_positions_as_of_a_past_tick():
+    history = S.SnapshotHistory(size=4)
+    for tick in range(1, 7):
+        history.record(tick, 0.0, records(tick, [2, 5] if tick < 6 else [2]))
+    found, x, y, z = history.positions(5, [5, 2, 9])
+    assert found.tolist() == [True, True, False]
+    assert x[:2].tolist() == [10.0, 7.0]
+    found, x, _, _ = history.positions(6, [5])
+    assert not found[0]  # gone by tick 6
+    found, x, _, _ = history.positions(1, [2])  # too old: the oldest kept (tick 3)
+    assert found[0] and x[0] == 5.0
+    assert not S.SnapshotHistory(size=4).positions(1, [2])[0].any()
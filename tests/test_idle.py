@@ -0,0 +1,82 @@
+import asyncio
+
+import numpy as np
+
+import online_server as S
+from conftest import make_store, visible_ids
+
+
+class Box:
+    """Records a room's set_lean() calls for one connection."""
+    def __init__(self):
+        self.lean = False
+
+    def set_lean(self, lean):
+        self.lean = lean
+
+
+def test_viewer_rows_marks_every_pair_of_the_given_viewers():
+    keys = np.sort(S.pair_keys(np.array([1, 1, 2, 3, 3, 5], np.uint32), np.array([2, 3, 1, 1, 2, 1], np.uint32)))
+    assert S.viewer_rows(keys, np.array([1, 3], np.uint32)).tolist() == [True, True, False, True, True, False]
+    assert not S.viewer_rows(keys, np.array([4], np.uint32)).any()
+    assert not S.viewer_rows(S.NO_KEYS, np.array([1], np.uint32)).size
+
+
+def test_frozen_viewers_are_held_then_caught_up():
+    store = make_store([(0, 0), (4, 0), (30, 0)])
+    tracker = S.InterestTracker(radius=5, hysteresis=2)
+    tracker.update(store, 1)
+    frozen = np.array([1], np.uint32)
+
+    # Slots 1 and 2 are players 2 and 3: 2 walks away, 3 comes up to player 1
+    store.write(np.array([1]), np.float32(30), np.float32(0), np.float32(1), np.float32(0), np.uint8(0))
+    store.write(np.array([2]), np.float32(1), np.float32(0), np.float32(0), np.float32(0), np.uint8(0))
+    keys, _, _, _, entered, exited = tracker.update(store, 2, frozen=frozen)
+    assert visible_ids(keys) == [(3, 1)]                      # player 1 gets nothing ...
+    assert visible_ids(exited) == [(2, 1)]
+    assert (1, 2) in visible_ids(tracker.keys)                # ... but keeps its old pair
+
+    keys, _, _, since, entered, exited = tracker.update(store, 3)
+    assert visible_ids(keys[entered]) == [(1, 3)]
+    assert visible_ids(exited) == [(1, 2)]
+    assert since[~entered].tolist() == [2]
+
+
+def test_lean_outbox_sheds_droppables_and_shrinks_its_queue():
+    class Socket:
+        async def send(self, payload):
+            await asyncio.Event().wait()
+
+    async def main():
+        box = S.Outbox(Socket(), limit=S.IDLE_QUEUE_LIMIT * 4)
+        box.set_lean(True)
+        assert box.limit == S.IDLE_QUEUE_LIMIT and box.stats()['lean']
+        assert not box.push('talk', S.DROPPABLE, 'voice_talking')
+        assert not box.defer('talk', S.DROPPABLE, 'voice_talking')
+        assert box.defer('chat', S.RELIABLE, 'chat')
+        assert S.MESSAGES_DROPPED.values[('voice_talking', 'idle')] >= 2
+        box.set_lean(False)
+        assert box.limit == S.IDLE_QUEUE_LIMIT * 4
+        box.close()
+    asyncio.run(main())
+
+
+def test_room_freezes_idle_clients_and_staggers_afk_updates(game):
+    room = S.Room('lobby', game)
+    room.idle_period = 4
+    for pid in ('1', '2', '3'):
+        room.connections[pid] = Box()
+        room.baselines[pid] = S.ClientBaseline()
+    assert room.frozen_viewers(0) is S.NO_IDS
+
+    room.sleep('1', 'afk')
+    room.sleep('2', 'afk')
+    room.report_input('3', hidden=True)
+    assert room.connections['1'].lean and room.idle == {'1': 'afk', '2': 'afk', '3': 'hidden'}
+    due = {tick: sorted(set('123') - set(map(str, room.frozen_viewers(tick).tolist()))) for tick in range(4)}
+    assert due == {0: [], 1: [], 2: ['2'], 3: ['1']}          # hidden tabs never come due
+
+    room.baselines['1'].seq = 5
+    room.report_input('1')
+    assert not room.connections['1'].lean and '1' not in room.idle
+    assert room.frozen_viewers(0).tolist() == [2, 3]
@@ -0,0 +1,39 @@
+import online_server as S
+
+
+def test_bools_only_pass_fields_that_declare_bool():
+    move = S.INBOUND['move']
+    assert move.check({'x': 1, 'y': 2.5, 'z': -3, 'ry': 0.0, 'anim': 'walk', 'seq': 4}, 64) is None
+    assert move.check({'x': True}, 64) == 'schema'
+    assert move.check({'seq': False}, 64) == 'schema'
+    assert move.check({'x': '1'}, 64) == 'schema'
+    assert S.INBOUND['presence'].check({'hidden': True}, 32) is None
+    assert S.INBOUND['presence'].check({'hidden': 1}, 32) == 'schema'
+    assert S.INBOUND['join'].check({'color': True}, 32) == 'schema'
+    assert S.INBOUND['join'].check({'color': '#ff0000', 'room': None}, 32) is None
+
+
+def test_size_cap_and_absent_fields():
+    chat = S.INBOUND['chat']
+    assert chat.check({}, 10) is None
+    assert chat.check({'message': 'hi'}, chat.max_bytes + 1) == 'size'
+    assert S.INBOUND_MAX_BYTES == max(spec.max_bytes for spec in S.INBOUND.values())
+
+
+def test_every_handler_exists():
+    for spec in S.INBOUND.values():
+        assert callable(getattr(S.GameServer, spec.handler)), spec.handler
+
+
+def test_parse_rates_skips_malformed_rules():
+    assert S.parse_rates(' move = 30/60 ;chat=1.5/5;bad;=1/1;x=3') == {'move': (30.0, 60), 'chat': (1.5, 5)}
+
+
+def test_client_buckets_and_strikes(monkeypatch):
+    monkeypatch.setattr(S, 'INBOUND_LIMITS', {'chat': (0.001, 2)})
+    monkeypatch.setattr(S, 'INBOUND_STRIKE_RATE', 0.001)
+    monkeypatch.setattr(S, 'INBOUND_STRIKE_BURST', 2)
+    client = S.Client(websocket=None)
+    assert [client.admit('chat') for _ in range(3)] == [True, True, False]
+    assert client.admit('unlimited')
+    assert [client.reject('move', 'schema') for _ in range(3)] == [False, False, True]
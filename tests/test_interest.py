@@ -0,0 +1,87 @@
+import numpy as np
+
+import online_server as S
+from conftest import make_store, visible_ids
+
+
+def test_pair_keys_round_trip_and_sort_viewer_major():
+    viewers = np.array([3, 1, 2, 1], np.uint32)
+    others = np.array([1, 4_000_000_000, 7, 2], np.uint32)
+    keys = S.pair_keys(viewers, others)
+    assert S.key_viewers(keys).tolist() == viewers.tolist()
+    assert S.key_others(keys).tolist() == others.tolist()
+    assert S.key_viewers(np.sort(keys)).tolist() == [1, 1, 2, 3]
+
+
+def test_candidate_pairs_cover_every_pair_within_a_cell():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-60, 60, size=(80, 2))
+    store = make_store(points)
+    grid = S.InterestGrid(cell_size=10)
+    viewers, others = grid.candidate_pairs(store)
+    found = set(zip(viewers.tolist(), others.tolist()))
+
+    assert all(v != o for v, o in found)
+    assert len(found) == len(viewers)  # no duplicates
+    for a in range(len(points)):
+        for b in range(len(points)):
+            if a != b and np.hypot(*(points[a] - points[b])) <= 10:
+                assert (a, b) in found
+
+
+def test_candidate_pairs_skip_viewers_but_keep_them_visible():
+    store = make_store([(0, 0), (1, 0), (2, 0)])
+    grid = S.InterestGrid(cell_size=10)
+    viewers, others = grid.candidate_pairs(store, skip=np.array([2], np.uint32))
+    assert 1 not in viewers.tolist()  # slot of player 2
+    assert 1 in others.tolist()
+
+
+def test_tracker_enters_within_radius_and_keeps_through_hysteresis():
+    store = make_store([(0, 0), (4, 0), (30, 0)])
+    tracker = S.InterestTracker(radius=5, hysteresis=2)
+
+    keys, viewers, others, since, entered, exited = tracker.update(store, 1)
+    assert visible_ids(keys) == [(1, 2), (2, 1)]
+    assert entered.all()
+    assert since.tolist() == [1, 1]
+    assert not exited.size
+
+    # Inside the hysteresis band: still visible, no longer new
+    store.move('2', x=6.5)
+    keys, _, _, since, entered, exited = tracker.update(store, 2)
+    assert visible_ids(keys) == [(1, 2), (2, 1)]
+    assert not entered.any()
+    assert since.tolist() == [1, 1]
+
+    # Past radius + hysteresis: both directions exit
+    store.move('2', x=7.5)
+    keys, _, _, _, _, exited = tracker.update(store, 3)
+    assert not keys.size
+    assert visible_ids(exited) == [(1, 2), (2, 1)]
+    assert visible_ids(tracker.exit_keys) == [(1, 2), (2, 1)]
+
+    # Coming back needs the full radius again
+    store.move('2', x=6)
+    keys, *_ = tracker.update(store, 4)
+    assert not keys.size
+    store.move('2', x=5)
+    keys, _, _, since, entered, _ = tracker.update(store, 5)
+    assert visible_ids(keys) == [(1, 2), (2, 1)]
+    assert entered.all() and since.tolist() == [5, 5]
+
+
+def test_tracker_announced_pairs_are_not_reported_as_entered():
+    store = make_store([(0, 0), (1, 0)])
+    tracker = S.InterestTracker(radius=5, hysteresis=2)
+    tracker.announce(S.pair_keys(np.array([1, 2], np.uint32), np.array([2, 1], np.uint32)), 1)
+    keys, _, _, since, entered, _ = tracker.update(store, 2)
+    assert visible_ids(keys) == [(1, 2), (2, 1)]
+    assert not entered.any()
+    assert since.tolist() == [1, 1]
+
+
+def test_visible_from_uses_the_enter_radius():
+    store = make_store([(0, 0), (3, 4), (5.5, 0), (0, -2)])
+    tracker = S.InterestTracker(radius=5, hysteresis=2)
+    assert tracker.visible_from(store, store.slot_of['1']).tolist() == [2, 4]
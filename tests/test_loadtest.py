@@ -0,0 +1,41 @@
+import argparse
+
+import loadtest as L
+import online_server as S
+
+
+def test_wire_format_matches_the_server():
+    assert L.WIRE_PROTOCOL == S.WIRE_PROTOCOL
+    assert (L.POS_SCALE, L.RY_SCALE, L.MSG_STATE, L.MSG_MOVE) == (S.POS_SCALE, S.RY_SCALE, S.MSG_STATE, S.MSG_MOVE)
+    assert L.STATE_HEADER.format == S.STATE_HEADER.format
+    assert L.MOVE_RECORD.format == S.MOVE_RECORD.format
+    assert L.PLAYER_RECORD == S.PLAYER_RECORD
+    assert tuple(L.ANIM_STATES) == S.ANIM_STATES
+
+
+def test_reservoir_stays_bounded():
+    sample = L.Reservoir(limit=100)
+    assert sample.percentiles(50) == [None]
+    for v in range(10_000):
+        sample.add(v)
+    assert sample.seen == 10_000 and len(sample.values) == 100
+    low, high = sample.percentiles(1, 99)
+    assert 0 <= low < high < 10_000
+
+
+def test_latency_is_matched_on_quantized_positions():
+    swarm = L.Swarm(argparse.Namespace())
+    swarm.measuring = True
+    x, z = L.quantize(1.2345), L.quantize(-7.01)
+    assert x * L.POS_SCALE == round(x * L.POS_SCALE)
+    swarm.record_sent('3', x, z, 10.0)
+    swarm.record_seen('3', x, z, 10.025)
+    swarm.record_seen('3', 0.0, 0.0, 10.03)  # never sent: ignored
+    assert [round(v, 6) for v in swarm.latency_ms.values] == [25.0]
+
+
+def test_lookup_walks_nested_results():
+    result = {'server': {'cpu': 12.5}, 'connected': 10}
+    assert L.lookup(result, 'server.cpu') == 12.5
+    assert L.lookup(result, 'connected') == 10
+    assert L.lookup(result, 'missing.cpu') is None
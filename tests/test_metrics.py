@@ -0,0 +1,93 @@
+import asyncio
+import io
+import json
+from types import SimpleNamespace
+
+import websockets
+from websockets.http11 import Request
+
+import online_server as S
+
+
+def admin_request(path, remote, **headers):
+    connection = SimpleNamespace(remote_address=remote)
+    return connection, Request(path, websockets.Headers(headers))
+
+
+def test_render_prometheus_text():
+    registry = S.Metrics()
+    registry.const_labels['worker'] = '1'
+    requests = registry.counter('app_requests_total', 'Requests', ('route',))
+    assert registry.counter('app_requests_total', 'Requests', ('route',)) is requests
+    requests.inc('/a')
+    requests.inc('/a', n=2)
+    requests.inc('say "hi"\n')
+    latency = registry.histogram('app_seconds', 'Latency', buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    registry.gauge('app_open', 'Open', lambda: 4)
+    registry.gauge('app_by_kind', 'By kind', lambda: [(('x',), 1), (('y',), 2)], ('kind',))
+
+    lines = registry.render().splitlines()
+    assert '# TYPE app_requests_total counter' in lines
+    assert 'app_requests_total{route="/a",worker="1"} 3' in lines
+    assert 'app_requests_total{route="say \\"hi\\"\\n",worker="1"} 1' in lines
+    assert '# TYPE app_seconds histogram' in lines
+    assert 'app_seconds_bucket{le="0.1",worker="1"} 1' in lines
+    assert 'app_seconds_bucket{le="1.0",worker="1"} 2' in lines
+    assert 'app_seconds_bucket{le="+Inf",worker="1"} 3' in lines
+    assert 'app_seconds_sum{worker="1"} 5.55' in lines
+    assert 'app_seconds_count{worker="1"} 3' in lines
+    assert 'app_open{worker="1"} 4' in lines
+    assert 'app_by_kind{kind="y",worker="1"} 2' in lines
+
+
+def test_logger_writes_text_and_json_off_thread():
+    text, js = io.StringIO(), io.StringIO()
+    for fmt, stream in (('text', text), ('json', js)):
+        logger = S.Logger(fmt=fmt, stream=stream)
+        logger('join', '[+] {name} joined', name='ann', room='lobby')
+        logger.flush()
+    assert text.getvalue() == '  [+] ann joined\n'
+    record = json.loads(js.getvalue())
+    assert record['event'] == 'join' and record['msg'] == '[+] ann joined'
+    assert record['name'] == 'ann' and record['room'] == 'lobby'
+
+
+def test_logger_drops_instead_of_blocking_when_full():
+    logger = S.Logger(limit=2, stream=io.StringIO())
+    logger.thread = object()  # no writer: the queue only fills
+    for i in range(5):
+        logger('e', '{i}', i=i)
+    assert logger.dropped == 3
+
+
+def test_admin_routes_answer_loopback_only_without_a_token(monkeypatch):
+    monkeypatch.setattr(S, 'ADMIN_TOKEN', '')
+    assert S.admin_allowed(*admin_request('/api/stats', ('127.0.0.1', 5000)))
+    assert S.admin_allowed(*admin_request('/api/stats', ('::1', 5000, 0, 0)))
+    assert S.admin_allowed(*admin_request('/api/stats', ('::ffff:127.0.0.1', 5000, 0, 0)))
+    assert not S.admin_allowed(*admin_request('/api/stats', ('203.0.113.9', 5000)))
+    # Behind a local proxy every request looks loopback
+    assert not S.admin_allowed(*admin_request(
+        '/api/stats', ('127.0.0.1', 5000), **{'X-Forwarded-For': '203.0.113.9'}))
+    assert not S.admin_allowed(*admin_request('/api/stats', None))
+
+
+def test_admin_token_is_required_once_configured(monkeypatch):
+    monkeypatch.setattr(S, 'ADMIN_TOKEN', 's3cret')
+    local = ('127.0.0.1', 5000)
+    assert not S.admin_allowed(*admin_request('/api/metrics', local))
+    assert not S.admin_allowed(*admin_request('/api/metrics', local, Authorization='Bearer nope'))
+    assert S.admin_allowed(*admin_request('/api/metrics', ('203.0.113.9', 5000), Authorization='Bearer s3cret'))
+
+
+def test_serve_file_forbids_admin_routes(game, monkeypatch):
+    monkeypatch.setattr(S, 'ADMIN_TOKEN', '')
+    remote = ('203.0.113.9', 5000)
+    for path in ('/api/metrics', '/api/stats', '/api/connections'):
+        response = asyncio.run(S.serve_file(*admin_request(path, remote), game))
+        assert response.status_code == 403
+    response = asyncio.run(S.serve_file(*admin_request('/api/metrics', ('127.0.0.1', 5000)), game))
+    assert response.status_code == 200 and b'metaverse_' in response.body
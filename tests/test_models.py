@@ -0,0 +1,93 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import online_server as S
+
+CUBE = S.ROOT_DIR / 'samples' / 'cube.obj'
+
+
+def read_glb(data):
+    """(gltf JSON, binary chunk) after checking the container layout."""
+    magic, version, length = struct.unpack_from('<4sII', data)
+    assert (magic, version, length) == (b'glTF', 2, len(data))
+    json_len, json_type = struct.unpack_from('<I4s', data, 12)
+    assert json_type == b'JSON' and json_len % 4 == 0
+    gltf = json.loads(data[20:20 + json_len])
+    bin_len, bin_type = struct.unpack_from('<I4s', data, 20 + json_len)
+    assert bin_type == b'BIN\0' and bin_len == gltf['buffers'][0]['byteLength']
+    return gltf, data[28 + json_len:28 + json_len + bin_len]
+
+
+def accessor_array(gltf, body, index, dtype, width):
+    accessor = gltf['accessors'][index]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    raw = np.frombuffer(body, dtype, view['byteLength'] // np.dtype(dtype).itemsize, view['byteOffset'])
+    return raw.reshape(accessor['count'], -1)[:, :width]
+
+
+def test_cube_converts_to_quantized_glb(tmp_path):
+    out = tmp_path / 'cache' / 'cube.glb'
+    vertices, triangles, in_bytes, out_bytes = S.convert_model(str(CUBE), [], str(out))
+    assert (vertices, triangles) == (24, 12)   # each corner once per face normal
+    assert out_bytes == out.stat().st_size and in_bytes == len(CUBE.read_text())
+
+    gltf, body = read_glb(out.read_bytes())
+    assert gltf['extensionsRequired'] == ['KHR_mesh_quantization']
+    (primitive,) = gltf['meshes'][0]['primitives']
+    position = gltf['accessors'][primitive['attributes']['POSITION']]
+    assert (position['componentType'], position['count'], position['normalized']) == (S.GL_SHORT, 24, True)
+    assert gltf['accessors'][primitive['attributes']['NORMAL']]['componentType'] == S.GL_BYTE
+    assert 'TEXCOORD_0' not in primitive['attributes']
+    assert gltf['accessors'][primitive['indices']]['count'] == 36
+
+    # Node transform puts the normalized positions back in model space
+    node = gltf['nodes'][0]
+    q = accessor_array(gltf, body, primitive['attributes']['POSITION'], '<i2', 3)
+    positions = q / 32767 * node['scale'][0] + node['translation']
+    assert np.allclose(np.abs(positions), 1, atol=1e-4)
+    assert not list(tmp_path.glob('cache/*.tmp'))
+
+
+def test_materials_split_primitives_and_keep_opacity(tmp_path):
+    (tmp_path / 'm.mtl').write_text('newmtl glass\nKd 1 0 0\nd 0.5\n')
+    obj = tmp_path / 'm.obj'
+    obj.write_text('mtllib m.mtl\nv 0 0 0\nv 1 0 0\nv 0 1 0\nvt 0 0\nvt 1 0\nvt 0 1\n'
+                   'f 1/1 2/2 3/3\nusemtl glass\nf 3/3 2/2 1/1\n')
+    S.convert_model(str(obj), [str(tmp_path / 'm.mtl')], str(tmp_path / 'm.glb'))
+    gltf, _ = read_glb((tmp_path / 'm.glb').read_bytes())
+    default, glass = gltf['materials']
+    assert default['name'] == 'default' and 'alphaMode' not in default
+    assert glass['alphaMode'] == 'BLEND'
+    assert glass['pbrMetallicRoughness']['baseColorFactor'] == [1.0, 0.0, 0.0, 0.5]
+    uv = gltf['accessors'][gltf['meshes'][0]['primitives'][0]['attributes']['TEXCOORD_0']]
+    assert uv['componentType'] == S.GL_UNSIGNED_SHORT
+
+
+def test_bad_models_are_refused(tmp_path):
+    obj = tmp_path / 'bad.obj'
+    obj.write_text('v 0 0 0\n')
+    with pytest.raises(ValueError, match='no faces'):
+        S.convert_model(str(obj), [], str(tmp_path / 'bad.glb'))
+    obj.write_text('v 0 0 0\nv 1 0 0\nf 1 2 3\n')
+    with pytest.raises(ValueError, match='out of range'):
+        S.convert_model(str(obj), [], str(tmp_path / 'bad.glb'))
+
+
+def test_parse_obj_fans_polygons_and_resolves_negative_indices():
+    v, vt, vn, faces = S.parse_obj('v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nvn 0 0 1\n'
+                                   'f -4//-1 -3//-1 -2//-1 -1//-1\nusemtl red\nf 1 2 3\n')
+    assert len(v) == 4 and not vt and vn == [['0', '0', '1']]
+    assert faces[None] == [(1, 0, 1), (2, 0, 1), (3, 0, 1), (1, 0, 1), (3, 0, 1), (4, 0, 1)]
+    assert faces['red'] == [(1, 0, 0), (2, 0, 0), (3, 0, 0)]
+
+
+def test_model_key_follows_the_mtl_files(tmp_path):
+    obj = tmp_path / 'a.obj'
+    obj.write_text('mtllib a.mtl ../outside.mtl\nv 0 0 0\n')
+    key, inputs = S.model_key(obj)
+    assert inputs == [obj, (tmp_path / 'a.mtl').resolve()]   # missing, but watched
+    (tmp_path / 'a.mtl').write_text('newmtl x\nKd 1 1 1\n')
+    assert S.model_key(obj)[0] != key
@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+
+import online_server as S
+
+GUIDE = {'kind': 'topic', 'name': 'Guide', 'waypoints': [[0, 0], [10, 0]], 'speed': 2, 'radius': 3}
+
+
+def write(tmp_path, defs):
+    path = tmp_path / 'npcs.json'
+    path.write_text(json.dumps(defs))
+    return str(path)
+
+
+def test_load_npcs_defaults_and_valid_file(tmp_path):
+    assert S.load_npcs('') is S.DEFAULT_NPCS
+    assert S.load_npcs(write(tmp_path, [GUIDE])) == [GUIDE]
+
+
+@pytest.mark.parametrize('bad, message', [
+    ({'name': 'x', 'waypoints': [[0, 0]]}, "'kind'"),
+    (dict(GUIDE, name=''), "'name'"),
+    (dict(GUIDE, waypoints=[]), 'waypoints'),
+    (dict(GUIDE, waypoints=[[0, 0], [1]]), 'bad waypoint'),
+    (dict(GUIDE, waypoints=[[True, 0]]), 'bad waypoint'),
+    (dict(GUIDE, speed=-1), "'speed'"),
+    (dict(GUIDE, radius='5'), "'radius'"),
+    ('guide', 'expected an object'),
+])
+def test_load_npcs_rejects_bad_definitions(tmp_path, bad, message):
+    with pytest.raises(ValueError, match=message):
+        S.load_npcs(write(tmp_path, [GUIDE, bad]))
+
+
+def test_load_npcs_wants_a_list(tmp_path):
+    with pytest.raises(ValueError, match='list'):
+        S.load_npcs(write(tmp_path, GUIDE))
+
+
+def crowd_with_player(x, z):
+    store = S.PlayerStore()
+    crowd = S.NpcCrowd([GUIDE])
+    crowd.spawn(store)
+    store.add('1', {'name': 'p1'}, x, 0, z)
+    return crowd, store
+
+
+def test_npc_walks_its_route_when_nobody_is_near():
+    crowd, store = crowd_with_player(50, 50)
+    for _ in range(20):
+        assert not crowd.step(store, 0.1).size
+    assert crowd.pos[0, 0] > 1 and store.anim[crowd.slots[0]] == S.ANIM_INDEX['walk']
+
+
+def test_npc_stops_and_greets_once_per_approach():
+    crowd, store = crowd_with_player(1, 1)
+    entered = crowd.step(store, 0.1)
+    assert S.key_viewers(entered).tolist() == [S.NPC_ID_BASE]
+    assert S.key_others(entered).tolist() == [1]
+    assert tuple(crowd.pos[0]) == (0, 0)
+    assert not crowd.step(store, 0.1).size
+    assert crowd.stats() == {'npcs': 1, 'in_range': 1, 'greetings': 1}
+
+
+def test_npcs_are_seen_but_never_viewers():
+    crowd, store = crowd_with_player(1, 1)
+    tracker = S.InterestTracker(radius=5, hysteresis=2)
+    tracker.announce(S.pair_keys(crowd.num_ids, np.array([1], np.uint32)), 0)
+    keys = tracker.update(store, 1, blind=crowd.num_ids)[0]
+    assert S.key_viewers(keys).tolist() == [1]
+    assert S.key_others(keys).tolist() == [S.NPC_ID_BASE]
+    assert not S.viewer_rows(tracker.keys, crowd.num_ids).any()
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import online_server as S
+
+
+class FakeSocket:
+    """Stands in for a websockets connection; send() waits until the test opens the gate."""
+    def __init__(self, open_=True):
+        self.sent = []
+        self.gate = asyncio.Event()
+        if open_:
+            self.gate.set()
+
+    async def send(self, payload):
+        await self.gate.wait()
+        self.sent.append(payload)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def drain(box):
+    for _ in range(10):
+        await asyncio.sleep(0)
+    return box.ws.sent
+
+
+def test_supersede_keeps_only_the_newest_queued_state():
+    async def main():
+        ws = FakeSocket(open_=False)
+        box = S.Outbox(ws, limit=8)
+        box.push('in-flight')
+        await asyncio.sleep(0)  # writer takes it and blocks in send()
+        for i in range(3):
+            assert box.push(f'state{i}', S.SUPERSEDE, 'state')
+        box.push('event')
+        assert box.pending == 2
+        ws.gate.set()
+        sent = await drain(box)
+        box.close()
+        return sent
+    assert run(main()) == ['in-flight', 'state2', 'event']
+
+
+def test_droppable_is_shed_once_the_queue_is_half_full():
+    async def main():
+        ws = FakeSocket(open_=False)
+        box = S.Outbox(ws, limit=4)
+        assert box.push('a', S.DROPPABLE, 'voice_talking')
+        await asyncio.sleep(0)
+        box.push('r1')
+        assert box.push('b', S.DROPPABLE, 'voice_talking')
+        assert box.pending == 2
+        assert not box.push('c', S.DROPPABLE, 'voice_talking')
+        assert not box.defer('d', S.DROPPABLE, 'voice_talking')
+        assert box.push('r2')  # reliable still fits
+        ws.gate.set()
+        sent = await drain(box)
+        box.close()
+        return sent
+    assert run(main()) == ['a', 'r1', 'b', 'r2']
+
+
+def test_reliable_overflow_disconnects_the_slow_consumer():
+    async def main():
+        box = S.Outbox(FakeSocket(open_=False), limit=2)
+        box.push('a')
+        await asyncio.sleep(0)
+        assert box.push('b') and box.push('c')
+        assert not box.push('d')
+        assert box.closed
+        assert not box.push('e') and not box.defer('f')
+        await asyncio.sleep(0)
+        return box.task.cancelled()
+    assert run(main())
+
+
+def test_flush_batches_events_with_the_state():
+    async def main():
+        box = S.Outbox(FakeSocket())
+        box.defer('{"type": "chat"}', kind='chat')
+        box.defer('{"type": "player_join"}', kind='player_join')
+        box.flush('{"type": "state"}')
+        await drain(box)
+        box.defer('{"type": "chat"}', kind='chat')
+        box.flush()  # a lone event goes out as itself
+        box.flush('{"type": "state"}')
+        sent = await drain(box)
+        box.close()
+        return sent
+    sent = run(main())
+    assert [m['type'] for m in json.loads(sent[0])['messages']] == ['chat', 'player_join', 'state']
+    assert sent[1:] == ['{"type": "chat"}', '{"type": "state"}']
+
+
+def test_flush_queues_state_separately_while_the_client_lags():
+    async def main():
+        ws = FakeSocket(open_=False)
+        box = S.Outbox(ws)
+        box.push('in-flight')
+        await asyncio.sleep(0)
+        box.push('backlog')
+        box.defer('{"type": "chat"}', kind='chat')
+        box.flush('{"type": "state", "n": 1}')
+        box.flush('{"type": "state", "n": 2}')
+        ws.gate.set()
+        sent = await drain(box)
+        box.close()
+        return sent
+    assert run(main()) == ['in-flight', 'backlog', '{"type": "chat"}', '{"type": "state", "n": 2}']
@@ -0,0 +1,54 @@
+import numpy as np
+
+import online_server as S
+
+
+def test_slots_are_reused_and_columns_grow():
+    store = S.PlayerStore(capacity=2)
+    for pid in ('1', '2', '3'):
+        store.add(pid, {'name': pid}, float(pid), 0, 0)
+    assert store.capacity == 4
+    assert store.position('1') == (1.0, 0.0)  # rows survive the reallocation
+
+    store.remove('2')
+    assert '2' not in store and len(store) == 2
+    assert not store.active[1]
+    assert store.add('4', {'name': '4'}, 4, 0, 0) == 1
+    assert store.pid_at[1] == '4' and store.num_id[1] == 4
+    store.remove('missing')  # no-op
+
+
+def test_move_stamps_only_changed_fields():
+    store = S.PlayerStore()
+    store.add('1', {'name': 'a'}, 0, 0, 0)
+    store.take_dirty()
+    store.advance(5)
+    assert not store.move('1', x=0, anim='idle')
+    assert not store.take_dirty().size
+    assert store.move('1', z=2, anim='wave')
+    assert store.field_tick[0].tolist() == [1, 1, 6, 1, 6]
+    assert store.take_dirty().tolist() == [0]
+    assert store.record('1')['anim'] == 'wave'
+
+
+def test_write_is_a_vectorized_move():
+    store = S.PlayerStore()
+    for pid in ('1', '2', '3'):
+        store.add(pid, {'name': pid}, 0, 0, 0)
+    store.take_dirty()
+    store.advance(1)
+    slots = np.array([0, 2])
+    store.write(slots, np.float32([0, 3]), np.float32(0), np.float32([1, 1]),
+                np.float32([0, 0]), np.uint8([0, 1]))
+    assert store.take_dirty().tolist() == [0, 2]
+    assert store.field_tick[0].tolist() == [1, 1, 2, 1, 1]
+    assert store.field_tick[2].tolist() == [2, 1, 2, 1, 2]
+    assert store.field_tick[1].tolist() == [1] * 5
+
+
+def test_record_merges_profile_and_per_tick_fields():
+    store = S.PlayerStore()
+    store.add('12', {'name': 'a', 'color': 7}, 1.23456, 0, -2, ry=0.5, anim='run')
+    assert store.record('12') == {'id': '12', 'name': 'a', 'color': 7,
+                                  'x': 1.235, 'y': 0.0, 'z': -2.0, 'ry': 0.5, 'anim': 'run'}
+    assert store.ids_of(np.array([12, 3], np.uint32)) == ['12', '3']
@@ -0,0 +1,34 @@
+import asyncio
+
+import online_server as S
+
+
+def test_room_name_is_sanitized():
+    assert S.room_name('Team-Blue_2') == 'team-blue_2'
+    assert S.room_name('a b/c#3') == 'abc3'
+    assert S.room_name('x' * 50) == 'x' * 32
+    assert S.room_name('!!!') == S.DEFAULT_ROOM
+    assert S.room_name(None) == S.DEFAULT_ROOM
+    assert S.room_name(7) == S.DEFAULT_ROOM
+
+
+def test_full_rooms_overflow_into_new_instances(game, monkeypatch):
+    monkeypatch.setattr(S, 'ROOM_CAPACITY', 2)
+
+    async def main():
+        first = game.assign_room('Hall')
+        assert first.key == 'hall' and first.population == 0
+        for pid in ('1', '2'):
+            first.players.add(pid, {'name': pid}, 0, 0, 0)
+        second = game.assign_room('hall')
+        assert second.key == 'hall#2'
+        assert second.population == 0  # NPCs don't count
+        assert len(second.players) == len(second.npcs)
+
+        first.players.remove('1')
+        assert game.assign_room('hall') is first  # space again in the first one
+        for room in game.rooms.values():
+            room.stop()
+        return sorted(game.rooms)
+
+    assert asyncio.run(main()) == ['hall', 'hall#2']
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+import online_server as S
+
+
+class FakeTime:
+    """time module for the scheduler with a monotonic clock the test moves."""
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class FakeAsyncio:
+    """asyncio for the scheduler whose sleep() advances the fake clock instead of waiting."""
+    def __init__(self, clock):
+        self.clock = clock
+
+    async def sleep(self, delay):
+        self.clock.now += delay
+        await asyncio.sleep(0)
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(S, 'time', clock)
+    monkeypatch.setattr(S, 'asyncio', FakeAsyncio(clock))
+    return clock
+
+
+def run_ticks(clock, scheduler, cost, until):
+    """Run the scheduler until tick `until`; job cost[tick] seconds of fake time. Returns the ticks run."""
+    seen = []
+
+    def job(tick):
+        seen.append(tick)
+        clock.now += cost.get(tick, 0)
+
+    async def main():
+        scheduler.on_tick(job)
+        task = asyncio.create_task(scheduler.run())
+        while not seen or seen[-1] < until:
+            await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(main())
+    return seen
+
+
+def test_on_time_ticks_run_once_per_period(clock):
+    scheduler = S.TickScheduler(rate=8, policy='skip', name='test')
+    assert run_ticks(clock, scheduler, {}, 5) == [1, 2, 3, 4, 5]
+    assert clock.now == 4 * scheduler.period
+    assert (scheduler.overruns, scheduler.skipped, scheduler.caught_up) == (0, 0, 0)
+
+
+def test_skip_policy_drops_missed_ticks_but_keeps_counting(clock):
+    scheduler = S.TickScheduler(rate=8, policy='skip', name='test')
+    # tick 3 takes 4.5 periods: ticks 4-6 were due while it ran
+    assert run_ticks(clock, scheduler, {3: 4.5 * scheduler.period}, 8) == [1, 2, 3, 7, 8]
+    assert scheduler.skipped == 3
+    assert scheduler.overruns == 1
+    assert scheduler.caught_up == 0
+
+
+def test_catchup_policy_runs_late_ticks_back_to_back(clock):
+    scheduler = S.TickScheduler(rate=8, policy='catchup', max_catchup=2, name='test')
+    # 3 ticks missed, at most 2 caught up: one is dropped
+    assert run_ticks(clock, scheduler, {3: 4.5 * scheduler.period}, 8) == [1, 2, 3, 5, 6, 7, 8]
+    assert scheduler.skipped == 1
+    assert scheduler.caught_up == 2
+
+
+def test_every_rounds_to_whole_ticks():
+    scheduler = S.TickScheduler(rate=20, name='test')
+    scheduler.every(1, print)
+    scheduler.every(0.01, print)
+    scheduler.every(0.26, print)
+    assert [interval for interval, _ in scheduler.jobs] == [20, 1, 5]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        S.TickScheduler(policy='sometimes')
+
+
+def test_failing_jobs_are_logged_and_async_ones_released(monkeypatch):
+    logged = []
+    monkeypatch.setattr(S, 'log', lambda event, template, **fields: logged.append((event, fields['job'])))
+    scheduler = S.TickScheduler(rate=20, name='test')
+
+    def sync_job(tick):
+        raise RuntimeError('sync')
+
+    async def async_job(tick):
+        await asyncio.sleep(0)
+        raise RuntimeError('async')
+
+    async def main():
+        scheduler.on_tick(sync_job)
+        scheduler.on_tick(async_job)
+        scheduler._run_jobs()
+        assert len(scheduler.tasks) == 1
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert not scheduler.tasks
+    assert logged == [('tick_error', 'sync_job'), ('tick_error', 'async_job')]
@@ -0,0 +1,100 @@
+import asyncio
+import base64
+import os
+import stat
+import time
+
+import websockets
+from websockets.http11 import Request
+
+import online_server as S
+
+SECRET = b'k' * 32
+
+
+def test_signed_token_round_trip():
+    payload = {'sid': 'abc', 'uid': 3, 'exp': int(time.time()) + 60}
+    token = S.sign_token(SECRET, payload)
+    assert S.read_token(SECRET, token) == payload
+
+
+def test_forged_expired_and_malformed_tokens_are_rejected():
+    token = S.sign_token(SECRET, {'sid': 'abc', 'uid': 3, 'exp': int(time.time()) + 60})
+    body, mac = token.split('.')
+    forged = S.b64url(b'{"sid":"abc","uid":1,"exp":9999999999}')
+    assert S.read_token(b'other', token) is None
+    assert S.read_token(SECRET, f'{forged}.{mac}') is None
+    assert S.read_token(SECRET, f'{body}.{mac[:-2]}') is None
+    assert S.read_token(SECRET, S.sign_token(SECRET, {'sid': 'abc', 'exp': time.time() - 1})) is None
+    assert S.read_token(SECRET, S.sign_token(SECRET, [1, 2])) is None
+    for bad in ('', 'a.b.c', 'no-dot', '!!.??', None, 42):
+        assert S.read_token(SECRET, bad) is None
+
+
+def test_session_cache_is_an_lru_with_a_ttl(monkeypatch):
+    cache = S.SessionCache(capacity=2, ttl=10)
+    cache.put('a', {'id': 1})
+    cache.put('b', {'id': 2})
+    assert cache.get('a') == (True, {'id': 1})
+    cache.put('c', {'id': 3})  # evicts b, the least recently used
+    assert cache.get('b') == (False, None)
+    cache.revoke('a')
+    assert cache.get('a') == (True, None)  # known bad: no database read
+    now = time.monotonic()
+    monkeypatch.setattr(S.time, 'monotonic', lambda: now + 11)
+    assert cache.get('c') == (False, None)
+
+
+def test_session_key_is_created_once_outside_the_web_root(tmp_path, monkeypatch):
+    path = tmp_path / 'state' / 'session_secret'
+    monkeypatch.setattr(S, 'SESSION_SECRET', '')
+    monkeypatch.setattr(S, 'SESSION_SECRET_PATH', path)
+    key = S.load_session_secret()
+    assert len(key) == 64 and path.read_bytes() == key
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert S.load_session_secret() == key
+    assert not S.STATE_DIR.resolve().is_relative_to(S.ROOT_DIR)
+    monkeypatch.setattr(S, 'SESSION_SECRET', 'from-env')
+    assert S.load_session_secret() == b'from-env'
+
+
+def test_issue_validate_and_revoke(game):
+    sessions = game.sessions
+
+    async def main():
+        user = await game.db.register('a@x.io', 'pw', 'Ann')
+        token, sid, expires = await sessions.issue(user)
+        assert expires > time.time()
+        assert await sessions.validate(token) == {'id': user['id'], 'name': 'Ann', 'color': None}
+
+        # A restarted worker has an empty cache and reads the database once
+        fresh = S.Sessions(game.db)
+        found = await asyncio.gather(fresh.validate(token), fresh.validate(token))
+        assert found[0] == found[1] and found[0]['id'] == user['id'] and found[0]['name'] == 'Ann'
+        assert fresh.db_reads == 1  # concurrent misses share one query
+
+        assert await sessions.revoke(token) == sid
+        assert await sessions.validate(token) is None
+        assert await S.Sessions(game.db).validate(token) is None
+        assert await sessions.revoke('garbage') is None
+        assert await S.Sessions(game.db).warm() == 0
+
+    asyncio.run(main())
+
+
+def test_register_needs_a_post_and_auth_responses_are_not_cached(game):
+    basic = 'Basic ' + base64.b64encode(b'a@x.io:pw').decode()
+
+    def call(method, path):
+        request = Request(path, websockets.Headers({'Authorization': basic}), method)
+        return asyncio.run(S.handle_api(request, path.partition('?')[0], game))
+
+    response = call('GET', '/api/register?name=Ann')
+    assert response.status_code == 405 and response.headers['Allow'] == 'POST, PUT'
+    assert call('GET', '/api/login').status_code == 401  # no account was created
+
+    response = call('POST', '/api/register?name=Ann')
+    assert response.status_code == 200 and response.headers['Cache-Control'] == 'no-store'
+    response = call('GET', '/api/login')
+    assert response.status_code == 200 and response.headers['Cache-Control'] == 'no-store'
+    assert 'Cache-Control' not in call('GET', '/api/world').headers
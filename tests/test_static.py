@@ -0,0 +1,145 @@
+import asyncio
+import gzip
+import os
+
+import websockets
+from websockets.http11 import Request
+
+import online_server as S
+
+
+def test_accepted_encodings_honours_q_zero():
+    assert S.accepted_encodings('gzip, br;q=0, deflate;q=0.5') == {'gzip', 'deflate'}
+    assert not S.accepted_encodings('br;q=0.0') & {'br', 'gzip'}
+
+
+def test_etag_matches_uses_weak_comparison():
+    assert S.etag_matches('"a", W/"b"', '"b"')
+    assert S.etag_matches('*', '"x"')
+    assert not S.etag_matches('"a"', '"b"')
+
+
+def test_cache_control_rules_first_match_wins():
+    rules = S.parse_cache_control('*.html=no-cache;/src/*=no-store;*=public, max-age=60')
+    assert rules == [('*.html', 'no-cache'), ('/src/*', 'no-store'), ('*', 'public, max-age=60')]
+    assert S.cache_control_for('/index.html') == 'no-cache'
+    assert S.cache_control_for('/samples/cube.obj') == 'public, max-age=3600'
+
+
+def test_asset_variants_and_selection(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(b'console.log("hello");\n' * 200)
+    asset = S.load_asset(path, 'application/javascript; charset=utf-8')
+    assert gzip.decompress(asset.variants['gzip']) == asset.body
+
+    coding, body, etag = asset.select('gzip, deflate')
+    assert coding == 'gzip' and body is asset.variants['gzip']
+    assert etag == asset.etag[:-1] + '-gzip"'
+    assert asset.select('identity') == (None, asset.body, asset.etag)
+
+    tiny = tmp_path / 'tiny.css'
+    tiny.write_bytes(b'a{}')
+    assert not S.load_asset(tiny, 'text/css').variants  # under STATIC_COMPRESS_MIN
+
+
+def test_cache_hits_until_the_file_changes(tmp_path):
+    path = tmp_path / 'a.html'
+    path.write_bytes(b'<p>one</p>')
+    cache = S.StaticCache(budget=1 << 20)
+
+    async def main():
+        first = await cache.get('/a.html', path)
+        assert await cache.get('/a.html', path) is first
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.lookup('/a.html') == path
+
+        path.write_bytes(b'<p>two!</p>')
+        os.utime(path, ns=(first.mtime_ns + 10 ** 9, first.mtime_ns + 10 ** 9))
+        second = await cache.get('/a.html', path)
+        assert second.body == b'<p>two!</p>' and second.etag != first.etag
+
+        path.unlink()
+        assert await cache.get('/a.html', path) is None
+        assert cache.lookup('/a.html') is None and cache.bytes == 0
+        assert await cache.get('/dir', tmp_path) is None
+
+    asyncio.run(main())
+
+
+def test_cache_evicts_least_recently_used_within_budget(tmp_path):
+    for name in 'abc':
+        (tmp_path / name).write_bytes(os.urandom(400))
+    cache = S.StaticCache(budget=1000, max_file=500)
+    big = tmp_path / 'big'
+    big.write_bytes(os.urandom(600))
+
+    async def main():
+        await cache.get('/a', tmp_path / 'a')
+        await cache.get('/b', tmp_path / 'b')
+        await cache.get('/a', tmp_path / 'a')   # a is now the most recent
+        await cache.get('/c', tmp_path / 'c')
+        assert list(cache.entries) == ['/a', '/c']
+        assert cache.evictions == 1 and cache.bytes == 800
+        assert (await cache.get('/big', big)).size == 600  # served, not kept
+        assert '/big' not in cache.entries
+
+    asyncio.run(main())
+
+
+def test_only_allowlisted_paths_are_served():
+    for path in ('/index.html', '/landing.html', '/world_data.json', '/src/main.js',
+                 '/src/engine/ModelLoader.js', '/samples/cube.obj'):
+        assert S.static_allowed(path), path
+    for path in ('/.session_secret', '/users.db', '/users.db-wal', '/world.log', '/world.json',
+                 '/online_server.py', '/requirements.txt', '/src/.env', '/samples/x.DB',
+                 '/src/../users.db', '/.git/config', '/srcx/main.js', '/index.html/'):
+        assert not S.static_allowed(path), path
+    assert S.parse_static_paths(' /a.html ; /b/ ;;') == ({'/a.html'}, ('/b/',))
+
+
+def test_serve_static_refuses_server_state():
+    async def status(path):
+        response = await S.serve_static(None, Request(path, websockets.Headers()), path)
+        return response.status_code
+    assert asyncio.run(status('/')) == 200
+    for path in ('/.session_secret', '/users.db', '/world.log', '/online_server.py'):
+        assert asyncio.run(status(path)) == 404, path
+
+
+def test_parse_range_single_spans():
+    assert S.parse_range('bytes=0-9', 100) == (0, 9)
+    assert S.parse_range('bytes=90-', 100) == (90, 99)
+    assert S.parse_range('bytes=50-500', 100) == (50, 99)   # end clamped to the file
+    assert S.parse_range('bytes=-10', 100) == (90, 99)      # suffix: last 10 bytes
+    assert S.parse_range('bytes=-500', 100) == (0, 99)      # suffix longer than the file
+
+
+def test_parse_range_unsatisfiable_and_ignored():
+    assert S.parse_range('bytes=100-', 100) is False
+    assert S.parse_range('bytes=200-300', 100) is False
+    assert S.parse_range('bytes=-0', 100) is False
+    for header in ('bytes=0-1,5-6', 'items=0-9', 'bytes=9-0', 'bytes=a-b', 'bytes=5', 'bytes=-'):
+        assert S.parse_range(header, 100) is None, header
+
+
+def test_if_range_mismatch_sends_the_whole_file():
+    def request(if_range):
+        return Request('/a', websockets.Headers({'Range': 'bytes=0-9', 'If-Range': if_range}))
+    assert S.request_range(request('"old"'), '"new"', 100) is None
+    assert S.request_range(request('"new"'), '"new"', 100) == (0, 9)
+    assert S.request_range(Request('/a', websockets.Headers()), '"new"', 100) is None
+
+
+def test_serve_static_partial_and_unsatisfiable():
+    body = (S.ROOT_DIR / 'index.html').read_bytes()
+
+    async def get(spec):
+        headers = websockets.Headers({'Range': spec})
+        return await S.serve_static(None, Request('/index.html', headers), '/index.html')
+
+    partial = asyncio.run(get('bytes=-16'))
+    assert partial.status_code == 206 and partial.body == body[-16:]
+    assert partial.headers['Content-Range'] == f'bytes {len(body) - 16}-{len(body) - 1}/{len(body)}'
+    refused = asyncio.run(get(f'bytes={len(body)}-'))
+    assert refused.status_code == 416
+    assert refused.headers['Content-Range'] == f'bytes */{len(body)}'
@@ -0,0 +1,60 @@
+import json
+
+import online_server as S
+
+
+class Box:
+    """Records what a room defers to one connection."""
+    def __init__(self):
+        self.deferred = []
+
+    def defer(self, payload, policy=S.RELIABLE, kind='other'):
+        self.deferred.append((kind, json.loads(payload)))
+        return True
+
+
+def test_topic_names_are_validated():
+    assert S.topic_name('chat') == 'chat'
+    assert S.topic_name('voice:Team A!') == 'voice:teama'
+    assert S.topic_name('chat:') == 'chat'
+    assert S.topic_name('admin') is None
+    assert S.topic_name(3) is None
+    assert S.topic_names(['chat', 'chat', 'nope', 'world', 'voice:x']) == ['chat', 'world', 'voice:x']
+    assert S.topic_names('chat') == []
+    assert len(S.topic_names([f'chat:{i}' for i in range(100)])) == len(S.TOPICS) * 4
+
+
+def test_subscriptions_and_cleanup():
+    topics = S.Topics()
+    assert topics.subscribe('1', ['chat', 'voice:a']) == ['chat', 'voice:a']
+    assert topics.subscribe('1', ['chat']) == []
+    topics.subscribe('2', ['chat'])
+    assert topics['chat'] == {'1', '2'} and topics['world'] == ()
+    topics.unsubscribe('1', ['voice:a', 'world'])
+    assert 'voice:a' not in topics.members
+    topics.drop('2')
+    assert topics.stats() == {'chat': 1} and '2' not in topics.of
+
+
+def test_room_broadcast_reaches_only_subscribers(game):
+    room = S.Room('lobby', game)
+    for pid in ('1', '2', '3'):
+        room.connections[pid] = Box()
+    room.topics.subscribe('1', ['chat'])
+    room.topics.subscribe('2', ['chat', 'chat:team'])
+
+    room.broadcast({'type': 'chat', 'message': 'hi'}, exclude='1', topic='chat')
+    room.broadcast({'type': 'chat', 'message': 'team'}, topic='chat:team')
+    room.broadcast({'type': 'player_leave', 'id': '9'})
+    got = {pid: [m.get('message', m['type']) for _, m in box.deferred] for pid, box in room.connections.items()}
+    assert got == {'1': ['player_leave'], '2': ['hi', 'team', 'player_leave'], '3': ['player_leave']}
+
+
+def test_subscribing_to_world_catches_up_on_the_editor_state(game):
+    game.world.edit('spawn', {'type': 'cube', 'pos': {'x': 1, 'y': 0, 'z': 0}})
+    room = S.Room('lobby', game)
+    room.connections['1'] = Box()
+    room.subscribe('1', ['world'])
+    (kind, message), = room.connections['1'].deferred
+    assert kind == 'world' and message['type'] == 'world'
+    assert [op['action'] for op in message['ops']] == ['spawn']
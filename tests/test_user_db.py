@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+
+import pytest
+
+import online_server as S
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(S, 'DB_PATH', tmp_path / 'users.db')
+    S.init_db()
+    return S.UserDB(pool_size=2)
+
+
+def test_hash_and_verify_password():
+    stored = S.hash_password('secret')
+    assert stored.startswith(f'scrypt${S.PASSWORD_KDF_N}$8$1$')
+    assert S.hash_password('secret') != stored  # salted
+    assert S.verify_password('secret', stored) == (True, False)
+    assert S.verify_password('wrong', stored) == (False, False)
+
+
+def test_legacy_and_outdated_hashes_need_a_rehash():
+    legacy = hashlib.sha256(b'secret').hexdigest()
+    assert S.verify_password('secret', legacy) == (True, True)
+    assert S.verify_password('nope', legacy) == (False, True)
+    weak = S.hash_password('secret').replace(f'scrypt${S.PASSWORD_KDF_N}$', 'scrypt$1024$', 1)
+    salt = bytes.fromhex(weak.split('$')[4])
+    digest = hashlib.scrypt(b'secret', salt=salt, n=1024, r=8, p=1, dklen=32).hex()
+    weak = weak.rsplit('$', 1)[0] + '$' + digest
+    assert S.verify_password('secret', weak) == (True, True)
+
+
+def test_register_and_login(db):
+    async def main():
+        user = await db.register('Ann@Example.com', 'pw', 'Ann')
+        assert user['name'] == 'Ann'
+        assert await db.register('ann@example.com', 'other') is None  # emails are case-insensitive
+        found = await db.login('ANN@example.com', 'pw')
+        assert found['id'] == user['id'] and found['email'] == 'ann@example.com'
+        assert await db.login('ann@example.com', 'bad') is None
+        assert await db.login('nobody@example.com', 'pw') is None
+    asyncio.run(main())
+
+
+def test_concurrent_writes_share_a_batch(db):
+    async def main():
+        sql = 'INSERT INTO users (email, password_hash, name) VALUES (?, ?, ?)'
+        results = await asyncio.gather(
+            *(db.write(sql, (f'u{i}@x.io', 'h', 'u')) for i in range(8)),
+            db.write(sql, ('u0@x.io', 'h', 'dup')),
+            return_exceptions=True)
+        return results, db.stats()
+    results, stats = asyncio.run(main())
+    assert sorted(results[:8]) == list(range(1, 9))
+    assert isinstance(results[8], S.sqlite3.IntegrityError)  # fails alone, the rest commit
+    assert stats == {'batches': 1, 'writes': 9, 'queued': 0}
+
+
+def test_legacy_hash_is_upgraded_in_the_background(db):
+    async def main():
+        legacy = hashlib.sha256(b'pw').hexdigest()
+        await db.write('INSERT INTO users (email, password_hash, name) VALUES (?, ?, ?)', ('old@x.io', legacy, 'old'))
+        assert await db.login('old@x.io', 'pw') is not None
+        assert db.tasks  # the upgrade is tracked until it finishes
+        while db.tasks:
+            await asyncio.gather(*db.tasks)
+        row = await db.read('SELECT password_hash FROM users WHERE email = ?', ('old@x.io',))
+        assert row[0].startswith('scrypt$')
+        assert await db.login('old@x.io', 'pw') is not None
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+import asyncio
+import base64
+import json
+
+import numpy as np
+
+import online_server as S
+
+
+def segment(x1, y1, x2, y2, color='#ff0000', size=4):
+    return {'type': 'line', 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2, 'color': color, 'size': size}
+
+
+def test_segments_coalesce_into_strokes_per_tick():
+    board = S.Whiteboard()
+    board.draw('1', segment(0, 0, 10, 0))
+    board.draw('1', segment(10, 0, 20, 5))
+    board.draw('1', segment(20, 5, 30, 5, color='#00ff00'))
+    board.draw('2', {'type': 'stroke', 'points': [1, 1, 2, 2, 3, 3], 'color': '#0000ff', 'size': 99})
+    strokes = board.flush()
+    assert [(s['id'], s['color'], s['points']) for s in strokes] == [
+        ('1', '#ff0000', [0, 0, 10, 0, 20, 5]),
+        ('1', '#00ff00', [20, 5, 30, 5]),
+        ('2', '#0000ff', [1, 1, 2, 2, 3, 3]),
+    ]
+    assert strokes[2]['size'] == S.WHITEBOARD_MAX_SIZE
+    assert board.flush() == []
+
+
+def test_bad_input_is_ignored_and_points_are_clamped():
+    board = S.Whiteboard()
+    board.draw('1', segment(0, 0, 1, 1, color='red'))
+    board.draw('1', {'type': 'stroke', 'points': [0, 0, 1], 'color': '#000000', 'size': 2})
+    board.draw('1', {'type': 'stroke', 'points': [0, 0, 'x', 1], 'color': '#000000', 'size': 2})
+    board.draw('1', {'type': 'clear'})
+    board.draw('1', 'nope')
+    assert board.flush() == []
+    board.draw('1', segment(-5, 10_000, 5000.4, 2.6))
+    assert board.flush()[0]['points'] == [0, S.WHITEBOARD_HEIGHT - 1, S.WHITEBOARD_WIDTH - 1, 3]
+
+
+def test_history_continues_strokes_across_ticks_for_joiners():
+    board = S.Whiteboard()
+    board.draw('1', segment(0, 0, 10, 0))
+    board.flush()
+    board.draw('1', segment(10, 0, 20, 0))
+    board.flush()
+    assert list(board.history) == [['#ff0000', 4, [0, 0, 10, 0, 20, 0]]]
+    assert board.points == 3
+    replay = board.replay_message()
+    assert board.replay_message() is replay  # cached until the board changes
+    assert json.loads(replay)['data'] == {'type': 'replay', 'raster': None,
+                                          'strokes': [['#ff0000', 4, [0, 0, 10, 0, 20, 0]]]}
+    board.forget('1')
+    board.draw('1', segment(20, 0, 30, 0))
+    board.flush()
+    assert len(board.history) == 2
+
+
+def test_ink_limit_drops_points_past_the_burst(monkeypatch):
+    monkeypatch.setattr(S, 'WHITEBOARD_INK_RATE', 0.0)
+    monkeypatch.setattr(S, 'WHITEBOARD_INK_BURST', 3)
+    board = S.Whiteboard()
+    board.draw('1', {'type': 'stroke', 'points': list(range(10)), 'color': '#000000', 'size': 1})
+    assert board.flush()[0]['points'] == [0, 1, 2, 3, 4, 5]
+    assert board.dropped == 2
+    board.draw('1', segment(0, 0, 1, 1))
+    assert board.flush() == [] and board.dropped == 4
+
+
+def test_old_history_is_folded_into_a_bitmap(monkeypatch):
+    monkeypatch.setattr(S, 'WHITEBOARD_HISTORY_POINTS', 8)
+
+    async def main():
+        board = S.Whiteboard()
+        for i in range(5):
+            board.draw(str(i), segment(10 * i, 10, 10 * i + 5, 10, size=3))
+        board.flush()
+        assert board.folding
+        while board.folding:
+            await asyncio.sleep(0.01)
+        return board
+
+    board = asyncio.run(main())
+    assert board.points <= 4 and len(board.history) == 2
+    raster = board.raster_json
+    runs = np.frombuffer(base64.b64decode(raster['runs']), '<u4')
+    values = np.frombuffer(base64.b64decode(raster['values']), '<u4')
+    assert runs.sum() == raster['w'] * raster['h']
+    pixels = np.repeat(values, runs).reshape(raster['h'], raster['w'])
+    assert pixels[10, 2] == S.RASTER_OPAQUE | 0x0000FF  # red, stored ABGR
+    assert pixels[10, 45] == 0  # still a live stroke, not folded
+    assert json.loads(board.replay_message())['data']['raster'] == raster
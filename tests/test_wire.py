@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+
+import online_server as S
+
+
+def test_state_frame_layout():
+    store = S.PlayerStore()
+    store.add('7', {'name': 'a'}, 1.5, 0.25, -2.0, ry=math.pi / 2, anim='walk')
+    store.add('9', {'name': 'b'}, 600.0, 0, 0, ry=-math.pi / 2)
+    records = S.player_records(store, np.array([0, 1]))
+    frame = S.encode_state(5, 3, 120, 1234.5, records, np.array([4, 11], np.uint32))
+
+    kind, seq, base, tick, ms, count, gone = S.STATE_HEADER.unpack_from(frame)
+    assert (kind, seq, base, tick, ms, count, gone) == (S.MSG_STATE, 5, 3, 120, 1234.5, 2, 2)
+    body = np.frombuffer(frame, S.PLAYER_RECORD, count, S.STATE_HEADER.size)
+    assert body['id'].tolist() == [7, 9]
+    assert body['x'][0] / S.POS_SCALE == 1.5
+    assert body['y'][0] / S.POS_SCALE == 0.25
+    assert body['z'][0] / S.POS_SCALE == -2.0
+    assert body['x'][1] == 32767  # clamped to the int16 range
+    assert abs(body['ry'][0] / S.RY_SCALE - math.pi / 2) < 1e-4
+    assert body['ry'][1] == -16384
+    assert body['anim'].tolist() == [S.ANIM_INDEX['walk'], S.ANIM_INDEX['idle']]
+    tail = np.frombuffer(frame, '<u4', offset=S.STATE_HEADER.size + count * S.PLAYER_RECORD.itemsize)
+    assert tail.tolist() == [4, 11]
+
+
+def test_quantize_ry_wraps_into_range():
+    ry = np.array([0.0, math.tau + 0.5, -math.tau - 0.5], np.float32)
+    assert np.allclose(S.quantize_ry(ry) / S.RY_SCALE, [0.0, 0.5, -0.5], atol=1e-4)
+
+
+def test_decode_move_round_trip():
+    packed = S.MOVE_RECORD.pack(S.MSG_MOVE, 64, 0, -128, int(S.RY_SCALE), S.ANIM_INDEX['run'], 17, 42)
+    move = S.decode_move(packed)
+    assert move['x'] == 1.0 and move['y'] == 0.0 and move['z'] == -2.0
+    assert abs(move['ry'] - 1.0) < 1e-4
+    assert move['anim'] == 'run'
+    assert (move['ack'], move['seq']) == (17, 42)
+
+
+def test_decode_move_accepts_old_clients_without_seq():
+    move = S.decode_move(S.MOVE_RECORD_V0.pack(S.MSG_MOVE, 0, 0, 0, 0, 0, 3))
+    assert move['ack'] == 3
+    assert 'seq' not in move
+
+
+def test_decode_move_rejects_malformed_frames():
+    good = S.MOVE_RECORD.pack(S.MSG_MOVE, 0, 0, 0, 0, 0, 0, 0)
+    assert S.decode_move(b'') is None
+    assert S.decode_move(bytes([S.MSG_STATE]) + good[1:]) is None
+    assert S.decode_move(good[:-1]) is None
+    assert S.decode_move(S.MOVE_RECORD.pack(S.MSG_MOVE, 0, 0, 0, 0, 250, 0, 0))['anim'] == 'idle'
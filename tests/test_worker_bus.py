@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import numpy as np
+
+import online_server as S
+
+
+def test_frames_round_trip():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(S.pack_frame(S.BUS_JSON, b'{"op": "x"}') + S.pack_frame(S.BUS_STATE, b'\x01\x02'))
+        reader.feed_eof()
+        return [await S.read_frame(reader), await S.read_frame(reader)]
+    assert asyncio.run(main()) == [(S.BUS_JSON, b'{"op": "x"}'), (S.BUS_STATE, b'\x01\x02')]
+
+
+def test_hub_relays_between_workers_and_announces_down(tmp_path):
+    path = str(tmp_path / 'bus.sock')
+    got = {0: [], 1: []}
+
+    def on_frame(worker):
+        def handle(kind, payload):
+            got[worker].append(json.loads(payload) if kind == S.BUS_JSON else np.frombuffer(payload, S.BUS_RECORD))
+        return handle
+
+    def messages(worker):
+        return [m for m in got[worker] if isinstance(m, dict)]
+
+    async def until(predicate):
+        for _ in range(200):
+            if predicate():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError('timed out')
+
+    async def main():
+        hub = S.BusHub(path)
+        server = await hub.start()
+        buses = [S.WorkerBus(w, on_frame(w), path) for w in (0, 1)]
+        tasks = [asyncio.create_task(bus.run()) for bus in buses]
+        await until(lambda: sorted(w for w in hub.peers.values() if w is not None) == [0, 1])
+
+        buses[0].publish({'op': 'load', 'worker': 0, 'connections': 3})
+        records = np.zeros(2, S.BUS_RECORD)
+        records['id'] = [5, 9]
+        buses[0].publish_state(records)
+        await until(lambda: len([m for m in got[1] if not isinstance(m, dict)]) == 1)
+        assert {'op': 'load', 'worker': 0, 'connections': 3} in messages(1)
+        assert got[1][-1]['id'].tolist() == [5, 9]
+        assert hub.load == {0: 3}
+        assert all(m['op'] != 'load' for m in messages(0))  # not echoed back
+
+        tasks[0].cancel()
+        buses[0].writer.close()
+        await until(lambda: {'op': 'down', 'worker': 0} in messages(1))
+        assert hub.load == {}
+        tasks[1].cancel()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_a_crashed_bus_task_is_logged_and_fails_the_worker(game, tmp_path, monkeypatch):
+    logged = []
+    monkeypatch.setattr(S, 'log', lambda event, template, **fields: logged.append((event, fields['task'])))
+
+    def on_frame(kind, payload):
+        raise KeyError('op')
+
+    async def preconvert():
+        raise OSError('disk full')
+
+    async def main():
+        async def hub(reader, writer):
+            writer.write(S.pack_frame(S.BUS_JSON, b'{}'))
+            await reader.read()
+
+        path = str(tmp_path / 'bus.sock')
+        server = await asyncio.start_unix_server(hub, path)
+        game.start_task(preconvert(), essential=False)
+        game.start_task(S.WorkerBus(0, on_frame, path).run())
+        await asyncio.wait_for(game.failed.wait(), 1)
+        server.close()
+        return len(game.tasks)
+
+    assert asyncio.run(main()) == 0
+    assert [task.rsplit('.', 1)[-1] for _, task in logged] == ['preconvert', 'run']
+    assert logged[1] == ('task_error', 'WorkerBus.run')
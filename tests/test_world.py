@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import online_server as S
+
+
+def spawn(x, kind='cube'):
+    return {'type': kind, 'pos': {'x': x, 'y': 0, 'z': 0}}
+
+
+async def settle(world_log):
+    """Flush pending ops and wait for the writer thread to finish everything queued."""
+    world_log.flush()
+    await asyncio.wrap_future(world_log.writer.submit(lambda: None))
+
+
+def reload(tmp_path):
+    world_log = S.WorldLog(tmp_path / 'world.log', tmp_path / 'world.json')
+    world = S.WorldState(world_log)
+    world.restore(*world_log.load())
+    return world
+
+
+def test_edits_are_validated():
+    world = S.WorldState()
+    assert world.edit('spawn', {'type': 'cube'}) is None  # no position
+    assert world.edit('spawn', {'type': 'cube', 'pos': {'x': 'nan', 'y': 0, 'z': 0}}) is None
+    assert world.edit('explode', spawn(0)) is None
+    op = world.edit('spawn', spawn(1))
+    assert op == {'seq': 1, 'action': 'spawn', 'oid': 1, 'data': {
+        'type': 'cube', 'pos': {'x': 1.0, 'y': 0.0, 'z': 0.0},
+        'rot': {'x': 0.0, 'y': 0.0, 'z': 0.0}, 'scl': {'x': 1.0, 'y': 1.0, 'z': 1.0}}}
+    assert world.edit('move', {'oid': 1}) is None  # nothing to change
+    assert world.edit('move', {'oid': 9, 'pos': {'x': 0, 'y': 0, 'z': 0}}) is None
+    assert world.edit('move', {'index': 0, 'pos': {'x': 5, 'y': 0, 'z': 0}})['oid'] == 1
+    assert world.objects[1]['pos']['x'] == 5.0
+    assert world.edit('delete', {'oid': 1})['seq'] == 3
+    assert not world.objects
+
+
+def test_followers_replay_only_the_next_op():
+    leader, follower = S.WorldState(), S.WorldState()
+    ops = [leader.edit('spawn', spawn(i)) for i in range(3)]
+    assert not follower.replay(ops[1])
+    assert all(follower.replay(op) for op in ops)
+    assert not follower.replay(ops[2])  # already applied
+    assert follower.objects == leader.objects and follower.seq == 3
+
+
+def test_log_replays_after_a_restart_and_drops_a_torn_tail(tmp_path):
+    async def main():
+        world = reload(tmp_path)
+        world.edit('spawn', spawn(1))
+        world.edit('spawn', spawn(2))
+        world.edit('move', {'oid': 1, 'pos': {'x': 9, 'y': 0, 'z': 0}})
+        await settle(world.log)
+        return world
+
+    world = asyncio.run(main())
+    with open(tmp_path / 'world.log', 'ab') as f:
+        f.write(b'{"seq": 4, "action": "spa')  # crash mid-write
+    restored = reload(tmp_path)
+    assert restored.objects == world.objects and restored.seq == 3
+    assert (tmp_path / 'world.log').read_bytes().endswith(b'}\n')
+    assert restored.next_oid == 3
+
+
+def test_world_files_default_outside_the_web_root(tmp_path):
+    for path in (S.WORLD_LOG_PATH, S.WORLD_SNAPSHOT_PATH):
+        assert not path.resolve().is_relative_to(S.ROOT_DIR)
+    state = tmp_path / 'state'
+    world_log = S.WorldLog(state / 'world.log', state / 'world.json')
+    assert world_log.load()[1] == [] and (state / 'world.log').is_file()
+    world_log.file.close()
+
+
+def test_compaction_folds_the_log_into_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(S, 'WORLD_COMPACT_OPS', 3)
+
+    async def main():
+        world = reload(tmp_path)
+        for i in range(3):
+            world.edit('spawn', spawn(i))
+        await settle(world.log)
+        await asyncio.sleep(0)  # let the compaction callback run
+        assert not world.compacting
+        assert world.snapshot_seq == 3 and world.tail == []
+        assert (tmp_path / 'world.log').read_bytes() == b''
+        assert json.loads((tmp_path / 'world.json').read_text())['seq'] == 3
+
+        world.edit('delete', {'oid': 2})
+        await settle(world.log)
+        message = json.loads(world.join_message())
+        assert message['seq'] == 3 and len(message['objects']) == 3
+        assert [op['seq'] for op in message['ops']] == [4]
+        return world
+
+    world = asyncio.run(main())
+    restored = reload(tmp_path)
+    assert restored.objects == world.objects
+    assert restored.seq == 4 and restored.snapshot_seq == 3
+
+
+def test_restore_assigns_ids_to_old_snapshots():
+    world = S.WorldState()
+    world.restore({'seq': 7, 'objects': [spawn(1), {**spawn(2), 'oid': 5}, {'type': 'bad'}]})
+    assert sorted(world.objects) == [1, 5]
+    assert world.next_oid == 6 and world.seq == 7